@@ -0,0 +1,105 @@
+"""Compare the SDPA and eager ``CodeEncoder`` attention paths.
+
+Each (implementation, sequence length) case runs a forward + backward pass in
+a fresh process so the peak resident set size on CPU belongs to that case
+alone; on CUDA the peak allocated memory is reported instead. Cases that run
+out of memory are reported as failed rather than aborting the sweep::
+
+    python -m benchmarks.attention --seq-lens 2048 8192 14336
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import torch
+
+from benchmarks.common import peak_memory_mb, run_isolated
+from src.training.config import EncoderConfig
+from src.training.encoder import CodeEncoder
+
+
+@dataclass
+class AttentionResult:
+    implementation: str
+    seq_len: int
+    seconds: Optional[float]
+    peak_mb: Optional[float]
+    error: Optional[str] = None
+
+
+def _run_case(args: argparse.Namespace, implementation: str, seq_len: int) -> AttentionResult:
+    torch.manual_seed(0)
+    device = torch.device(args.device)
+    config = EncoderConfig(
+        hidden_size=args.hidden_size,
+        num_layers=args.num_layers,
+        num_attention_heads=args.num_heads,
+        intermediate_size=4 * args.hidden_size,
+        dropout=0.0,
+        max_position_embeddings=max(seq_len, 2),
+        attention_implementation=implementation,
+    )
+    model = CodeEncoder(config, vocab_size=args.vocab_size, use_flash_attention=not args.math_only).to(device)
+    input_ids = torch.randint(0, args.vocab_size, (args.batch_size, seq_len), device=device)
+
+    def step() -> None:
+        model.zero_grad(set_to_none=True)
+        model(input_ids).float().pow(2).mean().backward()
+
+    step()  # warm-up
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    started = time.perf_counter()
+    for _ in range(args.repeats):
+        step()
+    peak = peak_memory_mb(device)
+    seconds = (time.perf_counter() - started) / args.repeats
+    return AttentionResult(implementation, seq_len, seconds, peak)
+
+
+def run(args: argparse.Namespace) -> List[AttentionResult]:
+    results: List[AttentionResult] = []
+    for seq_len in args.seq_lens:
+        for implementation in args.implementations:
+            result, error = run_isolated(_run_case, args, implementation, seq_len)
+            if error:
+                result = AttentionResult(implementation, seq_len, None, None, error=error)
+            results.append(result)
+            if result.error:
+                print(f"{implementation:>6} T={seq_len:<6} failed ({result.error})", flush=True)
+            else:
+                print(
+                    f"{implementation:>6} T={seq_len:<6} {result.seconds * 1000:10.1f} ms/step"
+                    f" {result.peak_mb:10.1f} MiB peak",
+                    flush=True,
+                )
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[2048, 8192, 14336])
+    parser.add_argument("--implementations", nargs="+", default=["sdpa", "eager"], choices=["sdpa", "eager"])
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--num-heads", type=int, default=4)
+    parser.add_argument("--num-layers", type=int, default=2)
+    parser.add_argument("--vocab-size", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--math-only", action="store_true", help="Pin SDPA to the reference math kernel.")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+    results = run(args)
+    if args.json_path:
+        with open(args.json_path, "w") as handle:
+            json.dump([asdict(result) for result in results], handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Peak memory versus step time for the custom model's checkpointing policies.
+
+Every policy trains the same ``CodexLikeCausalLM`` for a few forward +
+backward steps in its own process::
+
+    python -m benchmarks.checkpointing --seq-len 4096 --num-layers 8
+
+On CPU, ``offload`` has nothing to move and mainly shows its copy overhead;
+run with ``--device cuda`` to see device memory drop.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import List, Optional
+
+import torch
+
+from benchmarks.common import SizedVocab, peak_memory_mb, run_isolated
+from src.training.config import DecoderConfig, EncoderConfig, ModelConfig
+from src.training.modeling import CodexLikeCausalLM
+
+# (label, checkpoint_policy or None, offload_activations)
+POLICIES = [
+    ("none", None, False),
+    ("all", "all", False),
+    ("every_k", "every_k", False),
+    ("attention", "attention", False),
+    ("mlp", "mlp", False),
+    ("all+offload", "all", True),
+    ("none+offload", None, True),
+]
+
+
+@dataclass
+class CheckpointResult:
+    policy: str
+    seconds: Optional[float]
+    peak_mb: Optional[float]
+    error: Optional[str] = None
+
+
+def _run_case(args: argparse.Namespace, policy: Optional[str], offload: bool) -> CheckpointResult:
+    torch.manual_seed(0)
+    device = torch.device(args.device)
+    config = ModelConfig(
+        use_custom_architecture=True,
+        gradient_checkpointing=policy is not None,
+        checkpoint_policy=policy or "all",
+        checkpoint_every=args.every,
+        offload_activations=offload,
+        encoder=EncoderConfig(
+            hidden_size=args.hidden_size,
+            num_layers=args.num_layers,
+            num_attention_heads=args.num_heads,
+            intermediate_size=4 * args.hidden_size,
+            dropout=0.0,
+            max_position_embeddings=args.seq_len,
+        ),
+        decoder=DecoderConfig(hidden_size=args.hidden_size, loss_chunk_size=args.loss_chunk_size),
+    )
+    model = CodexLikeCausalLM(config, SizedVocab(args.vocab_size)).to(device).train()
+    if policy is not None:
+        model.gradient_checkpointing_enable()
+    elif offload:
+        # Offloading alone: keep every activation but park it in CPU memory.
+        model.encoder.offload_activations = True
+    input_ids = torch.randint(0, args.vocab_size, (args.batch_size, args.seq_len), device=device)
+
+    def step() -> None:
+        model.zero_grad(set_to_none=True)
+        model(input_ids, labels=input_ids).loss.backward()
+
+    step()  # warm-up
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    started = time.perf_counter()
+    for _ in range(args.repeats):
+        step()
+    peak = peak_memory_mb(device)
+    return CheckpointResult("", (time.perf_counter() - started) / args.repeats, peak)
+
+
+def run(args: argparse.Namespace) -> List[CheckpointResult]:
+    results: List[CheckpointResult] = []
+    for label, policy, offload in POLICIES:
+        if args.policies and label not in args.policies:
+            continue
+        result, error = run_isolated(_run_case, args, policy, offload)
+        result = CheckpointResult(label, None, None, error) if error else replace(result, policy=label)
+        results.append(result)
+        if result.error:
+            print(f"{label:>13} failed ({result.error})", flush=True)
+        else:
+            print(f"{label:>13} {result.seconds * 1000:10.1f} ms/step {result.peak_mb:10.1f} MiB peak", flush=True)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--policies", nargs="+", choices=[label for label, _, _ in POLICIES])
+    parser.add_argument("--seq-len", type=int, default=2048)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--num-heads", type=int, default=4)
+    parser.add_argument("--num-layers", type=int, default=8)
+    parser.add_argument("--every", type=int, default=2, help="Layer stride for the every_k policy.")
+    parser.add_argument("--vocab-size", type=int, default=1024)
+    parser.add_argument("--loss-chunk-size", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+    results = run(args)
+    if args.json_path:
+        with open(args.json_path, "w") as handle:
+            json.dump([asdict(result) for result in results], handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
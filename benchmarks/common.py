@@ -0,0 +1,52 @@
+"""Helpers shared by the benchmark scripts."""
+from __future__ import annotations
+
+import multiprocessing as mp
+import resource
+import sys
+from typing import Any, Callable, Optional, Tuple
+
+import torch
+
+
+def peak_memory_mb(device: torch.device) -> float:
+    """Peak allocated CUDA memory, or the process's peak resident set size on CPU."""
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() / 2**20
+    # ``ru_maxrss`` is KiB on Linux and bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+class SizedVocab:
+    """Stands in for a tokenizer where a model only needs ``len(tokenizer)``."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def _call(target: Callable[..., Any], args: tuple, queue) -> None:
+    queue.put(target(*args))
+
+
+def run_isolated(target: Callable[..., Any], *args: Any) -> Tuple[Optional[Any], Optional[str]]:
+    """Run ``target(*args)`` in a fresh spawned process and return ``(result, error)``.
+
+    A separate process per case keeps peak-RSS measurements independent, and a
+    case killed for running out of memory is reported instead of ending the
+    sweep. Results must be small picklable objects.
+    """
+
+    context = mp.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_call, args=(target, args, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0 or queue.empty():
+        return None, f"exit code {process.exitcode}"
+    return queue.get(), None
@@ -0,0 +1,146 @@
+"""Recall@k and query latency of the IVF retrieval index against brute force.
+
+Fills an :class:`EmbeddingStore` with synthetic unit vectors, drawn as noisy
+copies of random cluster centres the way embeddings of related commands
+bunch together. It builds an :class:`IVFIndex` over the store and then
+adds ``--incremental`` more vectors without retraining. For each ``nprobe``
+it reports recall@k against exact search and the p50/p99 latency of
+single-query searches. ``--embed-texts`` also times how fast a small random
+``CodeEncoder`` embeds synthetic records::
+
+    python -m benchmarks.retrieval --vectors 1000000 --dim 256 --dtype int8 --nprobe 8 16 32 64
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+from benchmarks.common import SizedVocab
+from src.training.config import DecoderConfig, EncoderConfig, ModelConfig, RetrievalConfig
+from src.training.modeling import CodexLikeCausalLM
+from src.training.retrieval import EmbeddingStore, build_index, embed_texts, evaluate_index
+
+
+@dataclass
+class RetrievalResult:
+    vectors: int
+    dtype: str
+    nprobe: int
+    k: int
+    recall: float
+    p50_ms: float
+    p99_ms: float
+    brute_force_ms: float
+
+
+def _synthetic(rng: np.random.Generator, centres: np.ndarray, count: int, noise: float) -> np.ndarray:
+    vectors = centres[rng.integers(0, len(centres), count)]
+    vectors = vectors + noise * rng.standard_normal(vectors.shape, dtype=np.float32) / np.sqrt(centres.shape[1])
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class _CharTokenizer:
+    """Byte-level stand-in for a trained tokenizer; only padding/truncation are needed."""
+
+    padding_side = "right"
+
+    def __call__(self, texts, padding=True, truncation=True, max_length=256, return_tensors="pt"):
+        encoded = [list(text.encode()[:max_length]) or [0] for text in texts]
+        width = max(len(ids) for ids in encoded)
+        input_ids = torch.zeros(len(encoded), width, dtype=torch.long)
+        attention_mask = torch.zeros(len(encoded), width, dtype=torch.long)
+        for row, ids in enumerate(encoded):
+            input_ids[row, : len(ids)] = torch.tensor(ids)
+            attention_mask[row, : len(ids)] = 1
+        from transformers import BatchEncoding
+
+        return BatchEncoding({"input_ids": input_ids, "attention_mask": attention_mask})
+
+
+def _embedding_throughput(args: argparse.Namespace) -> float:
+    config = ModelConfig(
+        use_custom_architecture=True,
+        gradient_checkpointing=False,
+        encoder=EncoderConfig(hidden_size=args.dim, num_layers=2, num_attention_heads=4, intermediate_size=4 * args.dim, dropout=0.0, max_position_embeddings=256),
+        decoder=DecoderConfig(hidden_size=args.dim),
+    )
+    torch.manual_seed(0)
+    model = CodexLikeCausalLM(config, SizedVocab(256)).eval()
+    texts = [f"# list files in directory {index}\nls -la /var/log/app{index} | grep -i error" for index in range(args.embed_texts)]
+    started = time.perf_counter()
+    embed_texts(model, _CharTokenizer(), texts, batch_size=64, max_length=128)
+    return args.embed_texts / (time.perf_counter() - started)
+
+
+def run(args: argparse.Namespace) -> List[RetrievalResult]:
+    torch.set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+    centres = rng.standard_normal((args.clusters, args.dim), dtype=np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    results: List[RetrievalResult] = []
+    with tempfile.TemporaryDirectory() as workdir:
+        store = EmbeddingStore(workdir, dim=args.dim, dtype=args.dtype)
+        started = time.perf_counter()
+        for offset in range(0, args.vectors, 100_000):
+            store.append(_synthetic(rng, centres, min(100_000, args.vectors - offset), args.noise))
+        print(f"stored {len(store)} vectors in {time.perf_counter() - started:.1f}s", flush=True)
+
+        config = RetrievalConfig(num_lists=args.num_lists, kmeans_iterations=args.kmeans_iterations, seed=args.seed)
+        started = time.perf_counter()
+        index = build_index(store, config)
+        print(f"built {index.num_lists}-list index in {time.perf_counter() - started:.1f}s", flush=True)
+        if args.incremental:
+            store.append(_synthetic(rng, centres, args.incremental, args.noise))
+            started = time.perf_counter()
+            build_index(store, config, index)
+            elapsed = time.perf_counter() - started
+            print(f"added {args.incremental} vectors in {elapsed:.2f}s ({args.incremental / elapsed:.0f}/s)", flush=True)
+
+        queries = _synthetic(rng, centres, args.queries, args.noise)
+        for nprobe in args.nprobe:
+            metrics = evaluate_index(index, store, queries, k=args.k, nprobe=nprobe)
+            result = RetrievalResult(vectors=len(store), dtype=args.dtype, **metrics)
+            results.append(result)
+            print(
+                f"nprobe={nprobe:<4} recall@{args.k} {result.recall:.3f}  p50 {result.p50_ms:7.2f} ms"
+                f"  p99 {result.p99_ms:7.2f} ms  brute force {result.brute_force_ms:8.2f} ms/query",
+                flush=True,
+            )
+    if args.embed_texts:
+        print(f"embedding: {_embedding_throughput(args):.1f} records/s (random {args.dim}-d CodeEncoder)", flush=True)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=1_000_000)
+    parser.add_argument("--incremental", type=int, default=50_000, help="Vectors added after the index is built.")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--dtype", choices=["float32", "int8"], default="float32")
+    parser.add_argument("--clusters", type=int, default=10_000)
+    parser.add_argument("--noise", type=float, default=1.0, help="Spread of vectors around their cluster centre.")
+    parser.add_argument("--num-lists", type=int, default=None, help="Default: 4 * sqrt(vectors).")
+    parser.add_argument("--kmeans-iterations", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--embed-texts", type=int, default=0, help="Also time embedding this many synthetic records.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+    results = run(args)
+    if args.json_path:
+        with open(args.json_path, "w") as handle:
+            json.dump([asdict(result) for result in results], handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Load test for the continuous-batching completion server.
+
+Sweeps client concurrency and reports per-request latency, time to first
+token and aggregate generated tokens per second. Without ``--url`` a server
+is started in-process around ``--checkpoint`` or, by default, a randomly
+initialised custom model with a throwaway tokenizer trained on the sample
+data::
+
+    python -m benchmarks.serving --concurrency 1 4 16 --max-tokens 64
+    python -m benchmarks.serving --url http://127.0.0.1:8000 --concurrency 1 8 32
+
+``--shared-prefix-repeats`` puts a long common prefix in front of every
+prompt; compare runs with ``--prefix-cache-mb 0`` to see what prefix caching
+saves. The reported prefix hit rate is cumulative over the server's life.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import torch
+
+from src.training.config import (
+    DecoderConfig,
+    EncoderConfig,
+    ModelConfig,
+    ServingConfig,
+    TokenizerConfig,
+    default_training_config,
+)
+from src.training.modeling import CodexLikeCausalLM, build_tokenizer
+from src.training.serving import CompletionServer, build_engine, load_serving_model
+from src.training.tokenizer import build_custom_tokenizer
+
+SAMPLE_DATA = Path(__file__).resolve().parent.parent / "data" / "jsonl" / "terminal_commands_sample.jsonl"
+
+
+@dataclass
+class ServingResult:
+    concurrency: int
+    requests: int
+    rejected: int
+    p50_latency_ms: Optional[float]
+    p99_latency_ms: Optional[float]
+    p50_ttft_ms: Optional[float]
+    p99_ttft_ms: Optional[float]
+    tokens_per_second: float
+    prefix_token_hit_rate: Optional[float] = None
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def _sample_prompts(shared_prefix_repeats: int = 0) -> List[str]:
+    """One prompt per sample record, optionally behind a shared "file" made of every command."""
+
+    records = [json.loads(line) for line in SAMPLE_DATA.read_text().splitlines() if line.strip()]
+    prefix = "".join(f"{record['command']}\n" for record in records) * shared_prefix_repeats
+    return [f"{prefix}# {record['description']}\n" for record in records]
+
+
+async def _prefix_token_hit_rate(host: str, port: int) -> Optional[float]:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET /health HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    prefix_cache = json.loads(response.split(b"\r\n\r\n", 1)[1]).get("prefix_cache")
+    return prefix_cache["token_hit_rate"] if prefix_cache else None
+
+
+async def _complete(host: str, port: int, payload: dict) -> Tuple[Optional[float], Optional[float], int]:
+    """Stream one completion; returns ``(latency, ttft, tokens)`` or ``(None, None, 0)`` if rejected."""
+
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps({**payload, "stream": True}).encode()
+    writer.write(
+        f"POST /v1/completions HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    status = (await reader.readline()).split()
+    ttft, tokens = None, 0
+    try:
+        if len(status) < 2 or status[1] != b"200":
+            return None, None, 0
+        # Chunk-size lines never start with ``data:``, so SSE events can be read line by line.
+        while line := await reader.readline():
+            if not line.startswith(b"data: "):
+                continue
+            data = line[6:].strip()
+            if data == b"[DONE]":
+                break
+            if json.loads(data).get("token") is not None:
+                tokens += 1
+                ttft = ttft if ttft is not None else time.perf_counter() - started
+        return time.perf_counter() - started, ttft, tokens
+    finally:
+        writer.close()
+
+
+async def _run_level(host: str, port: int, prompts: List[str], args: argparse.Namespace, concurrency: int) -> ServingResult:
+    total = args.requests or 4 * concurrency
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    generated = rejected = 0
+    pending = iter(range(total))
+
+    async def client() -> None:
+        nonlocal generated, rejected
+        for index in pending:
+            payload = {"prompt": prompts[index % len(prompts)], "max_tokens": args.max_tokens, "temperature": args.temperature}
+            latency, ttft, tokens = await _complete(host, port, payload)
+            if latency is None:
+                rejected += 1
+                continue
+            latencies.append(latency * 1000)
+            if ttft is not None:
+                ttfts.append(ttft * 1000)
+            generated += tokens
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return ServingResult(
+        concurrency=concurrency,
+        requests=total,
+        rejected=rejected,
+        p50_latency_ms=_percentile(latencies, 50),
+        p99_latency_ms=_percentile(latencies, 99),
+        p50_ttft_ms=_percentile(ttfts, 50),
+        p99_ttft_ms=_percentile(ttfts, 99),
+        tokens_per_second=generated / elapsed,
+        prefix_token_hit_rate=await _prefix_token_hit_rate(host, port),
+    )
+
+
+def _random_model(args: argparse.Namespace, workdir: str):
+    texts = [
+        text
+        for record in map(json.loads, SAMPLE_DATA.read_text().splitlines())
+        for text in (record["description"], record["command"])
+    ]
+    tokenizer_config = TokenizerConfig(use_custom=True, vocab_size=args.vocab_size, min_frequency=1, serialization_dir=workdir)
+    build_custom_tokenizer(tokenizer_config, corpus=texts * 20)
+    tokenizer = build_tokenizer(replace(tokenizer_config, use_custom=False, pretrained=workdir))
+    config = ModelConfig(
+        use_custom_architecture=True,
+        gradient_checkpointing=False,
+        encoder=EncoderConfig(
+            hidden_size=args.hidden_size,
+            num_layers=args.num_layers,
+            num_attention_heads=args.num_heads,
+            intermediate_size=4 * args.hidden_size,
+            dropout=0.0,
+            max_position_embeddings=args.max_sequence_length,
+        ),
+        decoder=DecoderConfig(hidden_size=args.hidden_size),
+    )
+    torch.manual_seed(0)
+    return CodexLikeCausalLM(config, tokenizer).eval(), tokenizer
+
+
+async def _run(args: argparse.Namespace) -> List[ServingResult]:
+    prompts = _sample_prompts(args.shared_prefix_repeats)
+    server = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            if args.checkpoint:
+                model, tokenizer = load_serving_model(default_training_config(), args.checkpoint, args.tokenizer)
+            else:
+                model, tokenizer = _random_model(args, workdir)
+        config = ServingConfig(
+            port=0,
+            max_batch_size=args.max_batch_size,
+            max_queue_size=args.max_queue_size,
+            max_sequence_length=args.max_sequence_length,
+            max_new_tokens=args.max_tokens,
+            prefix_cache_mb=args.prefix_cache_mb,
+        )
+        server = CompletionServer(build_engine(model, tokenizer, config), tokenizer, config)
+        host, port = (await server.start()).sockets[0].getsockname()[:2]
+
+    results: List[ServingResult] = []
+    try:
+        for concurrency in args.concurrency:
+            result = await _run_level(host, port, prompts, args, concurrency)
+            results.append(result)
+            print(
+                f"c={concurrency:<4} {result.requests:5d} req {result.rejected:4d} rejected"
+                f"  latency p50 {result.p50_latency_ms or 0:8.1f} ms p99 {result.p99_latency_ms or 0:8.1f} ms"
+                f"  ttft p50 {result.p50_ttft_ms or 0:8.1f} ms p99 {result.p99_ttft_ms or 0:8.1f} ms"
+                f"  {result.tokens_per_second:8.1f} tok/s"
+                + (f"  prefix hits {result.prefix_token_hit_rate:.0%}" if result.prefix_token_hit_rate is not None else ""),
+                flush=True,
+            )
+    finally:
+        if server is not None:
+            await server.close()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Benchmark a running server instead of starting one.")
+    parser.add_argument("--checkpoint", help="Custom-model checkpoint for the in-process server.")
+    parser.add_argument("--tokenizer", help="Tokenizer directory for --checkpoint.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=None, help="Requests per level (default: 4 x concurrency).")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-queue-size", type=int, default=64)
+    parser.add_argument("--max-sequence-length", type=int, default=512)
+    parser.add_argument("--prefix-cache-mb", type=float, default=1024.0, help="0 disables prefix caching.")
+    parser.add_argument(
+        "--shared-prefix-repeats",
+        type=int,
+        default=0,
+        help="Prepend every sample command this many times to each prompt to model a shared file prefix.",
+    )
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--num-heads", type=int, default=4)
+    parser.add_argument("--num-layers", type=int, default=4)
+    parser.add_argument("--vocab-size", type=int, default=1024)
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+    results = asyncio.run(_run(args))
+    if args.json_path:
+        with open(args.json_path, "w") as handle:
+            json.dump([asdict(result) for result in results], handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""Offline regression suite for the data pipeline and the custom model.
+
+Benchmarks ``CodePreprocessor`` (fused and legacy normalizers, on records
+and on code-heavy source files), ``CodeChunker`` (character and token
+windows), ``CodeTokenizer`` training and encoding, ``interleave_weighted``
+and ``CodexLikeCausalLM.forward`` at several input sizes. Inputs are built
+from the checked-in samples under ``data/`` plus synthetic source files, and
+the model is tiny, so the whole suite runs on a CPU-only machine without
+network access. Every case runs in its own process; besides throughput it
+reports the process's peak RSS and how far the measured work raised it::
+
+    python -m benchmarks.suite run --sizes small medium --json before.json
+    python -m benchmarks.suite run --sizes small medium --json after.json
+    python -m benchmarks.suite compare before.json after.json --threshold 0.1
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+from benchmarks.common import SizedVocab, peak_memory_mb, run_isolated
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+SIZES = {"small": 1, "medium": 4, "large": 16}
+
+# A setup returns ``(work, items, bytes, unit)``: ``work()`` is timed and
+# processes ``items`` units totalling ``bytes`` of input.
+Setup = Callable[[int], Tuple[Callable[[], object], int, int, str]]
+
+
+@dataclass
+class SuiteResult:
+    component: str
+    size: str
+    items: int
+    unit: str
+    seconds: Optional[float]
+    items_per_second: Optional[float]
+    bytes_per_second: Optional[float]
+    peak_mb: Optional[float]
+    work_mb: Optional[float]
+    error: Optional[str] = None
+
+
+def _sample_records() -> List[Dict[str, str]]:
+    """Description/command pairs from both checked-in sample files."""
+
+    records = [json.loads(line) for line in (DATA_DIR / "jsonl" / "terminal_commands_sample.jsonl").read_text().splitlines() if line.strip()]
+    with open(DATA_DIR / "csv" / "terminal_commands_sample.csv", newline="") as handle:
+        records += list(csv.DictReader(handle))
+    return [{"text": record["description"], "code": record["command"]} for record in records]
+
+
+def _synthetic_records(count: int, seed: int = 0) -> List[Dict[str, str]]:
+    """Vary the sample records into ``count`` distinct ones, some with multi-line commented code."""
+
+    rng = random.Random(seed)
+    samples = _sample_records()
+    records = []
+    for index in range(count):
+        sample = samples[index % len(samples)]
+        code = sample["code"]
+        if index % 3 == 0:
+            code = (
+                f"# step {index}: {sample['text'].lower()}\n"
+                f"def run_{index}(target):\n"
+                f"\t\"\"\"Run ``{code}`` — variant {rng.randrange(10**6)}.\"\"\"\n"
+                f"    result = shell({code!r})  # execute\n\n\n"
+                f"    return result   \n"
+            )
+        records.append({"text": f"{sample['text']} (case {index}) ", "code": code})
+    return records
+
+
+def _synthetic_source(num_lines: int, seed: int = 0) -> str:
+    """A Python-like file with classes, functions, comments and blank lines."""
+
+    rng = random.Random(seed)
+    commands = [record["code"] for record in _sample_records()]
+    lines: List[str] = []
+    while len(lines) < num_lines:
+        name = f"task_{len(lines)}_{rng.randrange(1000)}"
+        if rng.random() < 0.2:
+            lines += [f"class {name.title()}:", f"    \"\"\"Wraps {rng.choice(commands)!r}.\"\"\"", ""]
+        lines.append(f"def {name}(host, retries={rng.randrange(5)}):")
+        for _ in range(rng.randrange(2, 12)):
+            lines.append(f"    # {rng.choice(commands)}")
+            lines.append(f"    output = run({rng.choice(commands)!r}, host=host)")
+        lines += ["    return output", "", ""]
+    return "\n".join(lines[:num_lines]) + "\n"
+
+
+def _utf8_size(texts: List[str]) -> int:
+    return sum(len(text.encode()) for text in texts)
+
+
+def _train_tokenizer(texts: List[str], vocab_size: int = 2000):
+    from src.training.config import TokenizerConfig
+    from src.training.tokenizer import CodeTokenizer
+
+    builder = CodeTokenizer(TokenizerConfig(vocab_size=vocab_size, min_frequency=2))
+    builder.train_from_iterator(texts)
+    return builder
+
+
+def _fast_tokenizer():
+    """A small trained tokenizer as ``PreTrainedTokenizerFast`` (conversion goes through a saved file)."""
+
+    builder = _train_tokenizer(_tokenizer_corpus(1))
+    with tempfile.TemporaryDirectory() as directory:
+        builder.save(directory)
+        return builder.to_hf()
+
+
+def _tokenizer_corpus(scale: int) -> List[str]:
+    records = _synthetic_records(1000 * scale)
+    sources = [_synthetic_source(200, seed=seed) for seed in range(4 * scale)]
+    return [f"{record['text']}\n{record['code']}" for record in records] + sources
+
+
+def _preprocess_case(records: List[Dict[str, str]], **config):
+    from src.training.config import PreprocessorConfig
+    from src.training.preprocess import CodePreprocessor
+
+    preprocessor = CodePreprocessor(PreprocessorConfig(**config))
+
+    def work() -> None:
+        for record in records:
+            preprocessor(record["text"], record["code"])
+
+    return work, len(records), _utf8_size([record["text"] + record["code"] for record in records]), "records"
+
+
+def _setup_preprocess(scale: int, normalizer: str = "fused"):
+    return _preprocess_case(_synthetic_records(2000 * scale), strip_comments=True, normalizer=normalizer)
+
+
+def _setup_preprocess_legacy(scale: int):
+    return _setup_preprocess(scale, normalizer="legacy")
+
+
+def _setup_preprocess_source(scale: int, normalizer: str = "fused"):
+    """Code-heavy documents: whole source files, and the same files fenced in Markdown."""
+
+    sources = [_synthetic_source(200, seed=seed) for seed in range(25 * scale)]
+    records = [{"text": "", "code": source} for source in sources]
+    records += [{"text": f"Example:\n```python\n{source}```\nRun it.", "code": ""} for source in sources]
+    return _preprocess_case(records, normalizer=normalizer)
+
+
+def _setup_preprocess_source_legacy(scale: int):
+    return _setup_preprocess_source(scale, normalizer="legacy")
+
+
+def _setup_chunk_characters(scale: int):
+    from src.training.chunker import CodeChunker
+    from src.training.config import ChunkerConfig
+
+    documents = [_synthetic_source(1000 * scale, seed=seed) for seed in range(8)]
+    chunker = CodeChunker(ChunkerConfig(max_characters=2048, overlap=128, minimum_chunk_size=64))
+
+    def work() -> None:
+        for document in documents:
+            for _ in chunker(document):
+                pass
+
+    return work, len(documents), _utf8_size(documents), "documents"
+
+
+def _setup_chunk_tokens(scale: int):
+    from src.training.chunker import CodeChunker
+    from src.training.config import ChunkerConfig
+
+    documents = [_synthetic_source(1000 * scale, seed=seed) for seed in range(8)]
+    tokenizer = _fast_tokenizer()
+    offsets = tokenizer(documents, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    chunker = CodeChunker(ChunkerConfig(mode="tokens", max_tokens=256, overlap_tokens=32, boundary="definition"))
+
+    def work() -> None:
+        for document, mapping in zip(documents, offsets):
+            for _ in chunker.token_windows(document, mapping, 256):
+                pass
+
+    return work, sum(len(mapping) for mapping in offsets), _utf8_size(documents), "tokens"
+
+
+def _setup_tokenizer_train(scale: int):
+    texts = _tokenizer_corpus(scale)
+    return lambda: _train_tokenizer(texts), len(texts), _utf8_size(texts), "documents"
+
+
+def _setup_tokenizer_encode(scale: int):
+    texts = _tokenizer_corpus(scale)
+    tokenizer = _fast_tokenizer()
+    tokens = sum(len(ids) for ids in tokenizer(texts)["input_ids"])
+    return lambda: tokenizer(texts)["input_ids"], tokens, _utf8_size(texts), "tokens"
+
+
+def _setup_mix(scale: int):
+    from datasets import Dataset
+
+    from src.training.data import MixedDataset, interleave_weighted
+
+    sources = [
+        MixedDataset(dataset=Dataset.from_list(_synthetic_records(count * scale, seed=seed)), name=f"source{seed}", weight=weight)
+        for seed, (count, weight) in enumerate([(2000, 5.0), (1000, 3.0), (500, 2.0)])
+    ]
+    rows = len(interleave_weighted(sources))
+    nbytes = sum(source.dataset.data.nbytes for source in sources)
+    return lambda: interleave_weighted(sources), rows, nbytes, "rows"
+
+
+def _setup_model_forward(scale: int):
+    from src.training.config import DecoderConfig, EncoderConfig, ModelConfig
+    from src.training.modeling import CodexLikeCausalLM
+
+    torch.manual_seed(0)
+    seq_len, batch_size, vocab_size = 128 * scale, 4, 2000
+    config = ModelConfig(
+        use_custom_architecture=True,
+        gradient_checkpointing=False,
+        encoder=EncoderConfig(
+            hidden_size=128,
+            num_layers=2,
+            num_attention_heads=4,
+            intermediate_size=512,
+            dropout=0.0,
+            max_position_embeddings=seq_len,
+        ),
+        decoder=DecoderConfig(hidden_size=128),
+    )
+    model = CodexLikeCausalLM(config, SizedVocab(vocab_size)).eval()
+    input_ids = torch.randint(0, vocab_size, (batch_size, seq_len))
+
+    @torch.no_grad()
+    def work() -> None:
+        model(input_ids, labels=input_ids)
+
+    return work, input_ids.numel(), 0, "tokens"
+
+
+COMPONENTS: Dict[str, Setup] = {
+    "preprocess": _setup_preprocess,
+    "preprocess_legacy": _setup_preprocess_legacy,
+    "preprocess_source": _setup_preprocess_source,
+    "preprocess_source_legacy": _setup_preprocess_source_legacy,
+    "chunk_characters": _setup_chunk_characters,
+    "chunk_tokens": _setup_chunk_tokens,
+    "tokenizer_train": _setup_tokenizer_train,
+    "tokenizer_encode": _setup_tokenizer_encode,
+    "mix": _setup_mix,
+    "model_forward": _setup_model_forward,
+}
+
+
+def _run_case(component: str, size: str, repeats: int) -> SuiteResult:
+    torch.set_num_threads(1)
+    work, items, nbytes, unit = COMPONENTS[component](SIZES[size])
+    device = torch.device("cpu")
+    baseline = peak_memory_mb(device)
+    work()  # warm-up
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        work()
+        timings.append(time.perf_counter() - started)
+    seconds = statistics.median(timings)
+    peak = peak_memory_mb(device)
+    return SuiteResult(component, size, items, unit, seconds, items / seconds, nbytes / seconds, peak, peak - baseline)
+
+
+def run(args: argparse.Namespace) -> List[SuiteResult]:
+    results: List[SuiteResult] = []
+    for component in args.components:
+        for size in args.sizes:
+            result, error = run_isolated(_run_case, component, size, args.repeats)
+            if error:
+                result = SuiteResult(component, size, 0, "", None, None, None, None, None, error=error)
+            results.append(result)
+            if result.error:
+                print(f"{component:>17} {size:<7} failed ({result.error})", flush=True)
+            else:
+                print(
+                    f"{component:>17} {size:<7} {result.items_per_second:12.1f} {result.unit}/s"
+                    f" {result.bytes_per_second / 2**20:9.2f} MiB/s {result.peak_mb:8.1f} MiB peak"
+                    f" (+{result.work_mb:.1f})",
+                    flush=True,
+                )
+    return results
+
+
+def compare(baseline: dict, candidate: dict, threshold: float, memory_threshold: float) -> List[str]:
+    """Return one message per case whose throughput or working memory regressed beyond the thresholds."""
+
+    regressions = []
+    before = {(entry["component"], entry["size"]): entry for entry in baseline["results"]}
+    for entry in candidate["results"]:
+        key = (entry["component"], entry["size"])
+        old = before.get(key)
+        label = f"{key[0]} [{key[1]}]"
+        if old is None or old.get("error") or entry.get("error"):
+            print(f"{label:>28}  skipped ({'no baseline' if old is None else 'failed run'})")
+            continue
+        change = entry["items_per_second"] / old["items_per_second"] - 1
+        # A few MiB of allocator noise should not count against tiny cases.
+        memory_limit = old["work_mb"] * (1 + memory_threshold) + 8
+        status = []
+        if change < -threshold:
+            status.append("SLOWER")
+            regressions.append(f"{label}: throughput {change:+.1%}")
+        if entry["work_mb"] > memory_limit:
+            status.append("MORE MEMORY")
+            regressions.append(f"{label}: working memory {old['work_mb']:.1f} -> {entry['work_mb']:.1f} MiB")
+        print(
+            f"{label:>28}  {old['items_per_second']:12.1f} -> {entry['items_per_second']:12.1f} {entry['unit']}/s"
+            f" ({change:+.1%})  +{entry['work_mb']:.1f} MiB  {' '.join(status) or 'ok'}"
+        )
+    return regressions
+
+
+def _environment() -> dict:
+    return {
+        "python": sys.version.split()[0],
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the suite and optionally save the results.")
+    run_parser.add_argument("--components", nargs="+", default=list(COMPONENTS), choices=list(COMPONENTS))
+    run_parser.add_argument("--sizes", nargs="+", default=["small", "medium"], choices=list(SIZES))
+    run_parser.add_argument("--repeats", type=int, default=3)
+    run_parser.add_argument("--json", dest="json_path", help="Write the results to this JSON file.")
+    run_parser.add_argument("--baseline", help="Compare against this earlier results file when done.")
+
+    for subparser in (run_parser, subparsers.add_parser("compare", help="Compare two results files.")):
+        if subparser is not run_parser:
+            subparser.add_argument("baseline")
+            subparser.add_argument("candidate")
+        subparser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative throughput drop.")
+        subparser.add_argument("--memory-threshold", type=float, default=0.25, help="Allowed relative working-memory growth.")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        candidate = {"environment": _environment(), "results": [asdict(result) for result in run(args)]}
+        if args.json_path:
+            Path(args.json_path).write_text(json.dumps(candidate, indent=2))
+        if not args.baseline:
+            return 0
+        baseline_path = args.baseline
+    else:
+        candidate = json.loads(Path(args.candidate).read_text())
+        baseline_path = args.baseline
+
+    regressions = compare(json.loads(Path(baseline_path).read_text()), candidate, args.threshold, args.memory_threshold)
+    for regression in regressions:
+        print(f"regression: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
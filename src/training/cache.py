@@ -0,0 +1,237 @@
+"""Content-addressed on-disk cache for intermediate training artefacts.
+
+Each pipeline stage (prepared corpus, trained tokenizer, tokenized dataset) is
+stored under a fingerprint derived from everything that influences its
+output. Reruns with unchanged upstream settings memory-map the cached files
+instead of recomputing them. Run ``python -m src.training.cache --help`` to
+list or prune entries.
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Optional, Sequence
+
+LOGGER = logging.getLogger(__name__)
+
+# Bump whenever a stage changes its output for an unchanged configuration.
+CACHE_FORMAT_VERSION = 2
+
+# Config fields that only affect how work is scheduled, never what it produces.
+_EXECUTION_ONLY_FIELDS = frozenset({"num_workers", "worker_batch_size", "serialization_dir"})
+
+_META_FILE = "meta.json"
+_SIZE_SUFFIXES = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+
+def _to_jsonable(value: Any) -> Any:
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {
+            field.name: _to_jsonable(getattr(value, field.name))
+            for field in dataclasses.fields(value)
+            if field.name not in _EXECUTION_ONLY_FIELDS
+        }
+    if isinstance(value, dict):
+        return {str(key): _to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(item) for item in value]
+    if isinstance(value, Path):
+        return str(value)
+    return value
+
+
+def fingerprint(*parts: Any) -> str:
+    """Return a stable hex digest for dataclasses, containers and primitives."""
+
+    payload = json.dumps([CACHE_FORMAT_VERSION, *map(_to_jsonable, parts)], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def tokenizer_fingerprint(tokenizer: Any) -> str:
+    """Hash the vocabulary, merges and special tokens of a tokenizer."""
+
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        serialized = backend.to_str()
+    else:
+        serialized = json.dumps(sorted(tokenizer.get_vocab().items()))
+    digest = hashlib.sha256(serialized.encode("utf-8"))
+    digest.update(json.dumps(tokenizer.all_special_tokens).encode("utf-8"))
+    digest.update(str(tokenizer.model_max_length).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def parse_size(value: str) -> int:
+    """Parse a byte count such as ``"512M"`` or ``"20G"``."""
+
+    value = value.strip().lower().rstrip("b")
+    if value and value[-1] in _SIZE_SUFFIXES:
+        return int(float(value[:-1]) * _SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def _format_size(num_bytes: int) -> str:
+    size = float(num_bytes)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def _directory_size(path: Path) -> int:
+    return sum(item.stat().st_size for item in path.rglob("*") if item.is_file())
+
+
+@dataclass
+class CacheEntry:
+    """Metadata describing a single committed cache entry."""
+
+    stage: str
+    key: str
+    path: Path
+    size_bytes: int
+    created: float
+    last_used: float
+    description: str = ""
+
+
+class ArtifactCache:
+    """Directory of immutable, fingerprinted stage outputs with LRU eviction."""
+
+    def __init__(self, root: str | Path, max_bytes: Optional[int] = None) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def path(self, stage: str, key: str) -> Path:
+        return self.root / f"{stage}-{key}"
+
+    def get(self, stage: str, key: str) -> Optional[Path]:
+        """Return the entry directory on a hit and refresh its LRU timestamp."""
+
+        path = self.path(stage, key)
+        meta_path = path / _META_FILE
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text())
+        meta["last_used"] = time.time()
+        meta_path.write_text(json.dumps(meta, indent=2))
+        LOGGER.info("Cache hit for %s %s", stage, key)
+        return path
+
+    @contextmanager
+    def stage(self, stage: str, key: str, description: str = "") -> Iterator[Path]:
+        """Yield a scratch directory that becomes the entry if the block succeeds.
+
+        The entry is published with an atomic rename, so concurrent readers
+        never observe a partially written artefact.
+        """
+
+        final = self.path(stage, key)
+        scratch = self.root / f".tmp-{stage}-{key}-{os.getpid()}"
+        shutil.rmtree(scratch, ignore_errors=True)
+        scratch.mkdir(parents=True)
+        try:
+            yield scratch
+            now = time.time()
+            meta = {
+                "stage": stage,
+                "key": key,
+                "created": now,
+                "last_used": now,
+                "size_bytes": _directory_size(scratch),
+                "description": description,
+            }
+            (scratch / _META_FILE).write_text(json.dumps(meta, indent=2))
+            shutil.rmtree(final, ignore_errors=True)
+            os.replace(scratch, final)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes, protect=[key])
+
+    def entries(self) -> List[CacheEntry]:
+        if not self.root.exists():
+            return []
+        found: List[CacheEntry] = []
+        for meta_path in sorted(self.root.glob(f"*/{_META_FILE}")):
+            meta = json.loads(meta_path.read_text())
+            found.append(
+                CacheEntry(
+                    stage=meta["stage"],
+                    key=meta["key"],
+                    path=meta_path.parent,
+                    size_bytes=meta["size_bytes"],
+                    created=meta["created"],
+                    last_used=meta["last_used"],
+                    description=meta.get("description", ""),
+                )
+            )
+        return found
+
+    def remove(self, entry: CacheEntry) -> None:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+    def evict(self, max_bytes: int, protect: Iterable[str] = ()) -> List[CacheEntry]:
+        """Delete least recently used entries until the cache fits ``max_bytes``."""
+
+        protected = set(protect)
+        entries = sorted(self.entries(), key=lambda entry: entry.last_used)
+        total = sum(entry.size_bytes for entry in entries)
+        evicted: List[CacheEntry] = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            if entry.key in protected:
+                continue
+            self.remove(entry)
+            total -= entry.size_bytes
+            evicted.append(entry)
+            LOGGER.info("Evicted %s %s (%s)", entry.stage, entry.key, _format_size(entry.size_bytes))
+        return evicted
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Inspect and prune the training artefact cache.")
+    parser.add_argument("--cache-dir", default=".cache/codex-like", help="Cache root directory.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List cache entries, most recently used first.")
+    prune = subparsers.add_parser("prune", help="Remove entries by size budget, stage or age.")
+    prune.add_argument("--max-size", type=parse_size, help="Evict LRU entries until the cache fits, e.g. 200G.")
+    prune.add_argument("--stage", help="Remove every entry of this stage.")
+    prune.add_argument("--older-than-days", type=float, help="Remove entries unused for this many days.")
+    prune.add_argument("--all", action="store_true", help="Remove every entry.")
+    args = parser.parse_args(argv)
+
+    cache = ArtifactCache(args.cache_dir)
+    if args.command == "list":
+        entries = sorted(cache.entries(), key=lambda entry: entry.last_used, reverse=True)
+        for entry in entries:
+            last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.last_used))
+            print(f"{entry.stage:<10} {entry.key}  {_format_size(entry.size_bytes):>11}  {last_used}  {entry.description}")
+        print(f"{len(entries)} entries, {_format_size(sum(entry.size_bytes for entry in entries))} total")
+        return
+
+    removed: List[CacheEntry] = []
+    cutoff = time.time() - args.older_than_days * 86400 if args.older_than_days is not None else None
+    for entry in cache.entries():
+        if args.all or entry.stage == args.stage or (cutoff is not None and entry.last_used < cutoff):
+            cache.remove(entry)
+            removed.append(entry)
+    if args.max_size is not None:
+        removed.extend(cache.evict(args.max_size))
+    print(f"Removed {len(removed)} entries, freed {_format_size(sum(entry.size_bytes for entry in removed))}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
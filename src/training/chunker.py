@@ -1,20 +1,47 @@
 """Chunking utilities to slice long documents into manageable windows."""
 from __future__ import annotations
 
-from typing import Iterable, Iterator, Sequence
+import bisect
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Sequence, Tuple
 
 from .config import ChunkerConfig
 
 
+_CHUNK_MODES = ("characters", "tokens")
+_BOUNDARIES = ("line", "definition")
+
+# A top-level definition starts a non-indented line that follows a blank line
+# (or opens the document), which holds for most languages' function/class
+# blocks without needing a parser per language.
+_DEFINITION_RE = re.compile(r"(?:\A|\n[ \t]*\n)(?=[^\s])")
+
+
+@dataclass
+class TokenWindow:
+    """A token slice ``[start, end)`` whose first ``masked_prefix`` tokens overlap the previous window."""
+
+    start: int
+    end: int
+    masked_prefix: int = 0
+
+
 class CodeChunker:
     """Chunk text into overlapping windows to respect model context limits."""
 
     def __init__(self, config: ChunkerConfig | None = None) -> None:
         self.config = config or ChunkerConfig()
+        if self.config.mode not in _CHUNK_MODES:
+            raise ValueError(f"mode must be one of {_CHUNK_MODES}")
+        if self.config.boundary not in _BOUNDARIES:
+            raise ValueError(f"boundary must be one of {_BOUNDARIES}")
         if self.config.max_characters <= 0:
             raise ValueError("max_characters must be positive")
         if self.config.overlap >= self.config.max_characters:
             raise ValueError("overlap must be smaller than max_characters")
+        if self.config.max_tokens is not None and self.config.overlap_tokens >= self.config.max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
 
     def _sliding_windows(self, text: str) -> Iterator[str]:
         step = self.config.max_characters - self.config.overlap
@@ -30,8 +57,90 @@ class CodeChunker:
             start += step
 
     def __call__(self, text: str | Sequence[str]) -> Iterable[str]:
-        if isinstance(text, str):
-            yield from self._sliding_windows(text)
-        else:
-            for segment in text:
+        segments = [text] if isinstance(text, str) else text
+        for segment in segments:
+            if self.config.mode == "tokens":
+                # Token windows are cut after tokenization; see ``token_windows``.
+                if segment:
+                    yield segment
+            else:
                 yield from self._sliding_windows(segment)
+
+    @staticmethod
+    def _boundary_tokens(token_starts: Sequence[int], char_positions: Iterable[int]) -> List[int]:
+        """Map character positions onto the first token starting at or after each.
+
+        Positions point at the newline ending the previous line: byte-level BPE
+        usually merges a newline with the next line's indentation, so cutting
+        before that token keeps the indentation intact.
+        """
+
+        cuts = {bisect.bisect_left(token_starts, position) for position in char_positions}
+        cuts.discard(0)
+        cuts.discard(len(token_starts))
+        return sorted(cuts)
+
+    @staticmethod
+    def _last_cut(cuts: Sequence[int], low: int, high: int) -> int | None:
+        """Return the largest cut in ``(low, high]`` if there is one."""
+
+        idx = bisect.bisect_right(cuts, high) - 1
+        if idx >= 0 and cuts[idx] > low:
+            return cuts[idx]
+        return None
+
+    def token_windows(
+        self,
+        text: str,
+        offsets: Sequence[Tuple[int, int]],
+        max_tokens: int,
+    ) -> Iterator[TokenWindow]:
+        """Split a tokenized document into windows of at most ``max_tokens`` tokens.
+
+        ``offsets`` is the tokenizer's character offset mapping for ``text``.
+        Cuts prefer top-level definition boundaries (when ``boundary`` is
+        ``"definition"``), then line boundaries, and fall back to a hard cut at
+        ``max_tokens``. Each window after the first starts up to
+        ``overlap_tokens`` earlier, snapped to a line start, and reports that
+        overlap as ``masked_prefix`` so its labels can be ignored.
+        """
+
+        if max_tokens <= self.config.overlap_tokens:
+            raise ValueError("max_tokens must exceed overlap_tokens")
+        num_tokens = len(offsets)
+        if num_tokens == 0:
+            return
+        token_starts = [start for start, _ in offsets]
+        line_cuts = self._boundary_tokens(
+            token_starts, (match.start() for match in re.finditer("\n", text))
+        )
+        definition_cuts = (
+            self._boundary_tokens(token_starts, (match.end() - 1 for match in _DEFINITION_RE.finditer(text)))
+            if self.config.boundary == "definition"
+            else []
+        )
+
+        start, prefix = 0, 0
+        while start + max_tokens < num_tokens:
+            limit = start + max_tokens
+            # Accept a boundary only if it keeps the window at least half full;
+            # otherwise a line break still beats splitting mid-line, as long as
+            # it leaves a quarter of the window's unmasked tokens. A near-empty
+            # window gets a hard cut at ``limit`` instead.
+            half = start + max(prefix, max_tokens // 2)
+            quarter = start + prefix + max(1, (max_tokens - prefix) // 4)
+            cut = (
+                self._last_cut(definition_cuts, half, limit)
+                or self._last_cut(line_cuts, half, limit)
+                or self._last_cut(line_cuts, quarter - 1, limit)
+                or limit
+            )
+            yield TokenWindow(start=start, end=cut, masked_prefix=min(prefix, cut - start))
+            # Always move forward, even when the overlap reaches back past ``start``.
+            next_start = max(start + 1, cut - self.config.overlap_tokens)
+            if self.config.overlap_tokens > 0:
+                idx = bisect.bisect_left(line_cuts, next_start)
+                if idx < len(line_cuts) and line_cuts[idx] < cut:
+                    next_start = line_cuts[idx]
+            start, prefix = next_start, cut - next_start
+        yield TokenWindow(start=start, end=num_tokens, masked_prefix=min(prefix, num_tokens - start))
@@ -0,0 +1,166 @@
+"""Command-line entry point: validate, inspect and run training configs.
+
+Only :mod:`src.training.config` is imported up front, so ``validate`` and
+``plan`` answer in tens of milliseconds; ``train`` imports the heavy
+``torch``/``transformers``/``datasets`` stack when it actually runs::
+
+    python -m src.training.cli validate configs/small.yaml
+    python -m src.training.cli plan configs/small.yaml --set model.encoder.num_layers=12
+    python -m src.training.cli train configs/small.yaml
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import sys
+from dataclasses import asdict
+from typing import List, Optional
+
+from .config import TrainingConfig, load_config, validate_config
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _custom_parameter_count(config: TrainingConfig) -> int:
+    """Approximate parameter count of the custom encoder/decoder stack."""
+
+    encoder = config.model.encoder
+    hidden, inner = encoder.hidden_size, encoder.intermediate_size
+    vocab = config.tokenizer.vocab_size
+    per_layer = 4 * hidden * hidden + 4 * hidden + 2 * hidden * inner + inner + hidden + 4 * hidden
+    embeddings = (vocab + encoder.max_position_embeddings) * hidden
+    lm_head = 0 if config.model.decoder.tie_embeddings else vocab * hidden
+    return embeddings + encoder.num_layers * per_layer + 2 * hidden + lm_head
+
+
+def describe_plan(config: TrainingConfig) -> List[str]:
+    """Summarise what ``train(config)`` would load, build and run, without importing any of it."""
+
+    lines = ["datasets:"]
+    total_weight = sum(dataset.weight for dataset in config.datasets) or 1.0
+    for dataset in config.datasets:
+        source = dataset.name + (f"/{dataset.subset}" if dataset.subset else "")
+        if dataset.manifest:
+            source += f" from manifest {dataset.manifest}"
+        mode = " (streaming)" if dataset.streaming else ""
+        lines.append(f"  {source} [{dataset.split}] weight {dataset.weight:g} ({dataset.weight / total_weight:.0%}){mode}")
+    if config.token_shards:
+        lines.append(f"  token shard: {config.token_shards} (used directly if it already exists)")
+
+    stages = [f"preprocess ({config.preprocessor.normalizer})", "chunk"]
+    if config.dedup.exact_index:
+        stages.insert(0, f"skip records indexed in {config.dedup.exact_index}")
+    if config.dedup.enabled:
+        stages.append("dedup")
+    if config.dedup.exact_index:
+        stages.append(f"append to the corpus in {config.dedup.exact_index}")
+    stages.append("tokenize")
+    if config.packing.enabled:
+        stages.append("pack")
+    lines.append(f"data pipeline: {' -> '.join(stages)} (cache: {config.cache_dir or 'disabled'})")
+
+    tokenizer = config.tokenizer
+    if tokenizer.use_custom:
+        source = f"sample of {tokenizer.sample_documents} documents" if tokenizer.sample_documents else "prepared corpus"
+        lines.append(f"tokenizer: train byte-level BPE, vocab {tokenizer.vocab_size}, on the {source}")
+    else:
+        lines.append(f"tokenizer: load {tokenizer.pretrained}")
+
+    model = config.model
+    if model.use_custom_architecture:
+        encoder = model.encoder
+        lines.append(
+            f"model: custom, {encoder.num_layers} layers x {encoder.hidden_size} hidden,"
+            f" {encoder.num_attention_heads} heads, ~{_custom_parameter_count(config) / 1e6:.1f}M parameters"
+        )
+    else:
+        lines.append(f"model: pretrained {model.pretrained} ({model.torch_dtype})")
+    if model.gradient_checkpointing:
+        offload = ", activations offloaded" if model.offload_activations else ""
+        lines.append(f"activation checkpointing: {model.checkpoint_policy}{offload}")
+
+    accumulation = config.gradient_accumulation_steps or config.total_batch_size // max(config.micro_batch_size, 1)
+    batch = (
+        f"<= {config.max_tokens_per_batch} tokens per micro-batch"
+        if config.max_tokens_per_batch
+        else f"micro-batch {config.micro_batch_size}"
+    )
+    lines.append(
+        f"training: {config.num_train_steps} steps, {batch} x {accumulation} accumulation,"
+        f" lr {config.learning_rate:g}, {config.mixed_precision}, output {config.output_dir}"
+    )
+    if config.resume_from_checkpoint:
+        lines.append(f"resume from: {config.resume_from_checkpoint} (reuses the training rows it recorded)")
+    return lines
+
+
+def _validate(args: argparse.Namespace, config: TrainingConfig) -> int:
+    problems = validate_config(config)
+    for problem in problems:
+        print(f"error: {problem}", file=sys.stderr)
+    if not problems:
+        print("config OK")
+    return 1 if problems else 0
+
+
+def _plan(args: argparse.Namespace, config: TrainingConfig) -> int:
+    if args.dump:
+        print(json.dumps(asdict(config), indent=2))
+        return 0
+    print("\n".join(describe_plan(config)))
+    for problem in validate_config(config):
+        print(f"warning: {problem}", file=sys.stderr)
+    return 0
+
+
+def _train(args: argparse.Namespace, config: TrainingConfig) -> int:
+    problems = validate_config(config)
+    if problems:
+        for problem in problems:
+            print(f"error: {problem}", file=sys.stderr)
+        return 1
+    from .train import train
+
+    train(config)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.training.cli", description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    commands = (
+        ("validate", _validate, "Check a config for errors without importing the training stack."),
+        ("plan", _plan, "Print the effective config and what training would do (a dry run)."),
+        ("train", _train, "Validate the config and run training."),
+    )
+    for name, handler, help_text in commands:
+        subparser = subparsers.add_parser(name, help=help_text, description=help_text)
+        subparser.add_argument("config", nargs="?", help="YAML or JSON file; omitted keys keep their defaults.")
+        subparser.add_argument(
+            "--set",
+            dest="overrides",
+            action="append",
+            default=[],
+            metavar="KEY=VALUE",
+            help="Override one field, e.g. --set model.encoder.num_layers=12 (values are parsed as JSON).",
+        )
+        subparser.set_defaults(handler=handler)
+        if name == "plan":
+            subparser.add_argument("--dump", action="store_true", help="Print the full effective config as JSON.")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        config = load_config(args.config, overrides=args.overrides)
+    except (OSError, ValueError) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    return args.handler(args, config)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
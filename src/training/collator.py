@@ -0,0 +1,144 @@
+"""Batch-time label derivation and token-budget batching for causal LM training."""
+from __future__ import annotations
+
+import random
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pyarrow.compute as pc
+import torch
+from torch.utils.data import Sampler
+
+
+def sequence_lengths(dataset) -> np.ndarray:
+    """Return the ``input_ids`` length of every row without decoding the lists."""
+
+    if hasattr(dataset, "lengths"):
+        return dataset.lengths()
+    table = dataset.with_format("arrow")[:]
+    return pc.list_value_length(table.column("input_ids")).to_numpy(zero_copy_only=False)
+
+
+class CausalLMCollator:
+    """Pad a list of tokenized rows and derive ``labels`` from ``input_ids``.
+
+    Labels are ``input_ids`` with padding and every ``[start, end)`` pair listed
+    in a row's flattened ``ignore_spans`` replaced by ``-100``, so the dataset
+    never has to store a second copy of the tokens. ``position_ids`` and
+    ``segment_ids`` from packed rows are padded alongside when present.
+    """
+
+    def __init__(
+        self,
+        pad_token_id: int,
+        pad_to_multiple_of: Optional[int] = None,
+        keep_segment_ids: bool = True,
+    ) -> None:
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.keep_segment_ids = keep_segment_ids
+
+    def __call__(self, features: List[dict]) -> Dict[str, torch.Tensor]:
+        lengths = [len(feature["input_ids"]) for feature in features]
+        max_length = max(lengths)
+        if self.pad_to_multiple_of:
+            max_length = -(-max_length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        batch_size = len(features)
+        input_ids = torch.full((batch_size, max_length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((batch_size, max_length), dtype=torch.long)
+        has_positions = "position_ids" in features[0]
+        has_segments = self.keep_segment_ids and "segment_ids" in features[0]
+        position_ids = torch.zeros((batch_size, max_length), dtype=torch.long) if has_positions else None
+        segment_ids = torch.zeros((batch_size, max_length), dtype=torch.long) if has_segments else None
+
+        for row, (feature, length) in enumerate(zip(features, lengths)):
+            input_ids[row, :length] = torch.as_tensor(feature["input_ids"], dtype=torch.long)
+            attention_mask[row, :length] = 1
+            if position_ids is not None:
+                position_ids[row, :length] = torch.as_tensor(feature["position_ids"], dtype=torch.long)
+            if segment_ids is not None:
+                segments = torch.as_tensor(feature["segment_ids"], dtype=torch.long)
+                segment_ids[row, :length] = segments
+                # Padding joins the last real segment so no query row is fully masked.
+                segment_ids[row, length:] = segments[-1]
+
+        labels = input_ids.masked_fill(attention_mask == 0, -100)
+        for row, feature in enumerate(features):
+            spans = feature.get("ignore_spans") or ()
+            for start, end in zip(spans[::2], spans[1::2]):
+                labels[row, start:end] = -100
+
+        batch = {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+        if position_ids is not None:
+            batch["position_ids"] = position_ids
+        if segment_ids is not None:
+            batch["segment_ids"] = segment_ids
+        return batch
+
+
+class TokenBudgetBatchSampler(Sampler[List[int]]):
+    """Group similar-length rows into micro-batches capped by a token budget.
+
+    Indices are shuffled, split into pools of ``pool_size`` rows, sorted by
+    length inside each pool and then greedily packed into batches whose padded
+    size ``len(batch) * longest_row`` stays within ``max_tokens``. Batch order is
+    shuffled again so long and short batches interleave. Everything is seeded
+    and recomputed per epoch through :meth:`set_epoch`.
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        max_tokens: int,
+        seed: int = 42,
+        shuffle: bool = True,
+        pool_size: int = 8192,
+    ) -> None:
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be positive")
+        self.lengths = np.asarray(lengths)
+        self.max_tokens = max_tokens
+        self.seed = seed
+        self.shuffle = shuffle
+        self.pool_size = pool_size
+        self.epoch = 0
+        self._batches: Optional[List[List[int]]] = None
+
+    def set_epoch(self, epoch: int) -> None:
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self._batches = None
+
+    def _build_batches(self) -> List[List[int]]:
+        rng = random.Random(self.seed + self.epoch)
+        order = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(order)
+        batches: List[List[int]] = []
+        for pool_start in range(0, len(order), self.pool_size):
+            pool = sorted(order[pool_start : pool_start + self.pool_size], key=lambda idx: self.lengths[idx])
+            batch: List[int] = []
+            longest = 0
+            for idx in pool:
+                length = int(self.lengths[idx])
+                if batch and max(longest, length) * (len(batch) + 1) > self.max_tokens:
+                    batches.append(batch)
+                    batch, longest = [], 0
+                batch.append(idx)
+                longest = max(longest, length)
+            if batch:
+                batches.append(batch)
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        if self._batches is None:
+            self._batches = self._build_batches()
+        yield from self._batches
+
+    def __len__(self) -> int:
+        if self._batches is None:
+            self._batches = self._build_batches()
+        return len(self._batches)
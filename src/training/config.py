@@ -1,8 +1,10 @@
 """Configuration dataclasses for Codex-like model training."""
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from typing import List, Optional
+import json
+from dataclasses import MISSING, Field, asdict, dataclass, field, fields, is_dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union, get_args, get_origin, get_type_hints
 
 
 def _default_special_tokens() -> List[str]:
@@ -31,6 +33,20 @@ class DatasetConfig:
             the ``text_column`` is assumed to contain all content.
         weight: Relative sampling weight for the dataset when mixing multiple
             sources together. The values do not need to add up to 1.0.
+        streaming: Open the split as an iterable instead of downloading and
+            materialising it. Streaming sources are mixed on the fly by
+            :class:`~src.training.data.WeightedStreamMixer`.
+        manifest: Path to a release manifest (JSON or YAML, see
+            ``docs/schema_reference.md``) listing local CSV/JSONL shards,
+            optionally gzip- or zstd-compressed. When set, ``name`` is only a
+            label and the shards are read by
+            :class:`~src.training.manifest.ManifestShardReader`; unless the
+            columns are changed from their defaults, ``description`` becomes
+            ``text`` and ``command`` becomes ``code``.
+        num_workers: Processes decoding manifest shards in parallel; records
+            still come out in manifest order.
+        verify_checksums: Check each manifest shard's SHA-256 checksum, size
+            and record count while it is read.
     """
 
     name: str
@@ -39,11 +55,23 @@ class DatasetConfig:
     text_column: str = "text"
     code_column: Optional[str] = None
     weight: float = 1.0
+    streaming: bool = False
+    manifest: Optional[str] = None
+    num_workers: int = 4
+    verify_checksums: bool = True
 
 
 @dataclass
 class TokenizerConfig:
-    """Configuration for building a tokenizer tailored to source code."""
+    """Configuration for building a tokenizer tailored to source code.
+
+    With ``use_custom`` and ``sample_documents`` set, the tokenizer is trained
+    on a weight-stratified reservoir sample of that many documents drawn from
+    the configured sources instead of the whole prepared corpus. Sources are
+    scanned as streams (at most ``sample_scan_limit`` records each), and
+    ``holdout_documents`` of the sample are held back to report tokens-per-byte
+    compression for ``convergence_steps`` doubling sample sizes.
+    """
 
     pretrained: Optional[str] = None
     vocab_size: int = 51200
@@ -55,31 +83,117 @@ class TokenizerConfig:
     train_files: Optional[List[str]] = None
     serialization_dir: str = "tokenizer"
     use_custom: bool = False
+    sample_documents: Optional[int] = None
+    sample_scan_limit: Optional[int] = None
+    sample_batch_size: int = 1000
+    holdout_documents: int = 1000
+    convergence_steps: int = 4
 
 
 @dataclass
 class PreprocessorConfig:
-    """Configuration options for the text/code preprocessor."""
+    """Configuration options for the text/code preprocessor.
+
+    ``normalizer`` is ``"fused"`` (default) or ``"legacy"``. Both produce the
+    same documents unless ``strip_comments`` is set. In that case the fused
+    normalizer strips comments with a lexer for the code's language, taken from
+    a code fence tag or from ``language`` (e.g. ``"python"``, ``"bash"``,
+    ``"powershell"``, ``"sql"``), and leaves strings and URLs intact. The
+    legacy one removes every ``#``/``//`` to the end of the line.
+
+    ``num_workers`` greater than one fans batches of ``worker_batch_size``
+    records out to a process pool that runs preprocessing and chunking
+    together. Output order is identical for every worker count.
+    """
 
     normalize_unicode: bool = True
     strip_comments: bool = False
     collapse_whitespace: bool = True
     dedent: bool = True
     ensure_trailing_newline: bool = True
+    normalizer: str = "fused"
+    language: Optional[str] = None
+    num_workers: int = 1
+    worker_batch_size: int = 256
+
+
+@dataclass
+class DedupConfig:
+    """Configuration for MinHash/LSH near-duplicate removal before chunking.
+
+    Documents are shingled into ``shingle_size``-word windows, summarised by
+    ``num_perm`` MinHash values and split into ``bands`` LSH bands; documents
+    sharing any band with an earlier document are dropped. The band index uses
+    ``bands * index_capacity * 8`` bytes (``index_capacity`` must be a power of
+    two and should be about 1.5x the expected number of unique documents).
+
+    Independently of ``enabled``, ``exact_index`` names a directory holding a
+    persistent :class:`~src.training.dedup.ExactDedupIndex` of record
+    ``dedupe_hash`` values. Manifest sources then skip every record that an
+    earlier ingest already indexed, before preprocessing; only the new
+    records are prepared, and they are appended to the corpus the index
+    directory keeps from earlier ingests. The index starts at
+    ``exact_index_capacity`` slots (a power of two; it doubles when full)
+    with a Bloom filter of about ``bloom_bits_per_key`` bits per key.
+    """
+
+    enabled: bool = False
+    num_perm: int = 128
+    bands: int = 16
+    shingle_size: int = 5
+    index_capacity: int = 1 << 24
+    seed: int = 1
+    exact_index: Optional[str] = None
+    exact_index_capacity: int = 1 << 24
+    bloom_bits_per_key: int = 10
 
 
 @dataclass
 class ChunkerConfig:
-    """Configuration describing how to chunk long documents."""
+    """Configuration describing how to chunk long documents.
+
+    ``mode="characters"`` slices documents into fixed character windows before
+    tokenization. ``mode="tokens"`` keeps documents whole until tokenization and
+    then cuts windows of at most ``max_tokens`` tokens (defaulting to the
+    tokenizer's ``model_max_length``), snapped to ``boundary`` (``"line"`` or
+    ``"definition"``). The overlapping prefix of each window is excluded from
+    the loss.
+    """
 
     max_characters: int = 12000
     overlap: int = 512
     minimum_chunk_size: int = 256
+    mode: str = "characters"
+    max_tokens: Optional[int] = None
+    overlap_tokens: int = 128
+    boundary: str = "definition"
+
+
+@dataclass
+class PackingConfig:
+    """Configuration for packing tokenized documents into fixed-length blocks.
+
+    When ``enabled`` documents are concatenated with ``<eos>`` separators into
+    rows of exactly ``block_size`` tokens (``model_max_length`` by default).
+    ``reset_position_ids`` restarts positions at every document and
+    ``document_attention`` emits segment ids so the custom architecture never
+    attends across documents.
+    """
+
+    enabled: bool = False
+    block_size: Optional[int] = None
+    reset_position_ids: bool = True
+    document_attention: bool = True
 
 
 @dataclass
 class EncoderConfig:
-    """High-level architecture knobs for the custom encoder."""
+    """High-level architecture knobs for the custom encoder.
+
+    ``attention_implementation`` selects ``"sdpa"`` (causal attention through
+    ``torch.nn.functional.scaled_dot_product_attention``) or ``"eager"`` (the
+    ``nn.TransformerEncoder`` stack with an explicit causal mask).
+    """
 
     hidden_size: int = 2048
     num_layers: int = 24
@@ -87,28 +201,164 @@ class EncoderConfig:
     intermediate_size: int = 8192
     dropout: float = 0.1
     max_position_embeddings: int = 16384
+    attention_implementation: str = "sdpa"
 
 
 @dataclass
 class DecoderConfig:
-    """Configuration for the causal LM decoder head."""
+    """Configuration for the causal LM decoder head.
+
+    With ``loss_chunk_size`` set, the training loss is computed that many
+    tokens at a time straight from the hidden states, and logits are only
+    returned when the caller asks for them.
+    """
 
     hidden_size: int = 2048
     tie_embeddings: bool = True
+    loss_chunk_size: Optional[int] = None
 
 
 @dataclass
 class ModelConfig:
-    """Configuration for instantiating the base language model."""
+    """Configuration for instantiating the base language model.
+
+    For the custom architecture ``checkpoint_policy`` picks what
+    ``gradient_checkpointing`` recomputes: ``"all"`` layers, ``"every_k"``
+    (every ``checkpoint_every``-th layer), or only the ``"attention"`` or
+    ``"mlp"`` half of each layer. ``offload_activations`` keeps the activations
+    that are still saved in CPU memory until the backward pass.
+    """
 
     pretrained: Optional[str] = "bigcode/starcoderbase"
     torch_dtype: str = "bfloat16"
     gradient_checkpointing: bool = True
+    checkpoint_policy: str = "all"
+    checkpoint_every: int = 2
+    offload_activations: bool = False
     use_flash_attention: bool = True
     use_custom_architecture: bool = False
     encoder: EncoderConfig = field(default_factory=EncoderConfig)
     decoder: DecoderConfig = field(default_factory=DecoderConfig)
 
+    def to_json_string(self) -> str:
+        """Serialise like ``PretrainedConfig``; the ``Trainer``'s TensorBoard logger calls this on ``model.config``."""
+
+        return json.dumps(asdict(self), indent=2)
+
+
+@dataclass
+class GenerationConfig:
+    """Decoding settings for :meth:`CodexLikeCausalLM.generate`.
+
+    ``do_sample=False`` decodes greedily; otherwise logits are divided by
+    ``temperature`` and restricted to the ``top_k`` most likely tokens and the
+    smallest set whose probability reaches ``top_p`` before sampling.
+    ``cache_length`` overrides the key/value cache preallocation, which
+    defaults to ``encoder.max_position_embeddings``.
+    """
+
+    max_new_tokens: int = 128
+    do_sample: bool = False
+    temperature: float = 1.0
+    top_k: int = 0
+    top_p: float = 1.0
+    eos_token_id: Optional[int] = None
+    pad_token_id: Optional[int] = None
+    cache_length: Optional[int] = None
+    seed: Optional[int] = None
+
+
+@dataclass
+class ServingConfig:
+    """Settings for the local completion server in :mod:`src.training.serving`.
+
+    ``max_batch_size`` sequences decode together and each owns a KV cache
+    slot of ``max_sequence_length`` positions. Requests beyond
+    ``max_queue_size`` waiting ones are rejected with HTTP 503. Prompt
+    prefixes of the custom model are kept in a radix-tree KV cache of up to
+    ``prefix_cache_mb`` megabytes (``0`` disables it).
+    """
+
+    host: str = "127.0.0.1"
+    port: int = 8000
+    max_batch_size: int = 8
+    max_queue_size: int = 64
+    max_sequence_length: int = 2048
+    max_new_tokens: int = 256
+    default_max_tokens: int = 64
+    prefix_cache_mb: float = 1024.0
+
+
+@dataclass
+class QuantizationConfig:
+    """CPU inference quantization of the custom model.
+
+    ``dynamic_linear`` converts linear layers, ``lm_head`` included, to
+    dynamic int8 with per-channel weight scales. Calibration runs
+    ``calibration_samples`` corpus chunks through the float model and keeps
+    any layer whose relative output error would exceed ``max_relative_error``
+    in floating point. ``weight_only_bits`` (8, 4 or ``None``) stores the token
+    embedding as grouped integers with one scale per ``group_size`` weights. A
+    tied ``lm_head`` that is not converted to dynamic int8 shares that storage;
+    its clipping ratio is then picked from ``clip_ratios`` to minimise the
+    calibration logit error.
+    """
+
+    dynamic_linear: bool = True
+    max_relative_error: float = 0.05
+    weight_only_bits: Optional[int] = 8
+    group_size: int = 128
+    clip_ratios: List[float] = field(default_factory=lambda: [1.0, 0.95, 0.9, 0.85, 0.8])
+    calibration_samples: int = 64
+    calibration_max_tokens: int = 4096
+    eval_samples: int = 64
+    benchmark_new_tokens: int = 64
+
+
+@dataclass
+class MetricsConfig:
+    """Pipeline and training instrumentation (see :mod:`src.training.metrics`).
+
+    The JSON run report goes to ``report_path`` (``<output_dir>/run_report.json``
+    by default) and per-stage scalars to TensorBoard when ``tensorboard`` is
+    set. ``peak_tflops`` is the per-device peak used for model FLOPs
+    utilisation. ``profile`` samples the Python stack every
+    ``profile_interval_ms`` of CPU time, in every stage or only in
+    ``profile_stages``, and adds the ``profile_top`` hottest functions to the
+    report.
+    """
+
+    report_path: Optional[str] = None
+    tensorboard: bool = True
+    peak_tflops: Optional[float] = None
+    profile: bool = False
+    profile_interval_ms: float = 5.0
+    profile_stages: Optional[List[str]] = None
+    profile_top: int = 30
+
+
+@dataclass
+class RetrievalConfig:
+    """Embedding store and IVF index settings for :mod:`src.training.retrieval`.
+
+    Records are embedded ``batch_size`` at a time, truncated to
+    ``max_length`` tokens, as L2-normalised mean-pooled final hidden states.
+    They are stored as ``embedding_dtype`` (``"float32"`` or ``"int8"`` with
+    one scale per vector). The IVF coarse quantizer has ``num_lists`` k-means
+    centroids (default ``4 * sqrt(vectors)``), trained for
+    ``kmeans_iterations`` on at most ``kmeans_sample`` vectors. A query scans
+    its ``nprobe`` nearest lists.
+    """
+
+    embedding_dtype: str = "float32"
+    batch_size: int = 64
+    max_length: int = 256
+    num_lists: Optional[int] = None
+    nprobe: int = 32
+    kmeans_iterations: int = 20
+    kmeans_sample: int = 131072
+    seed: int = 0
+
 
 @dataclass
 class TrainingConfig:
@@ -117,6 +367,9 @@ class TrainingConfig:
     output_dir: str = "checkpoints/codex-like"
     total_batch_size: int = 1024
     micro_batch_size: int = 8
+    # When set, micro-batches hold similar-length samples up to this many
+    # (padded) tokens instead of a fixed ``micro_batch_size``.
+    max_tokens_per_batch: Optional[int] = None
     learning_rate: float = 2.5e-4
     warmup_ratio: float = 0.05
     weight_decay: float = 0.1
@@ -127,11 +380,25 @@ class TrainingConfig:
     mixed_precision: str = "bf16"
     checkpoint_interval: int = 10000
     resume_from_checkpoint: Optional[str] = None
+    seed: int = 42
+    shuffle_buffer_size: int = 10000
+    writer_batch_size: int = 1000
+    cache_dir: Optional[str] = ".cache/codex-like"
+    cache_max_bytes: Optional[int] = None
+    # Directory of a memory-mapped token shard. Trains from it directly when it
+    # exists; otherwise the data pipeline writes one there before training.
+    token_shards: Optional[str] = None
     datasets: List[DatasetConfig] = field(default_factory=list)
     tokenizer: TokenizerConfig = field(default_factory=TokenizerConfig)
     model: ModelConfig = field(default_factory=ModelConfig)
     preprocessor: PreprocessorConfig = field(default_factory=PreprocessorConfig)
     chunker: ChunkerConfig = field(default_factory=ChunkerConfig)
+    dedup: DedupConfig = field(default_factory=DedupConfig)
+    packing: PackingConfig = field(default_factory=PackingConfig)
+    quantization: QuantizationConfig = field(default_factory=QuantizationConfig)
+    serving: ServingConfig = field(default_factory=ServingConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
+    retrieval: RetrievalConfig = field(default_factory=RetrievalConfig)
 
 
 DEFAULT_DATASETS: List[DatasetConfig] = [
@@ -156,3 +423,164 @@ def default_training_config() -> TrainingConfig:
     """Return a ``TrainingConfig`` populated with curated defaults."""
 
     return TrainingConfig(datasets=list(DEFAULT_DATASETS))
+
+
+def _coerce(hint: Any, value: Any, path: str) -> Any:
+    """Check ``value`` against the field annotation ``hint`` and convert nested dataclasses."""
+
+    if get_origin(hint) is Union:
+        if value is None:
+            return None
+        (hint,) = [arg for arg in get_args(hint) if arg is not type(None)]
+    if get_origin(hint) is list:
+        if not isinstance(value, list):
+            raise ValueError(f"{path}: expected a list, got {value!r}")
+        (item,) = get_args(hint)
+        return [_coerce(item, entry, f"{path}[{index}]") for index, entry in enumerate(value)]
+    if is_dataclass(hint):
+        if not isinstance(value, dict):
+            raise ValueError(f"{path}: expected a mapping, got {value!r}")
+        required = [spec.name for spec in fields(hint) if _is_required(spec)]
+        missing = [name for name in required if name not in value]
+        if missing:
+            raise ValueError(f"{path}: missing required key(s) {', '.join(missing)}")
+        # Required values are type-checked again by the merge.
+        return _merge(hint(**{name: value[name] for name in required}), value, path)
+    if hint is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if (isinstance(value, bool) and hint is not bool) or not isinstance(value, hint):
+        raise ValueError(f"{path}: expected {hint.__name__}, got {value!r}")
+    return value
+
+
+def _is_required(spec: Field) -> bool:
+    return spec.default is MISSING and spec.default_factory is MISSING
+
+
+def _merge(instance: Any, values: Dict[str, Any], path: str = "") -> Any:
+    """Overlay a nested mapping onto a dataclass instance in place and return it."""
+
+    hints = get_type_hints(type(instance))
+    known = {spec.name for spec in fields(instance)}
+    for key, value in values.items():
+        key_path = f"{path}.{key}" if path else key
+        if key not in known:
+            raise ValueError(f"Unknown config key {key_path!r}")
+        current = getattr(instance, key)
+        if is_dataclass(current) and isinstance(value, dict):
+            _merge(current, value, key_path)
+        else:
+            setattr(instance, key, _coerce(hints[key], value, key_path))
+    return instance
+
+
+def _parse_override(override: str) -> Dict[str, Any]:
+    """Turn ``"model.encoder.num_layers=12"`` into ``{"model": {"encoder": {"num_layers": 12}}}``."""
+
+    key, separator, raw = override.partition("=")
+    if not separator or not key:
+        raise ValueError(f"Overrides look like key.path=value, got {override!r}")
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError:
+        value = raw
+    for part in reversed(key.split(".")):
+        value = {part: value}
+    return value
+
+
+def load_config(path: Optional[str | Path] = None, overrides: Optional[List[str]] = None) -> TrainingConfig:
+    """Build a ``TrainingConfig`` from the curated defaults, a YAML/JSON file and ``key.path=value`` overrides.
+
+    The file only needs the keys it changes; nested sections are merged into
+    the defaults while lists (such as ``datasets``) replace them. Values are
+    type-checked against the dataclass annotations, and unknown keys raise
+    ``ValueError``. YAML files require PyYAML.
+    """
+
+    config = default_training_config()
+    if path is not None:
+        path = Path(path)
+        text = path.read_text()
+        if path.suffix in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError as error:  # pragma: no cover - optional dependency
+                raise ImportError("Loading YAML configs requires PyYAML (`pip install pyyaml`).") from error
+            values = yaml.safe_load(text) or {}
+        else:
+            values = json.loads(text)
+        if not isinstance(values, dict):
+            raise ValueError(f"{path} must contain a mapping at the top level")
+        _merge(config, values)
+    for override in overrides or []:
+        _merge(config, _parse_override(override))
+    return config
+
+
+def validate_config(config: TrainingConfig) -> List[str]:
+    """Return human-readable problems that would make ``train(config)`` fail or misbehave."""
+
+    problems: List[str] = []
+    if not config.datasets and not config.token_shards:
+        problems.append("datasets: at least one dataset (or token_shards) is required")
+    for index, dataset in enumerate(config.datasets):
+        if not dataset.name:
+            problems.append(f"datasets[{index}].name must not be empty")
+        if dataset.weight <= 0:
+            problems.append(f"datasets[{index}].weight must be positive")
+        if dataset.manifest is not None and not Path(dataset.manifest).is_file():
+            problems.append(f"datasets[{index}].manifest {dataset.manifest} does not exist")
+
+    if config.micro_batch_size < 1:
+        problems.append("micro_batch_size must be positive")
+    elif config.gradient_accumulation_steps is None and config.total_batch_size % config.micro_batch_size:
+        problems.append("total_batch_size must be a multiple of micro_batch_size")
+    if config.learning_rate <= 0:
+        problems.append("learning_rate must be positive")
+    if not 0 <= config.warmup_ratio <= 1:
+        problems.append("warmup_ratio must be between 0 and 1")
+    if config.mixed_precision not in ("bf16", "fp16", "no"):
+        problems.append("mixed_precision must be 'bf16', 'fp16' or 'no'")
+
+    if config.preprocessor.normalizer not in ("fused", "legacy"):
+        problems.append("preprocessor.normalizer must be 'fused' or 'legacy'")
+
+    dedup = config.dedup
+    if dedup.exact_index is not None:
+        if dedup.exact_index_capacity < 1 or dedup.exact_index_capacity & (dedup.exact_index_capacity - 1):
+            problems.append("dedup.exact_index_capacity must be a power of two")
+        if not all(dataset.manifest for dataset in config.datasets):
+            problems.append("dedup.exact_index only filters manifest sources; every dataset must set a manifest")
+
+    tokenizer = config.tokenizer
+    if not tokenizer.use_custom and not tokenizer.pretrained:
+        problems.append("tokenizer.pretrained is required unless tokenizer.use_custom is set")
+    if tokenizer.sample_documents is not None and tokenizer.sample_documents <= tokenizer.holdout_documents:
+        problems.append("tokenizer.sample_documents must exceed tokenizer.holdout_documents")
+
+    model = config.model
+    if model.checkpoint_policy not in ("all", "every_k", "attention", "mlp"):
+        problems.append("model.checkpoint_policy must be 'all', 'every_k', 'attention' or 'mlp'")
+    if model.checkpoint_every < 1:
+        problems.append("model.checkpoint_every must be positive")
+    if model.use_custom_architecture:
+        encoder = model.encoder
+        if encoder.hidden_size % encoder.num_attention_heads:
+            problems.append("model.encoder.hidden_size must be divisible by num_attention_heads")
+        if model.decoder.hidden_size != encoder.hidden_size:
+            problems.append("model.decoder.hidden_size must equal model.encoder.hidden_size")
+        if encoder.attention_implementation not in ("sdpa", "eager"):
+            problems.append("model.encoder.attention_implementation must be 'sdpa' or 'eager'")
+        if tokenizer.model_max_length > encoder.max_position_embeddings:
+            problems.append("tokenizer.model_max_length exceeds model.encoder.max_position_embeddings")
+    elif not model.pretrained:
+        problems.append("model.pretrained is required unless model.use_custom_architecture is set")
+
+    if config.quantization.weight_only_bits not in (None, 4, 8):
+        problems.append("quantization.weight_only_bits must be 4, 8 or null")
+    if config.retrieval.embedding_dtype not in ("float32", "int8"):
+        problems.append("retrieval.embedding_dtype must be 'float32' or 'int8'")
+    if config.retrieval.nprobe < 1:
+        problems.append("retrieval.nprobe must be positive")
+    return problems
@@ -1,26 +1,95 @@
 """Utilities for mixing natural language and source code datasets."""
 from __future__ import annotations
 
+import bisect
+import logging
 import math
+import random
 from dataclasses import dataclass
-from typing import Iterable, Iterator, List, Optional
+from itertools import accumulate, chain
+from typing import Iterable, Iterator, List, Optional, Sequence
 
-from datasets import Dataset, DatasetDict, concatenate_datasets, load_dataset
+from datasets import (
+    Dataset,
+    DatasetDict,
+    IterableDataset,
+    IterableDatasetDict,
+    concatenate_datasets,
+    load_dataset,
+)
 
 from .config import DatasetConfig
+from .dedup import ExactDedupIndex
+from .manifest import ManifestShardReader
+
+LOGGER = logging.getLogger(__name__)
 
 
 @dataclass
 class MixedDataset:
     """A dataset that samples examples proportionally from several sources."""
 
-    dataset: Dataset
+    dataset: Dataset | IterableDataset | ManifestShardReader
     name: str
     weight: float
 
 
-def _load_single_dataset(config: DatasetConfig) -> Dataset:
-    """Load a dataset split according to the provided ``DatasetConfig``."""
+def _project_record(example: dict, config: DatasetConfig) -> dict:
+    """Map a raw example onto the ``text``/``code`` fields used downstream."""
+
+    text = example.get(config.text_column) or ""
+    code = (example.get(config.code_column) or "") if config.code_column else ""
+    return {"text": text, "code": code}
+
+
+def _load_streaming_dataset(config: DatasetConfig) -> IterableDataset:
+    """Open a dataset split as an iterable without downloading it up front."""
+
+    data = load_dataset(config.name, config.subset, split=config.split, streaming=True)
+    if isinstance(data, IterableDatasetDict):
+        data = data[config.split]
+    # Streaming datasets do not always know their columns ahead of time, in
+    # which case the raw columns are kept alongside the projected ones.
+    return data.map(
+        _project_record,
+        fn_kwargs={"config": config},
+        remove_columns=data.column_names,
+    )
+
+
+def _load_manifest_dataset(
+    config: DatasetConfig,
+    exact_index: Optional[ExactDedupIndex] = None,
+) -> Dataset | ManifestShardReader:
+    """Read the local shards of a release manifest, streamed or materialised."""
+
+    reader = ManifestShardReader.from_config(config, index=exact_index)
+    if config.streaming:
+        return reader
+    records = iter(reader)
+    first = next(records, None)
+    if first is None:
+        # ``Dataset.from_generator`` cannot infer a schema from nothing, e.g. when the index has every record.
+        return Dataset.from_dict({"text": [], "code": []})
+    # An explicit fingerprint keeps ``datasets`` from hashing the reader (and its index).
+    return Dataset.from_generator(lambda: chain([first], records), fingerprint=reader.fingerprint())
+
+
+def _load_single_dataset(
+    config: DatasetConfig,
+    exact_index: Optional[ExactDedupIndex] = None,
+) -> Dataset | IterableDataset | ManifestShardReader:
+    """Load a dataset split according to the provided ``DatasetConfig``.
+
+    ``exact_index`` filters manifest sources only; other sources are returned whole.
+    """
+
+    if config.manifest is not None:
+        return _load_manifest_dataset(config, exact_index)
+    if exact_index is not None:
+        LOGGER.warning("Exact dedup index only applies to manifest sources; %s is not filtered.", config.name)
+    if config.streaming:
+        return _load_streaming_dataset(config)
 
     data = load_dataset(config.name, config.subset, split=config.split)
     if isinstance(data, DatasetDict):  # Defensive; ``split`` usually prevents this.
@@ -39,12 +108,15 @@ def _load_single_dataset(config: DatasetConfig) -> Dataset:
     return data
 
 
-def load_mixed_datasets(configs: Iterable[DatasetConfig]) -> List[MixedDataset]:
+def load_mixed_datasets(
+    configs: Iterable[DatasetConfig],
+    exact_index: Optional[ExactDedupIndex] = None,
+) -> List[MixedDataset]:
     """Load and wrap each dataset with its respective sampling weight."""
 
     mixed: List[MixedDataset] = []
     for cfg in configs:
-        dataset = _load_single_dataset(cfg)
+        dataset = _load_single_dataset(cfg, exact_index)
         mixed.append(MixedDataset(dataset=dataset, name=cfg.name, weight=cfg.weight))
     return mixed
 
@@ -53,14 +125,20 @@ def interleave_weighted(datasets: List[MixedDataset]) -> Dataset:
     """Return a dataset that interleaves multiple sources by weight.
 
     ``datasets`` is expected to be small; the operation loads each dataset fully
-    into memory. For large-scale training you should rely on streaming mode from
-    ``datasets`` by setting ``streaming=True`` in the configs, which would
-    require a slightly different implementation.
+    into memory. For large-scale training set ``streaming=True`` in the configs
+    and mix the sources with :func:`interleave_streaming` instead.
     """
 
     total_weight = sum(ds.weight for ds in datasets)
     if total_weight <= 0:
         raise ValueError("At least one dataset must have a positive weight.")
+    # Empty sources (say, a manifest whose records are all indexed already) contribute nothing.
+    nonempty = [ds for ds in datasets if len(ds.dataset)]
+    if not nonempty:
+        return datasets[0].dataset
+    datasets, total_weight = nonempty, sum(ds.weight for ds in nonempty)
+    if total_weight <= 0:
+        raise ValueError("At least one non-empty dataset must have a positive weight.")
 
     # Compute the proportion of each dataset and repeat rows accordingly.
     proportions = [ds.weight / total_weight for ds in datasets]
@@ -73,6 +151,107 @@ def interleave_weighted(datasets: List[MixedDataset]) -> Dataset:
     return combined.shuffle(seed=42)
 
 
+class WeightedStreamMixer:
+    """Lazily interleave iterable sources, sampling each one by weight.
+
+    Every draw picks a source with probability proportional to its weight using
+    a seeded RNG and pulls a single example from it. Examples then pass through
+    a fixed-size shuffle buffer, so memory stays bounded by ``buffer_size``
+    regardless of how large the sources are. Exhausted sources drop out of the
+    draw and the remaining weights are renormalised; iteration ends once every
+    source is exhausted.
+    """
+
+    def __init__(self, datasets: Sequence[MixedDataset], seed: int = 42, buffer_size: int = 10000) -> None:
+        if sum(max(ds.weight, 0.0) for ds in datasets) <= 0:
+            raise ValueError("At least one dataset must have a positive weight.")
+        if buffer_size < 0:
+            raise ValueError("buffer_size must be non-negative")
+        self.datasets = list(datasets)
+        self.seed = seed
+        self.buffer_size = buffer_size
+
+    def _draw_examples(self, rng: random.Random) -> Iterator[dict]:
+        iterators = [iter(ds.dataset) for ds in self.datasets]
+        active = [idx for idx, ds in enumerate(self.datasets) if ds.weight > 0]
+        while active:
+            cumulative = list(accumulate(self.datasets[idx].weight for idx in active))
+            while True:
+                choice = bisect.bisect_right(cumulative, rng.random() * cumulative[-1])
+                source = active[min(choice, len(active) - 1)]
+                try:
+                    yield next(iterators[source])
+                except StopIteration:
+                    active.remove(source)
+                    break
+
+    def __iter__(self) -> Iterator[dict]:
+        rng = random.Random(self.seed)
+        if self.buffer_size <= 1:
+            yield from self._draw_examples(rng)
+            return
+
+        buffer: List[dict] = []
+        for example in self._draw_examples(rng):
+            if len(buffer) < self.buffer_size:
+                buffer.append(example)
+                continue
+            slot = rng.randrange(self.buffer_size)
+            yield buffer[slot]
+            buffer[slot] = example
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+def interleave_streaming(
+    datasets: List[MixedDataset],
+    seed: int = 42,
+    buffer_size: int = 10000,
+) -> WeightedStreamMixer:
+    """Return an iterable that mixes sources by weight without materialising them.
+
+    Map-style and streaming sources can be mixed freely; each is consumed one
+    example at a time.
+    """
+
+    return WeightedStreamMixer(datasets, seed=seed, buffer_size=buffer_size)
+
+
+def stratified_reservoir_sample(
+    datasets: Sequence[MixedDataset],
+    total: int,
+    seed: int = 42,
+    scan_limit: Optional[int] = None,
+) -> List[List[dict]]:
+    """Draw a uniform reservoir sample from each source, sized by weight.
+
+    Source ``i`` contributes ``total * weight_i / sum(weights)`` examples chosen
+    uniformly from its stream (or from its first ``scan_limit`` examples) with
+    Algorithm R, so memory is bounded by the sample rather than the corpus.
+    """
+
+    total_weight = sum(max(ds.weight, 0.0) for ds in datasets)
+    if total_weight <= 0:
+        raise ValueError("At least one dataset must have a positive weight.")
+    rng = random.Random(seed)
+    samples: List[List[dict]] = []
+    for ds in datasets:
+        quota = round(total * max(ds.weight, 0.0) / total_weight)
+        reservoir: List[dict] = []
+        if quota > 0:
+            for seen, example in enumerate(ds.dataset):
+                if scan_limit is not None and seen >= scan_limit:
+                    break
+                if seen < quota:
+                    reservoir.append(example)
+                    continue
+                slot = rng.randint(0, seen)
+                if slot < quota:
+                    reservoir[slot] = example
+        samples.append(reservoir)
+    return samples
+
+
 def iter_dataset_text(dataset: Iterable[dict], text_column: str = "text", code_column: Optional[str] = "code") -> Iterator[str]:
     """Yield concatenated text/code strings ready for tokenization."""
 
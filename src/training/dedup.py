@@ -0,0 +1,535 @@
+"""Duplicate elimination: MinHash + banded LSH for near-duplicate documents,
+and a persistent exact index of record hashes for incremental ingestion."""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import unicodedata
+import uuid
+import zlib
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import DedupConfig
+
+LOGGER = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+_MASK32 = np.uint64(0xFFFFFFFF)
+# Upper bound on the ``num_perm x shingles`` matrix evaluated at once.
+_MAX_HASH_CELLS = 1 << 24
+
+
+@dataclass
+class DedupStats:
+    """Counters describing what the deduplicator removed."""
+
+    documents: int = 0
+    removed_documents: int = 0
+    removed_characters: int = 0
+    removed_words: int = 0
+    index_full: bool = False
+
+
+class NumpyHashSet:
+    """Fixed-capacity open-addressing set of non-zero ``uint64`` keys.
+
+    Lookups and inserts are vectorised over whole key arrays with linear
+    probing, so memory is exactly ``8 * capacity`` bytes and never grows. The
+    ``table`` may be any writable ``uint64`` array, including a ``numpy.memmap``.
+    """
+
+    def __init__(self, capacity: int, table: Optional[np.ndarray] = None, size: Optional[int] = None) -> None:
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        self.capacity = capacity
+        self.table = table if table is not None else np.zeros(capacity, dtype=np.uint64)
+        # Counting a large memory-mapped table touches every page; callers that know the size pass it.
+        if size is None:
+            size = int(np.count_nonzero(self.table)) if table is not None else 0
+        self.size = size
+        self._mask = np.uint64(capacity - 1)
+
+    @staticmethod
+    def normalize(keys: np.ndarray) -> np.ndarray:
+        """Map keys onto the non-zero range; zero marks an empty slot."""
+
+        keys = np.asarray(keys, dtype=np.uint64)
+        return np.where(keys == 0, np.uint64(1), keys)
+
+    def _slots(self, keys: np.ndarray) -> np.ndarray:
+        # Keys are already well-mixed hashes; fold the high bits in for safety.
+        return ((keys ^ (keys >> np.uint64(29))) & self._mask).astype(np.int64)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        keys = self.normalize(keys)
+        found = np.zeros(len(keys), dtype=bool)
+        active = np.arange(len(keys))
+        slots = self._slots(keys)
+        while active.size:
+            values = self.table[slots]
+            hit = values == keys[active]
+            found[active[hit]] = True
+            keep = ~(hit | (values == 0))
+            active = active[keep]
+            slots = (slots[keep] + 1) & (self.capacity - 1)
+        return found
+
+    def add(self, keys: np.ndarray) -> bool:
+        """Insert keys that are not yet present.
+
+        Returns ``False`` (inserting nothing) when the keys would push the load
+        factor past 0.7, beyond which linear probing degrades quickly.
+        """
+
+        keys = np.unique(self.normalize(keys))
+        keys = keys[~self.contains(keys)]
+        if self.size + len(keys) > self.capacity * 0.7:
+            return False
+        pending = keys
+        slots = self._slots(pending)
+        while pending.size:
+            free = np.flatnonzero(self.table[slots] == 0)
+            # Several keys may probe the same empty slot; the first one wins.
+            _, first = np.unique(slots[free], return_index=True)
+            winners = free[first]
+            self.table[slots[winners]] = pending[winners]
+            placed = np.zeros(len(pending), dtype=bool)
+            placed[winners] = True
+            pending = pending[~placed]
+            slots = (slots[~placed] + 1) & (self.capacity - 1)
+        self.size += len(keys)
+        return True
+
+
+class MinHashDeduplicator:
+    """Detect near-duplicate documents with shingled MinHash and banded LSH.
+
+    :meth:`band_keys` is stateless and cheap to run in worker processes; it
+    turns a batch of documents into one ``uint64`` key per LSH band.
+    :meth:`filter` keeps the first document of every cluster, i.e. any document
+    sharing a band key with an earlier one is dropped. Band keys are held in
+    fixed-size :class:`NumpyHashSet` tables, so memory is bounded by
+    ``bands * index_capacity * 8`` bytes regardless of corpus size.
+    """
+
+    def __init__(self, config: DedupConfig) -> None:
+        if config.num_perm % config.bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.config = config
+        self.rows = config.num_perm // config.bands
+        rng = np.random.default_rng(config.seed)
+        # Multiply-shift hashing: ``(a * x + b) mod 2**64`` keeps its high 32 bits.
+        self._perm_a = rng.integers(1, 1 << 64, size=(config.num_perm, 1), dtype=np.uint64) | np.uint64(1)
+        self._perm_b = rng.integers(0, 1 << 64, size=(config.num_perm, 1), dtype=np.uint64)
+        self._band_mix = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self._shingle_mix = rng.integers(1, 1 << 32, size=config.shingle_size, dtype=np.uint64)
+        self._tables: Optional[list] = None
+        self.stats = DedupStats()
+
+    def _shingles(self, text: str) -> np.ndarray:
+        words = _WORD_RE.findall(text.lower())
+        hashes = np.fromiter((zlib.crc32(word.encode("utf-8")) for word in words), dtype=np.uint64, count=len(words))
+        size = self.config.shingle_size
+        if len(hashes) < size:
+            size = max(len(hashes), 1)
+            if not len(hashes):
+                return np.zeros(1, dtype=np.uint64)
+        windows = np.lib.stride_tricks.sliding_window_view(hashes, size)
+        return (windows * self._shingle_mix[:size]).sum(axis=1) & _MASK32
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        """Return a ``(len(texts), num_perm)`` ``uint32`` MinHash matrix."""
+
+        shingles = [self._shingles(text) for text in texts]
+        signatures = np.empty((len(texts), self.config.num_perm), dtype=np.uint32)
+        step = max(1, _MAX_HASH_CELLS // self.config.num_perm)
+        # Concatenate the batch and reduce per document with ``minimum.reduceat``;
+        # long documents are folded in slices to bound the temporary matrix.
+        flat = np.concatenate(shingles)
+        starts = np.cumsum([0] + [len(item) for item in shingles[:-1]])
+        running = np.full((self.config.num_perm, len(texts)), np.iinfo(np.uint32).max, dtype=np.uint64)
+        for lo in range(0, len(flat), step):
+            hi = min(len(flat), lo + step)
+            hashed = (self._perm_a * flat[lo:hi] + self._perm_b) >> np.uint64(32)
+            docs = np.flatnonzero((starts < hi) & (np.append(starts[1:], len(flat)) > lo))
+            bounds = np.clip(starts[docs], lo, hi) - lo
+            running[:, docs] = np.minimum(running[:, docs], np.minimum.reduceat(hashed, bounds, axis=1))
+        signatures[:] = running.T
+        return signatures
+
+    def band_keys(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(keys, word_counts)``; ``keys`` has shape ``(len(texts), bands)``."""
+
+        if not texts:
+            return np.zeros((0, self.config.bands), dtype=np.uint64), np.zeros(0, dtype=np.int64)
+        bands = self.signatures(texts).astype(np.uint64).reshape(len(texts), self.config.bands, self.rows)
+        keys = (bands * self._band_mix).sum(axis=2)
+        word_counts = np.fromiter((len(_WORD_RE.findall(text)) for text in texts), dtype=np.int64, count=len(texts))
+        return keys, word_counts
+
+    def filter(self, keys: np.ndarray, word_counts: np.ndarray, characters: Sequence[int]) -> np.ndarray:
+        """Return a keep-mask for a batch and record the survivors in the index."""
+
+        if self._tables is None:
+            self._tables = [NumpyHashSet(self.config.index_capacity) for _ in range(self.config.bands)]
+        count = len(keys)
+        duplicate = np.zeros(count, dtype=bool)
+        for band, table in enumerate(self._tables):
+            duplicate |= table.contains(keys[:, band])
+        # Within the batch a document is dropped only for sharing a band key with an
+        # earlier *kept* batch-mate, as if the documents arrived one at a time.
+        candidates = np.flatnonzero(~duplicate)
+        if any(len(np.unique(keys[candidates, band])) < len(candidates) for band in range(self.config.bands)):
+            kept: set = set()
+            for index in candidates:
+                bands = set(enumerate(keys[index].tolist()))
+                if kept.isdisjoint(bands):
+                    kept |= bands
+                else:
+                    duplicate[index] = True
+        keep = ~duplicate
+        for band, table in enumerate(self._tables):
+            if keep.any() and not table.add(keys[keep, band]) and not self.stats.index_full:
+                self.stats.index_full = True
+                LOGGER.warning("MinHash index is full; later documents are checked but no longer indexed.")
+
+        self.stats.documents += count
+        self.stats.removed_documents += int(duplicate.sum())
+        self.stats.removed_words += int(word_counts[duplicate].sum())
+        self.stats.removed_characters += int(np.asarray(characters, dtype=np.int64)[duplicate].sum())
+        return keep
+
+    def log_stats(self) -> None:
+        LOGGER.info(
+            "Near-duplicate filter removed %d of %d documents (%d words, %d characters)",
+            self.stats.removed_documents,
+            self.stats.documents,
+            self.stats.removed_words,
+            self.stats.removed_characters,
+        )
+
+
+def dedupe_hash(record: Mapping[str, Any]) -> str:
+    """The release schema's ``dedupe_hash``: SHA-256 of the canonical command plus its context.
+
+    The command is NFC-normalised with runs of whitespace collapsed; the
+    context is the lower-cased ``platform`` and ``execution_context``.
+    """
+
+    command = " ".join(unicodedata.normalize("NFC", str(record.get("command") or "")).split())
+    platform = str(record.get("platform") or "").strip().lower()
+    context = str(record.get("execution_context") or "").strip().lower()
+    return hashlib.sha256("\x1f".join((command, platform, context)).encode("utf-8")).hexdigest()
+
+
+def dedupe_key(digest: str) -> int:
+    """The first 64 bits of a hex ``dedupe_hash``, as stored in :class:`ExactDedupIndex`."""
+
+    return int(digest[:16], 16)
+
+
+class BloomFilter:
+    """Bit-array Bloom filter over well-mixed ``uint64`` keys.
+
+    Probe positions come from double hashing the two 32-bit halves of each
+    key. ``bits`` may be any writable ``uint8`` array, including a
+    ``numpy.memmap``.
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: Optional[np.ndarray] = None) -> None:
+        if num_bits < 8 or num_bits & (num_bits - 1):
+            raise ValueError("num_bits must be a power of two of at least 8")
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else np.zeros(num_bits // 8, dtype=np.uint8)
+        self._steps = np.arange(num_hashes, dtype=np.uint64)
+
+    def _positions(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        keys = np.asarray(keys, dtype=np.uint64)[:, None]
+        first, second = keys & _MASK32, (keys >> np.uint64(32)) | np.uint64(1)
+        positions = (first + self._steps * second) & np.uint64(self.num_bits - 1)
+        return (positions >> np.uint64(3)).astype(np.int64), (positions & np.uint64(7)).astype(np.uint8)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """Return ``False`` for keys never added; ``True`` may be a false positive."""
+
+        offsets, shifts = self._positions(keys)
+        return ((self.bits[offsets] >> shifts) & 1).all(axis=1)
+
+    def add(self, keys: np.ndarray) -> None:
+        offsets, shifts = self._positions(keys)
+        np.bitwise_or.at(self.bits, offsets.ravel(), (np.uint8(1) << shifts).ravel())
+
+
+@dataclass
+class IngestStats:
+    """New and duplicate record counts for one shard of an ingest."""
+
+    shard: str
+    records: int = 0
+    new: int = 0
+
+    @property
+    def duplicates(self) -> int:
+        return self.records - self.new
+
+
+class ExactDedupIndex:
+    """Persistent set of record hashes, and the corpus prepared from them, across ingests.
+
+    The directory holds a memory-mapped :class:`NumpyHashSet` of 64-bit
+    ``dedupe_key`` values (``keys.u64``), a memory-mapped
+    :class:`BloomFilter` in front of it (``bloom.u8``), ``meta.json`` and,
+    under ``corpus/``, the prepared records of every ingest that added any.
+    Lookups are vectorised over batches. Most new keys are rejected by the
+    Bloom filter without touching the table, so resident memory is whatever
+    pages the OS keeps cached, not the table size. At a billion records the
+    table takes 16 GiB and the filter 2 GiB on disk. The table doubles,
+    rehashing in bounded chunks, when it passes 70% load.
+
+    :meth:`filter_new` stages an ingest's new keys on disk as well: a
+    memory-mapped table with its own Bloom filter (``staged.u64``,
+    ``staged-bloom.u8``) answers lookups within the ingest, and an append-only
+    log (``staged-keys.u64``) keeps the keys in arrival order, so memory stays
+    bounded however many records an ingest adds. A shard's keys are accepted
+    when :meth:`record` is called for it, which the manifest reader does only
+    once the shard is verified. :meth:`commit` adopts the ingest's corpus file
+    and then merges the accepted prefix of the log into the table, so an
+    ingest that fails before it leaves the index unchanged; its staged files
+    are discarded when the index is next opened. An index reopened after an interrupted commit logs a
+    warning, because its next ingest may prepare some of those records again.
+    """
+
+    _KEYS_FILE = "keys.u64"
+    _BLOOM_FILE = "bloom.u8"
+    _STAGED_FILE = "staged.u64"
+    _STAGED_BLOOM_FILE = "staged-bloom.u8"
+    _STAGED_LOG_FILE = "staged-keys.u64"
+    _META_FILE = "meta.json"
+    _CORPUS_DIR = "corpus"
+    _REHASH_CHUNK = 1 << 22
+    _STAGE_CAPACITY = 1 << 16
+
+    def __init__(self, directory: str | Path, capacity: int = 1 << 24, bloom_bits_per_key: int = 10) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        meta_path = self.directory / self._META_FILE
+        if meta_path.exists():
+            self.meta = json.loads(meta_path.read_text())
+            if self.meta.get("dirty"):
+                LOGGER.warning(
+                    "Exact dedup index %s was interrupted while committing an ingest; "
+                    "the next ingest may prepare some of its records again.",
+                    self.directory,
+                )
+        else:
+            self.meta = {"capacity": capacity, "size": 0, "bloom_bits_per_key": bloom_bits_per_key, "dirty": False, "ingests": []}
+        for key, default in (("preparation", None), ("sources", []), ("corpora", [])):
+            self.meta.setdefault(key, default)
+        self._staged_log: Optional[BinaryIO] = None
+        self._reset_ingest()
+        self.table, self.bloom = self._open(
+            self._KEYS_FILE, self._BLOOM_FILE, self.meta["capacity"], self.meta["size"], create=not meta_path.exists()
+        )
+
+    @classmethod
+    def state_fingerprint(cls, directory: str | Path) -> Optional[str]:
+        """Digest of the committed corpora, or ``None`` for an index that does not exist yet."""
+
+        meta_path = Path(directory) / cls._META_FILE
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text())
+        payload = json.dumps([meta.get("preparation"), meta.get("corpora", [])])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    @property
+    def preparation(self) -> Optional[str]:
+        """Fingerprint of the settings the committed corpora were prepared with."""
+
+        return self.meta["preparation"]
+
+    def corpora(self) -> List[Path]:
+        """Prepared corpus files of the committed ingests, oldest first."""
+
+        return [self.directory / entry["path"] for entry in self.meta["corpora"]]
+
+    def corpus_path(self) -> Path:
+        """Where the current ingest writes its prepared corpus for :meth:`commit` to adopt."""
+
+        return self.directory / self._CORPUS_DIR / f"ingest-{len(self.meta['ingests']):05d}.arrow"
+
+    def ingested(self, source: str) -> bool:
+        """Whether a committed ingest already read ``source``, a fingerprint chosen by the caller."""
+
+        return source in self.meta["sources"]
+
+    def _reset_ingest(self) -> None:
+        """Start a new ingest, discarding whatever an unfinished one staged."""
+
+        self.ingest_id = uuid.uuid4().hex
+        if self._staged_log is not None:
+            self._staged_log.close()
+        self._staged_log = None
+        self._staged: Optional[NumpyHashSet] = None
+        self._staged_bloom: Optional[BloomFilter] = None
+        self._staged_count = self._accepted_count = 0
+        self._pending: Dict[str, IngestStats] = {}
+        for name in (self._STAGED_FILE, self._STAGED_BLOOM_FILE, self._STAGED_LOG_FILE):
+            (self.directory / name).unlink(missing_ok=True)
+
+    def _bloom_shape(self, capacity: int) -> Tuple[int, int]:
+        bits_per_key = self.meta["bloom_bits_per_key"]
+        num_bits = 1 << max(3, math.ceil(math.log2(capacity * 0.7 * bits_per_key)))
+        return num_bits, max(1, round(bits_per_key * math.log(2)))
+
+    def _open(
+        self, keys_file: str, bloom_file: str, capacity: int, size: int, create: bool
+    ) -> Tuple[NumpyHashSet, BloomFilter]:
+        mode = "w+" if create else "r+"
+        num_bits, num_hashes = self._bloom_shape(capacity)
+        table = np.memmap(self.directory / keys_file, dtype=np.uint64, mode=mode, shape=(capacity,))
+        bits = np.memmap(self.directory / bloom_file, dtype=np.uint8, mode=mode, shape=(num_bits // 8,))
+        return NumpyHashSet(capacity, table, size=size), BloomFilter(num_bits, num_hashes, bits)
+
+    def __len__(self) -> int:
+        return self.table.size
+
+    def _write_meta(self) -> None:
+        self.meta["capacity"], self.meta["size"] = self.table.capacity, self.table.size
+        path = self.directory / self._META_FILE
+        scratch = path.with_suffix(".tmp")
+        scratch.write_text(json.dumps(self.meta, indent=2))
+        os.replace(scratch, path)
+
+    def _grown(self, old: NumpyHashSet, keys_file: str, bloom_file: str) -> Tuple[NumpyHashSet, BloomFilter]:
+        """Rehash ``old`` into files of twice its capacity, with a rebuilt Bloom filter, and swap them in."""
+
+        LOGGER.info("Growing %s of exact dedup index %s to %d slots", keys_file, self.directory, old.capacity * 2)
+        table, bloom = self._open(keys_file + ".tmp", bloom_file + ".tmp", old.capacity * 2, 0, create=True)
+        for start in range(0, old.capacity, self._REHASH_CHUNK):
+            chunk = np.asarray(old.table[start : start + self._REHASH_CHUNK])
+            keys = chunk[chunk != 0]
+            table.add(keys)
+            bloom.add(keys)
+        table.table.flush()
+        bloom.bits.flush()
+        for name in (keys_file, bloom_file):
+            os.replace(self.directory / (name + ".tmp"), self.directory / name)
+        return self._open(keys_file, bloom_file, table.capacity, table.size, create=False)
+
+    def _grow(self) -> None:
+        """Double the table and rebuild the Bloom filter from it."""
+
+        self.table, self.bloom = self._grown(self.table, self._KEYS_FILE, self._BLOOM_FILE)
+        self._write_meta()
+
+    def _stage(self, keys: np.ndarray) -> None:
+        if self._staged is None:
+            self._staged, self._staged_bloom = self._open(
+                self._STAGED_FILE, self._STAGED_BLOOM_FILE, self._STAGE_CAPACITY, 0, create=True
+            )
+            self._staged_log = open(self.directory / self._STAGED_LOG_FILE, "wb")
+        while not self._staged.add(keys):
+            self._staged, self._staged_bloom = self._grown(self._staged, self._STAGED_FILE, self._STAGED_BLOOM_FILE)
+        self._staged_bloom.add(keys)
+        self._staged_log.write(keys.tobytes())
+        self._staged_count += len(keys)
+
+    def filter_new(self, keys: np.ndarray) -> np.ndarray:
+        """Return a mask of the keys not seen before (first occurrence only) and stage them.
+
+        Keys count as seen once a committed ingest holds them or an earlier
+        batch of the current ingest staged them.
+        """
+
+        keys = NumpyHashSet.normalize(keys)
+        new = np.zeros(len(keys), dtype=bool)
+        if not len(keys):
+            return new
+        _, first = np.unique(keys, return_index=True)
+        candidates = keys[first]
+        seen = self.bloom.contains(candidates)
+        if seen.any():
+            seen[seen] = self.table.contains(candidates[seen])
+        if self._staged is not None and not seen.all():
+            rest = np.flatnonzero(~seen)
+            staged = self._staged_bloom.contains(candidates[rest])
+            if staged.any():
+                staged[staged] = self._staged.contains(candidates[rest[staged]])
+            seen[rest] = staged
+        fresh = candidates[~seen]
+        if fresh.size:
+            self._stage(fresh)
+            new[first[~seen]] = True
+        return new
+
+    def record(self, stats: IngestStats) -> None:
+        """Accept a verified shard: its staged keys and counts join the next :meth:`commit`."""
+
+        self._accepted_count = self._staged_count
+        self._pending[stats.shard] = stats
+        LOGGER.info("%s: %d new, %d duplicate records", stats.shard, stats.new, stats.duplicates)
+
+    def flush(self) -> None:
+        self.table.table.flush()
+        self.bloom.bits.flush()
+
+    def commit(
+        self,
+        corpus: Optional[str | Path] = None,
+        sources: Sequence[str] = (),
+        preparation: Optional[str] = None,
+    ) -> List[IngestStats]:
+        """Adopt the ingest's corpus, persist its accepted keys and log it; returns its per-shard counts.
+
+        ``corpus`` is the file written to :meth:`corpus_path`, or ``None`` when
+        the ingest prepared nothing. ``sources`` and ``preparation`` are kept
+        for :meth:`ingested` and :attr:`preparation`.
+        """
+
+        if self._staged_count > self._accepted_count:
+            LOGGER.warning("Not committing the keys of a shard that was read but never verified.")
+        shards = list(self._pending.values())
+        entry = {
+            "id": self.ingest_id,
+            "shards": [{**asdict(stats), "duplicates": stats.duplicates} for stats in shards],
+            "new": sum(stats.new for stats in shards),
+            "duplicates": sum(stats.duplicates for stats in shards),
+        }
+        if corpus is not None:
+            entry["corpus"] = Path(corpus).relative_to(self.directory).as_posix()
+            self.meta["corpora"].append({"path": entry["corpus"], "id": self.ingest_id})
+        self.meta["ingests"].append(entry)
+        self.meta["sources"] = sorted(set(self.meta["sources"]).union(sources))
+        if preparation is not None:
+            self.meta["preparation"] = preparation
+        # The corpus is listed before its keys go in, so an interrupted commit can repeat records but never lose them.
+        self.meta["dirty"] = True
+        self._write_meta()
+        if self._accepted_count:
+            self._staged_log.close()
+            self._staged_log = None
+            accepted = np.memmap(
+                self.directory / self._STAGED_LOG_FILE, dtype=np.uint64, mode="r", shape=(self._accepted_count,)
+            )
+            for start in range(0, self._accepted_count, self._REHASH_CHUNK):
+                chunk = np.asarray(accepted[start : start + self._REHASH_CHUNK])
+                while not self.table.add(chunk):
+                    self._grow()
+                self.bloom.add(chunk)
+            del accepted
+        self.flush()
+        self.meta["dirty"] = False
+        self._write_meta()
+        self._reset_ingest()
+        LOGGER.info("Committed exact dedup index %s: %d keys", self.directory, len(self))
+        return shards
@@ -1,48 +1,292 @@
 """Custom Transformer encoder stack used for the Codex-like model."""
 from __future__ import annotations
 
+import contextlib
+from typing import TYPE_CHECKING
+
 import torch
+import torch.nn.functional as F
 from torch import nn
+from torch.nn.attention import SDPBackend, sdpa_kernel
+from torch.utils.checkpoint import checkpoint
 
 from .config import EncoderConfig
 
+if TYPE_CHECKING:
+    from .generation import KVCache
+
+_ATTENTION_IMPLEMENTATIONS = ("sdpa", "eager")
+_CHECKPOINT_POLICIES = ("all", "every_k", "attention", "mlp")
+
+
+class CausalSelfAttention(nn.Module):
+    """Multi-head self-attention evaluated with ``scaled_dot_product_attention``."""
+
+    def __init__(self, config: EncoderConfig) -> None:
+        super().__init__()
+        if config.hidden_size % config.num_attention_heads:
+            raise ValueError("hidden_size must be divisible by num_attention_heads")
+        self.num_heads = config.num_attention_heads
+        self.head_dim = config.hidden_size // config.num_attention_heads
+        self.dropout = config.dropout
+        self.qkv = nn.Linear(config.hidden_size, 3 * config.hidden_size)
+        self.out_proj = nn.Linear(config.hidden_size, config.hidden_size)
+
+    def forward(
+        self,
+        hidden_states: torch.FloatTensor,
+        attn_mask: torch.BoolTensor | None = None,
+        cache: KVCache | None = None,
+        layer_idx: int = 0,
+    ) -> torch.FloatTensor:
+        """Attend causally; ``attn_mask`` (``True`` = may attend) replaces the implicit causal mask.
+
+        With a ``cache`` the new keys/values are appended to layer
+        ``layer_idx`` and the queries attend over the whole cached prefix.
+        """
+
+        batch_size, seq_len, hidden_size = hidden_states.size()
+        qkv = self.qkv(hidden_states).view(batch_size, seq_len, 3, self.num_heads, self.head_dim)
+        query, key, value = qkv.permute(2, 0, 3, 1, 4).unbind(0)
+        if cache is not None:
+            key, value = cache.update(layer_idx, key, value)
+        attended = F.scaled_dot_product_attention(
+            query,
+            key,
+            value,
+            attn_mask=attn_mask,
+            dropout_p=self.dropout if self.training else 0.0,
+            is_causal=attn_mask is None,
+        )
+        return self.out_proj(attended.transpose(1, 2).reshape(batch_size, seq_len, hidden_size))
+
+
+class CodeEncoderLayer(nn.Module):
+    """Post-norm block matching ``nn.TransformerEncoderLayer`` with SDPA attention."""
+
+    def __init__(self, config: EncoderConfig) -> None:
+        super().__init__()
+        self.self_attn = CausalSelfAttention(config)
+        self.linear1 = nn.Linear(config.hidden_size, config.intermediate_size)
+        self.linear2 = nn.Linear(config.intermediate_size, config.hidden_size)
+        self.norm1 = nn.LayerNorm(config.hidden_size)
+        self.norm2 = nn.LayerNorm(config.hidden_size)
+        self.dropout = nn.Dropout(config.dropout)
+
+    def forward(
+        self,
+        hidden_states: torch.FloatTensor,
+        attn_mask: torch.BoolTensor | None = None,
+        cache: KVCache | None = None,
+        layer_idx: int = 0,
+        recompute: str | None = None,
+    ) -> torch.FloatTensor:
+        """Apply the block; ``recompute`` names the part (``"attention"`` or
+        ``"mlp"``) whose activations are recomputed in backward instead of stored."""
+
+        if recompute == "attention":
+            hidden_states = checkpoint(self._attention_block, hidden_states, attn_mask, use_reentrant=False)
+        else:
+            hidden_states = self._attention_block(hidden_states, attn_mask, cache, layer_idx)
+        if recompute == "mlp":
+            return checkpoint(self._mlp_block, hidden_states, use_reentrant=False)
+        return self._mlp_block(hidden_states)
+
+    def _attention_block(
+        self,
+        hidden_states: torch.FloatTensor,
+        attn_mask: torch.BoolTensor | None,
+        cache: KVCache | None = None,
+        layer_idx: int = 0,
+    ) -> torch.FloatTensor:
+        attended = self.self_attn(hidden_states, attn_mask, cache=cache, layer_idx=layer_idx)
+        return self.norm1(hidden_states + self.dropout(attended))
+
+    def _mlp_block(self, hidden_states: torch.FloatTensor) -> torch.FloatTensor:
+        feed_forward = self.linear2(self.dropout(F.gelu(self.linear1(hidden_states))))
+        return self.norm2(hidden_states + self.dropout(feed_forward))
+
+
+def _allowed_attention(
+    attention_mask: torch.LongTensor | None,
+    segment_ids: torch.LongTensor | None,
+    seq_len: int,
+    device: torch.device,
+) -> torch.BoolTensor | None:
+    """Return a ``(B, 1, T, T)`` mask of pairs that may attend, or ``None`` for plain causal.
+
+    Right padding needs no mask under causality: real tokens never see the pad
+    keys that follow them, so batches from :class:`CausalLMCollator` keep the
+    ``is_causal`` fast path unless they carry ``segment_ids``.
+    """
+
+    right_padded = attention_mask is None or bool((attention_mask[:, 1:] <= attention_mask[:, :-1]).all())
+    if right_padded and segment_ids is None:
+        return None
+    allowed = torch.ones(seq_len, seq_len, dtype=torch.bool, device=device).tril().unsqueeze(0)
+    if segment_ids is not None:
+        allowed = allowed & (segment_ids.unsqueeze(2) == segment_ids.unsqueeze(1))
+    if not right_padded:
+        allowed = allowed & attention_mask.bool().unsqueeze(1)
+    # Every query keeps itself so fully padded rows never softmax over nothing.
+    allowed = allowed | torch.eye(seq_len, dtype=torch.bool, device=device)
+    return allowed.unsqueeze(1)
+
 
 class CodeEncoder(nn.Module):
-    """Lightweight Transformer encoder tailored for causal language modelling."""
+    """Lightweight Transformer encoder tailored for causal language modelling.
+
+    The default ``"sdpa"`` implementation lets PyTorch dispatch to the flash or
+    memory-efficient attention kernels when ``use_flash_attention`` is set, and
+    pins the reference math kernel otherwise. ``"eager"`` keeps the original
+    ``nn.TransformerEncoder`` stack for comparison.
 
-    def __init__(self, config: EncoderConfig, vocab_size: int) -> None:
+    :meth:`enable_checkpointing` trades compute for memory during training by
+    recomputing whole layers, every ``k``-th layer, or only the attention or
+    MLP half of each layer in the backward pass, optionally keeping the
+    remaining saved activations in CPU memory.
+    """
+
+    def __init__(self, config: EncoderConfig, vocab_size: int, use_flash_attention: bool = True) -> None:
         super().__init__()
+        if config.attention_implementation not in _ATTENTION_IMPLEMENTATIONS:
+            raise ValueError(f"attention_implementation must be one of {_ATTENTION_IMPLEMENTATIONS}")
         self.config = config
+        self.use_flash_attention = use_flash_attention
         self.token_embeddings = nn.Embedding(vocab_size, config.hidden_size)
         self.position_embeddings = nn.Embedding(config.max_position_embeddings, config.hidden_size)
         self.layernorm = nn.LayerNorm(config.hidden_size)
-        encoder_layer = nn.TransformerEncoderLayer(
-            d_model=config.hidden_size,
-            nhead=config.num_attention_heads,
-            dim_feedforward=config.intermediate_size,
-            dropout=config.dropout,
-            activation="gelu",
-            batch_first=True,
-        )
-        self.layers = nn.TransformerEncoder(encoder_layer, num_layers=config.num_layers)
+        if config.attention_implementation == "sdpa":
+            self.layers = nn.ModuleList(CodeEncoderLayer(config) for _ in range(config.num_layers))
+        else:
+            encoder_layer = nn.TransformerEncoderLayer(
+                d_model=config.hidden_size,
+                nhead=config.num_attention_heads,
+                dim_feedforward=config.intermediate_size,
+                dropout=config.dropout,
+                activation="gelu",
+                batch_first=True,
+            )
+            self.layers = nn.TransformerEncoder(encoder_layer, num_layers=config.num_layers)
         self.dropout = nn.Dropout(config.dropout)
+        self.checkpoint_policy: str | None = None
+        self.checkpoint_every = 1
+        self.offload_activations = False
+
+    def enable_checkpointing(self, policy: str = "all", every: int = 2, offload: bool = False) -> None:
+        """Turn on activation checkpointing with one of ``("all", "every_k", "attention", "mlp")``."""
+
+        if policy not in _CHECKPOINT_POLICIES:
+            raise ValueError(f"checkpoint policy must be one of {_CHECKPOINT_POLICIES}")
+        if policy in ("attention", "mlp") and self.config.attention_implementation != "sdpa":
+            raise ValueError("Selective checkpointing requires attention_implementation='sdpa'.")
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        self.checkpoint_policy = policy
+        self.checkpoint_every = every if policy == "every_k" else 1
+        self.offload_activations = offload
+
+    def disable_checkpointing(self) -> None:
+        self.checkpoint_policy = None
+        self.offload_activations = False
+
+    def _recompute(self, layer_idx: int) -> str | None:
+        """Which part of layer ``layer_idx`` to recompute: ``"layer"``, ``"attention"``, ``"mlp"`` or ``None``."""
+
+        if self.checkpoint_policy is None or not (self.training and torch.is_grad_enabled()):
+            return None
+        if self.checkpoint_policy in ("attention", "mlp"):
+            return self.checkpoint_policy
+        return "layer" if layer_idx % self.checkpoint_every == 0 else None
+
+    def _memory_context(self):
+        if self.offload_activations and self.training and torch.is_grad_enabled():
+            return torch.autograd.graph.save_on_cpu(pin_memory=torch.cuda.is_available())
+        return contextlib.nullcontext()
+
+    def _attention_context(self):
+        if self.use_flash_attention:
+            return contextlib.nullcontext()
+        return sdpa_kernel(SDPBackend.MATH)
+
+    def forward(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: torch.LongTensor | None = None,
+        position_ids: torch.LongTensor | None = None,
+        segment_ids: torch.LongTensor | None = None,
+        cache: KVCache | None = None,
+    ) -> torch.FloatTensor:
+        """Encode ``input_ids`` causally.
+
+        ``position_ids`` overrides the default ``0..T-1`` positions (packed rows
+        restart them per document) and ``segment_ids`` restricts attention to
+        tokens that share a segment id. With a ``cache`` the tokens continue
+        each row's cached prefix; ``attention_mask`` must then be right-padded
+        and only its real tokens are committed to the cache.
+        """
 
-    def forward(self, input_ids: torch.LongTensor, attention_mask: torch.LongTensor | None = None) -> torch.FloatTensor:
         device = input_ids.device
         batch_size, seq_len = input_ids.size()
-        positions = torch.arange(seq_len, device=device).unsqueeze(0).expand(batch_size, seq_len)
+        if cache is not None:
+            return self._forward_cached(input_ids, attention_mask, cache)
+        if position_ids is None:
+            position_ids = torch.arange(seq_len, device=device).unsqueeze(0).expand(batch_size, seq_len)
         token_embeds = self.token_embeddings(input_ids)
-        position_embeds = self.position_embeddings(positions)
+        position_embeds = self.position_embeddings(position_ids)
         hidden_states = token_embeds + position_embeds
         hidden_states = self.layernorm(self.dropout(hidden_states))
 
-        if attention_mask is not None:
-            src_key_padding_mask = attention_mask == 0
+        allowed = _allowed_attention(attention_mask, segment_ids, seq_len, device)
+        with self._memory_context():
+            if self.config.attention_implementation == "eager":
+                return self._forward_eager(hidden_states, allowed)
+            with self._attention_context():
+                for layer_idx, layer in enumerate(self.layers):
+                    recompute = self._recompute(layer_idx)
+                    if recompute == "layer":
+                        hidden_states = checkpoint(layer, hidden_states, allowed, use_reentrant=False)
+                    else:
+                        hidden_states = layer(hidden_states, allowed, recompute=recompute)
+        return hidden_states
+
+    def _forward_eager(self, hidden_states: torch.FloatTensor, allowed: torch.BoolTensor | None) -> torch.FloatTensor:
+        seq_len = hidden_states.size(1)
+        is_causal = allowed is None
+        if is_causal:
+            mask = torch.ones(seq_len, seq_len, dtype=torch.bool, device=hidden_states.device).triu(1)
         else:
-            src_key_padding_mask = None
+            # ``True`` marks pairs that may not attend; one mask per head.
+            mask = (~allowed).expand(-1, self.config.num_attention_heads, -1, -1).reshape(-1, seq_len, seq_len)
+        if self.checkpoint_policy is None or not (self.training and torch.is_grad_enabled()):
+            return self.layers(hidden_states, mask=mask, is_causal=is_causal)
+        for layer_idx, layer in enumerate(self.layers.layers):
+            if self._recompute(layer_idx) == "layer":
+                hidden_states = checkpoint(layer, hidden_states, mask, None, is_causal, use_reentrant=False)
+            else:
+                hidden_states = layer(hidden_states, src_mask=mask, is_causal=is_causal)
+        return hidden_states
 
-        encoded = self.layers(hidden_states, src_key_padding_mask=src_key_padding_mask)
-        return encoded
+    def _forward_cached(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: torch.LongTensor | None,
+        cache: KVCache,
+    ) -> torch.FloatTensor:
+        if self.config.attention_implementation != "sdpa":
+            raise ValueError("Cached decoding requires attention_implementation='sdpa'.")
+        positions = cache.begin(input_ids.size(1))
+        hidden_states = self.token_embeddings(input_ids) + self.position_embeddings(positions)
+        hidden_states = self.layernorm(self.dropout(hidden_states))
+        allowed = cache.attention_mask()
+        with self._attention_context():
+            for layer_idx, layer in enumerate(self.layers):
+                hidden_states = layer(hidden_states, allowed, cache=cache, layer_idx=layer_idx)
+        if attention_mask is None:
+            cache.advance(torch.full_like(cache.lengths, input_ids.size(1)))
+        else:
+            cache.advance(attention_mask.sum(dim=1))
+        return hidden_states
 
     @property
     def embedding_weight(self) -> torch.nn.Parameter:
@@ -0,0 +1,208 @@
+"""Incremental decoding with a preallocated key/value cache."""
+from __future__ import annotations
+
+from typing import List, Optional, Tuple
+
+import torch
+from torch import nn
+
+from .config import GenerationConfig
+
+
+class KVCache:
+    """Per-layer key/value buffers of shape ``(batch, heads, max_length, head_dim)``.
+
+    Rows advance independently: ``lengths[b]`` is the number of cached tokens
+    of row ``b`` and the next tokens of that row are written right after them.
+    Buffers are allocated once, so a decoding step only touches the new
+    positions and attends over the ``max(lengths) + 1`` cached prefix.
+    """
+
+    def __init__(
+        self,
+        num_layers: int,
+        batch_size: int,
+        num_heads: int,
+        head_dim: int,
+        max_length: int,
+        dtype: torch.dtype = torch.float32,
+        device: torch.device | str = "cpu",
+    ) -> None:
+        shape = (batch_size, num_heads, max_length, head_dim)
+        self.keys = [torch.zeros(shape, dtype=dtype, device=device) for _ in range(num_layers)]
+        self.values = [torch.zeros(shape, dtype=dtype, device=device) for _ in range(num_layers)]
+        self.lengths = torch.zeros(batch_size, dtype=torch.long, device=device)
+        self.max_length = max_length
+        self._rows = torch.arange(batch_size, device=device).unsqueeze(1)
+        self._positions: Optional[torch.LongTensor] = None
+        self._span = 0
+
+    @classmethod
+    def for_model(cls, model: nn.Module, batch_size: int, max_length: int) -> "KVCache":
+        """Allocate a cache matching ``model.encoder``'s layer and head layout."""
+
+        config = model.encoder.config
+        # Position embeddings stay in floating point even in quantized models.
+        weight = model.encoder.position_embeddings.weight
+        return cls(
+            num_layers=config.num_layers,
+            batch_size=batch_size,
+            num_heads=config.num_attention_heads,
+            head_dim=config.hidden_size // config.num_attention_heads,
+            max_length=max_length,
+            dtype=weight.dtype,
+            device=weight.device,
+        )
+
+    def view(self, rows: slice) -> "KVCache":
+        """Return a cache over a contiguous range of rows that shares this cache's storage."""
+
+        view = KVCache.__new__(KVCache)
+        view.keys = [keys[rows] for keys in self.keys]
+        view.values = [values[rows] for values in self.values]
+        view.lengths = self.lengths[rows]
+        view.max_length = self.max_length
+        view._rows = torch.arange(len(view.lengths), device=self.lengths.device).unsqueeze(1)
+        view._positions, view._span = None, 0
+        return view
+
+    def move_row(self, source: int, target: int) -> None:
+        """Copy row ``source``'s cached prefix into row ``target``."""
+
+        length = int(self.lengths[source])
+        for keys, values in zip(self.keys, self.values):
+            keys[target, :, :length] = keys[source, :, :length]
+            values[target, :, :length] = values[source, :, :length]
+        self.lengths[target] = length
+
+    def begin(self, num_tokens: int) -> torch.LongTensor:
+        """Reserve positions for ``num_tokens`` new tokens per row and return them."""
+
+        offsets = torch.arange(num_tokens, device=self.lengths.device)
+        positions = self.lengths.unsqueeze(1) + offsets
+        span = int(positions.max()) + 1
+        if span > self.max_length:
+            raise ValueError(f"KV cache holds {self.max_length} positions; {span} are required")
+        self._positions, self._span = positions, span
+        return positions
+
+    def attention_mask(self) -> torch.BoolTensor:
+        """``(B, 1, new, span)`` mask letting each new token see its row's prefix and itself."""
+
+        keys = torch.arange(self._span, device=self.lengths.device)
+        return (keys.view(1, 1, -1) <= self._positions.unsqueeze(2)).unsqueeze(1)
+
+    def update(
+        self,
+        layer: int,
+        key: torch.FloatTensor,
+        value: torch.FloatTensor,
+    ) -> Tuple[torch.FloatTensor, torch.FloatTensor]:
+        """Write ``(B, H, new, D)`` projections and return the cached ``[:span]`` prefix."""
+
+        self.keys[layer][self._rows, :, self._positions] = key.transpose(1, 2).to(self.keys[layer].dtype)
+        self.values[layer][self._rows, :, self._positions] = value.transpose(1, 2).to(self.values[layer].dtype)
+        return self.keys[layer][:, :, : self._span], self.values[layer][:, :, : self._span]
+
+    def advance(self, counts: torch.LongTensor) -> None:
+        """Commit ``counts`` of the reserved tokens per row (the rest were padding)."""
+
+        self.lengths += counts
+        self._positions = None
+
+
+def _right_align(input_ids: torch.LongTensor, attention_mask: torch.LongTensor) -> Tuple[torch.LongTensor, torch.LongTensor]:
+    """Move every row's real tokens to the front so left- and right-padded prompts look alike."""
+
+    order = torch.argsort((attention_mask == 0).to(torch.int8), dim=1, stable=True)
+    return input_ids.gather(1, order), attention_mask.gather(1, order)
+
+
+def _filter_logits(logits: torch.FloatTensor, top_k: int, top_p: float) -> torch.FloatTensor:
+    if top_k > 0:
+        kth = torch.topk(logits, min(top_k, logits.size(-1)), dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    if top_p < 1.0:
+        sorted_logits, order = torch.sort(logits, dim=-1, descending=True)
+        probs = sorted_logits.softmax(dim=-1)
+        # Drop a token once the tokens ranked above it already reach ``top_p``.
+        remove = probs.cumsum(dim=-1) - probs >= top_p
+        sorted_logits = sorted_logits.masked_fill(remove, float("-inf"))
+        logits = torch.full_like(logits, float("-inf")).scatter(-1, order, sorted_logits)
+    return logits
+
+
+def select_next_tokens(
+    logits: torch.FloatTensor,
+    config: GenerationConfig,
+    generator: Optional[torch.Generator] = None,
+) -> torch.LongTensor:
+    """Pick one token per row from ``(B, vocab)`` logits."""
+
+    if not config.do_sample:
+        return logits.argmax(dim=-1)
+    logits = _filter_logits(logits.float() / max(config.temperature, 1e-5), config.top_k, config.top_p)
+    return torch.multinomial(logits.softmax(dim=-1), 1, generator=generator).squeeze(1)
+
+
+@torch.no_grad()
+def generate(
+    model: nn.Module,
+    input_ids: torch.LongTensor,
+    attention_mask: Optional[torch.LongTensor] = None,
+    config: Optional[GenerationConfig] = None,
+) -> torch.LongTensor:
+    """Continue a batch of prompts with ``model`` (a :class:`CodexLikeCausalLM`).
+
+    Prompts may have different lengths and be padded on either side. The
+    prompt is encoded once to fill the cache; every later step feeds only the
+    newest token. Returns the ``(B, new_tokens)`` continuation, with positions
+    after a row's ``eos_token_id`` set to ``pad_token_id``.
+    """
+
+    config = config or GenerationConfig()
+    encoder = model.encoder
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    input_ids, attention_mask = _right_align(input_ids, attention_mask)
+    prompt_lengths = attention_mask.sum(dim=1)
+    if int(prompt_lengths.min()) == 0:
+        raise ValueError("Every prompt needs at least one token.")
+
+    encoder_config = encoder.config
+    cache_length = config.cache_length or encoder_config.max_position_embeddings
+    if cache_length > encoder_config.max_position_embeddings:
+        raise ValueError("cache_length cannot exceed max_position_embeddings")
+    if int(prompt_lengths.max()) + config.max_new_tokens > cache_length:
+        raise ValueError(f"Prompt plus {config.max_new_tokens} new tokens does not fit the {cache_length}-token cache.")
+
+    was_training = model.training
+    model.eval()
+    cache = KVCache.for_model(model, batch_size=input_ids.size(0), max_length=cache_length)
+    generator = None
+    if config.seed is not None:
+        generator = torch.Generator(device=input_ids.device).manual_seed(config.seed)
+    pad_token_id = config.pad_token_id if config.pad_token_id is not None else (config.eos_token_id or 0)
+
+    finished = torch.zeros(input_ids.size(0), dtype=torch.bool, device=input_ids.device)
+    generated: List[torch.LongTensor] = []
+    try:
+        hidden_states = encoder(input_ids, attention_mask=attention_mask, cache=cache)
+        # Only the last prompt position of each row needs vocabulary logits.
+        last = hidden_states[torch.arange(input_ids.size(0), device=input_ids.device), prompt_lengths - 1]
+        logits = model.decoder(last)
+        for step in range(config.max_new_tokens):
+            next_tokens = select_next_tokens(logits, config, generator).masked_fill(finished, pad_token_id)
+            generated.append(next_tokens)
+            if config.eos_token_id is not None:
+                finished |= next_tokens == config.eos_token_id
+            if step + 1 == config.max_new_tokens or bool(finished.all()):
+                break
+            hidden_states = encoder(next_tokens.unsqueeze(1), cache=cache)
+            logits = model.decoder(hidden_states[:, -1])
+    finally:
+        model.train(was_training)
+
+    if not generated:
+        return input_ids.new_zeros((input_ids.size(0), 0))
+    return torch.stack(generated, dim=1)
@@ -0,0 +1,91 @@
+"""Memory-bounded causal LM loss through the output projection."""
+from __future__ import annotations
+
+import torch
+import torch.nn.functional as F
+
+IGNORE_INDEX = -100
+
+
+def _chunked_loss(hidden: torch.Tensor, weight: torch.Tensor, labels: torch.Tensor, chunk_size: int) -> torch.Tensor:
+    """Forward-only mean cross-entropy, one ``(chunk_size, vocab)`` logits slice at a time."""
+
+    num_targets = (labels != IGNORE_INDEX).sum().clamp(min=1)
+    loss = torch.zeros((), dtype=torch.float32, device=hidden.device)
+    for start in range(0, hidden.size(0), chunk_size):
+        logits = (hidden[start : start + chunk_size] @ weight.t()).float()
+        loss += F.cross_entropy(logits, labels[start : start + chunk_size], ignore_index=IGNORE_INDEX, reduction="sum")
+    return loss / num_targets
+
+
+class _ChunkedCrossEntropy(torch.autograd.Function):
+    """Cross-entropy of ``hidden @ weight.T`` evaluated ``chunk_size`` rows at a time.
+
+    Gradients are produced during the forward pass, chunk by chunk, so only a
+    ``(chunk_size, vocab)`` slice of logits ever exists and nothing but the
+    two gradient buffers is kept for the backward pass.
+    """
+
+    @staticmethod
+    def forward(ctx, hidden: torch.Tensor, weight: torch.Tensor, labels: torch.Tensor, chunk_size: int) -> torch.Tensor:
+        needs_hidden_grad, needs_weight_grad = ctx.needs_input_grad[0], ctx.needs_input_grad[1]
+        num_targets = (labels != IGNORE_INDEX).sum().clamp(min=1)
+        loss = torch.zeros((), dtype=torch.float32, device=hidden.device)
+        grad_hidden = torch.empty_like(hidden) if needs_hidden_grad else None
+        grad_weight = torch.zeros(weight.shape, dtype=torch.float32, device=weight.device) if needs_weight_grad else None
+
+        for start in range(0, hidden.size(0), chunk_size):
+            chunk = hidden[start : start + chunk_size]
+            targets = labels[start : start + chunk_size]
+            valid = targets != IGNORE_INDEX
+            logits = (chunk @ weight.t()).float()
+            safe_targets = targets.masked_fill(~valid, 0)
+            loss += F.cross_entropy(logits, safe_targets, reduction="none").masked_fill(~valid, 0.0).sum()
+            if grad_hidden is None and grad_weight is None:
+                continue
+            # d(loss)/d(logits) = softmax - one_hot, averaged over the valid targets.
+            grad_logits = logits.softmax(dim=-1)
+            grad_logits[torch.arange(len(targets), device=targets.device), safe_targets] -= 1.0
+            grad_logits *= valid.unsqueeze(1) / num_targets
+            grad_logits = grad_logits.to(weight.dtype)
+            if grad_hidden is not None:
+                grad_hidden[start : start + chunk_size] = grad_logits @ weight
+            if grad_weight is not None:
+                grad_weight += (grad_logits.t() @ chunk).float()
+
+        ctx.save_for_backward(
+            grad_hidden if grad_hidden is not None else torch.empty(0),
+            grad_weight.to(weight.dtype) if grad_weight is not None else torch.empty(0),
+        )
+        return loss / num_targets
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor):
+        grad_hidden, grad_weight = ctx.saved_tensors
+        grad_hidden = grad_hidden * grad_output.to(grad_hidden.dtype) if ctx.needs_input_grad[0] else None
+        grad_weight = grad_weight * grad_output.to(grad_weight.dtype) if ctx.needs_input_grad[1] else None
+        return grad_hidden, grad_weight, None, None
+
+
+def chunked_causal_lm_loss(
+    hidden_states: torch.Tensor,
+    weight: torch.Tensor,
+    labels: torch.LongTensor,
+    chunk_size: int,
+) -> torch.Tensor:
+    """Mean next-token cross-entropy of ``hidden_states`` projected by ``weight``.
+
+    Equivalent to shifting ``lm_head(hidden_states)`` and ``labels`` by one
+    position and calling ``cross_entropy``, but the labels are shifted instead
+    of the logits, so the ``(B, T, vocab)`` tensor is never built.
+    """
+
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    shift_labels = F.pad(labels[:, 1:], (0, 1), value=IGNORE_INDEX)
+    hidden = hidden_states.reshape(-1, hidden_states.size(-1))
+    # ``ctx.needs_input_grad`` stays set under ``no_grad``, so evaluation must
+    # bypass the Function or it would build both gradient buffers for nothing.
+    if not torch.is_grad_enabled() or not (hidden.requires_grad or weight.requires_grad):
+        return _chunked_loss(hidden, weight, shift_labels.reshape(-1), chunk_size)
+    return _ChunkedCrossEntropy.apply(hidden, weight, shift_labels.reshape(-1), chunk_size)
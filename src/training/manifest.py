@@ -0,0 +1,408 @@
+"""Streaming reader for local CSV/JSONL shards listed in a release manifest.
+
+A release (see ``docs/schema_reference.md``) ships a manifest naming its
+shards, each optionally ``gzip``- or ``zstd``-compressed, with a SHA-256
+checksum, byte size and record count. :class:`ManifestShardReader` decodes
+the shards straight from disk, without converting them to Arrow first, and
+keeps only the two columns training needs as ``text``/``code`` records.
+With ``num_workers > 1``, shards are decoded by worker processes. Each worker
+feeds its own bounded queue, and the queues are drained in manifest order,
+so the stream is identical to a sequential read. Checksums are computed over
+the compressed bytes as they are read, and a mismatch raises ``ValueError``
+once the shard ends. With an :class:`~src.training.dedup.ExactDedupIndex`,
+workers also compute each record's ``dedupe_hash``, and records an earlier
+ingest already indexed are dropped before they reach preprocessing.
+"""
+from __future__ import annotations
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import queue
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import DatasetConfig
+from .dedup import ExactDedupIndex, IngestStats, dedupe_hash, dedupe_key
+
+LOGGER = logging.getLogger(__name__)
+
+# Schema columns projected onto ``text``/``code`` when a manifest source keeps the default columns.
+SCHEMA_TEXT_COLUMN = "description"
+SCHEMA_CODE_COLUMN = "command"
+# Fields ``dedupe_hash`` reads; optional in CSV headers.
+_KEY_COLUMNS = ("command", "platform", "execution_context")
+
+_COMPRESSIONS = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl"}
+_READ_SIZE = 1 << 20
+_BATCH_SIZE = 1024
+_QUEUE_BATCHES = 8
+
+
+@dataclass
+class ShardEntry:
+    """One file of a release; ``checksum`` is ``"sha256:<hex>"`` (or bare hex)."""
+
+    path: Path
+    records: Optional[int] = None
+    checksum: Optional[str] = None
+    size_bytes: Optional[int] = None
+
+    @property
+    def compression(self) -> Optional[str]:
+        return _COMPRESSIONS.get(self.path.suffix.lower())
+
+    @property
+    def format(self) -> str:
+        suffixes = [suffix.lower() for suffix in self.path.suffixes]
+        if suffixes and suffixes[-1] in _COMPRESSIONS:
+            suffixes.pop()
+        if not suffixes or suffixes[-1] not in _FORMATS:
+            raise ValueError(f"{self.path}: expected a .csv or .jsonl shard, optionally .gz/.zst compressed")
+        return _FORMATS[suffixes[-1]]
+
+
+@dataclass
+class ShardManifest:
+    path: Path
+    dataset_name: Optional[str]
+    schema_version: Optional[str]
+    record_count: Optional[int]
+    files: List[ShardEntry]
+
+
+def _sidecar_checksum(path: Path) -> Optional[str]:
+    """Read ``<shard>.sha256`` in ``sha256sum`` format, if present."""
+
+    sidecar = path.with_name(path.name + ".sha256")
+    if not sidecar.is_file():
+        return None
+    content = sidecar.read_text().split()
+    return content[0] if content else None
+
+
+def load_manifest(path: str | Path) -> ShardManifest:
+    """Parse a JSON or YAML release manifest; shard paths are relative to its directory."""
+
+    path = Path(path)
+    text = path.read_text()
+    if path.suffix in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError as error:  # pragma: no cover - optional dependency
+            raise ImportError("Reading YAML manifests requires PyYAML (`pip install pyyaml`).") from error
+        values = yaml.safe_load(text) or {}
+    else:
+        values = json.loads(text)
+    if not isinstance(values.get("files"), list):
+        raise ValueError(f"{path}: manifest has no 'files' list")
+
+    files = []
+    for entry in values["files"]:
+        shard = path.parent / entry["path"]
+        files.append(
+            ShardEntry(
+                path=shard,
+                records=entry.get("records"),
+                checksum=entry.get("checksum") or _sidecar_checksum(shard),
+                size_bytes=entry.get("size_bytes"),
+            )
+        )
+    return ShardManifest(
+        path=path,
+        dataset_name=values.get("dataset_name"),
+        schema_version=values.get("schema_version"),
+        record_count=values.get("record_count"),
+        files=files,
+    )
+
+
+def manifest_fingerprint(path: str | Path) -> str:
+    """Digest of the manifest file, so caches follow a re-released manifest at the same path."""
+
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()[:32]
+
+
+class _HashingReader(io.RawIOBase):
+    """Raw reader that hashes and counts every byte pulled through it."""
+
+    def __init__(self, raw: BinaryIO) -> None:
+        self._raw = raw
+        self.digest = hashlib.sha256()
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = self._raw.readinto(buffer)
+        if count:
+            self.digest.update(memoryview(buffer)[:count])
+            self.bytes_read += count
+        return count
+
+    def drain(self) -> None:
+        """Hash whatever the decompressor left unread (e.g. trailing padding)."""
+
+        while self.read(_READ_SIZE):
+            pass
+
+
+def _decompressed(shard: ShardEntry, source: _HashingReader) -> BinaryIO:
+    if shard.compression == "gzip":
+        return gzip.GzipFile(fileobj=io.BufferedReader(source, _READ_SIZE))
+    if shard.compression == "zstd":
+        try:
+            import zstandard
+        except ImportError as error:  # pragma: no cover - optional dependency
+            raise ImportError("Reading .zst shards requires zstandard (`pip install zstandard`).") from error
+        reader = zstandard.ZstdDecompressor().stream_reader(source, read_size=_READ_SIZE, read_across_frames=True)
+        return io.BufferedReader(reader, _READ_SIZE)
+    return io.BufferedReader(source, _READ_SIZE)
+
+
+def _csv_records(stream: BinaryIO, required: Sequence[str], optional: Sequence[str], path: Path) -> Iterator[dict]:
+    """Yield the ``required`` and available ``optional`` columns of each row."""
+
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+    header = next(reader, None) or []
+    missing = [column for column in required if column not in header]
+    if missing:
+        raise ValueError(f"{path}: missing column(s) {', '.join(missing)}; found {', '.join(header)}")
+    indexes = {column: header.index(column) for column in (*required, *optional) if column in header}
+    for row in reader:
+        if not row:
+            continue
+        yield {column: row[index] if index < len(row) else "" for column, index in indexes.items()}
+
+
+def _jsonl_records(stream: BinaryIO, required: Sequence[str], optional: Sequence[str], path: Path) -> Iterator[dict]:
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as error:
+            raise ValueError(f"{path}:{number}: invalid JSON ({error})") from None
+
+
+def _verify(shard: ShardEntry, source: _HashingReader, records: int) -> None:
+    if shard.checksum is None:
+        LOGGER.warning("%s has no checksum in the manifest or a .sha256 file; not verified", shard.path)
+    else:
+        algorithm, _, expected = shard.checksum.rpartition(":")
+        if algorithm not in ("", "sha256"):
+            raise ValueError(f"{shard.path}: unsupported checksum algorithm {algorithm!r}")
+        if source.digest.hexdigest() != expected.lower():
+            raise ValueError(f"{shard.path}: SHA-256 mismatch (expected {expected}, got {source.digest.hexdigest()})")
+    if shard.size_bytes is not None and source.bytes_read != shard.size_bytes:
+        raise ValueError(f"{shard.path}: expected {shard.size_bytes} bytes, read {source.bytes_read}")
+    if shard.records is not None and records != shard.records:
+        raise ValueError(f"{shard.path}: expected {shard.records} records, decoded {records}")
+
+
+def read_shard(
+    shard: ShardEntry,
+    text_column: str = SCHEMA_TEXT_COLUMN,
+    code_column: Optional[str] = SCHEMA_CODE_COLUMN,
+    verify: bool = True,
+    with_keys: bool = False,
+    batch_size: int = _BATCH_SIZE,
+) -> Iterator[Tuple[List[dict], Optional[np.ndarray]]]:
+    """Yield batches of ``text``/``code`` records from one shard, verifying it at the end.
+
+    With ``with_keys`` each batch comes with the ``dedupe_key`` of every
+    record as a ``uint64`` array; otherwise the keys are ``None``.
+    """
+
+    decode = _csv_records if shard.format == "csv" else _jsonl_records
+    required = [column for column in (text_column, code_column) if column]
+    optional = _KEY_COLUMNS if with_keys else ()
+    with open(shard.path, "rb", buffering=0) as raw:
+        source = _HashingReader(raw)
+        records = 0
+        batch: List[dict] = []
+        keys: List[int] = []
+        for record in decode(_decompressed(shard, source), required, optional, shard.path):
+            batch.append({
+                "text": record.get(text_column) or "",
+                "code": (record.get(code_column) or "") if code_column else "",
+            })
+            if with_keys:
+                keys.append(dedupe_key(dedupe_hash(record)))
+            if len(batch) >= batch_size:
+                records += len(batch)
+                yield batch, np.array(keys, dtype=np.uint64) if with_keys else None
+                batch, keys = [], []
+        if batch:
+            records += len(batch)
+            yield batch, np.array(keys, dtype=np.uint64) if with_keys else None
+        if verify:
+            source.drain()
+            _verify(shard, source, records)
+
+
+def _decode_worker(
+    shards: List[ShardEntry],
+    columns: Tuple[str, Optional[str]],
+    verify: bool,
+    with_keys: bool,
+    output: multiprocessing.Queue,
+) -> None:
+    """Decode ``shards`` in order, sending ``("batch", (records, keys))`` then ``("done", bytes)`` per shard."""
+
+    try:
+        for shard in shards:
+            for batch in read_shard(shard, *columns, verify=verify, with_keys=with_keys):
+                output.put(("batch", batch))
+            output.put(("done", shard.path.stat().st_size))
+    except Exception as error:  # Reported to the consumer, which raises it.
+        output.put(("error", (isinstance(error, ValueError), f"{type(error).__name__}: {error}")))
+
+
+class ManifestShardReader:
+    """Iterable of ``{"text", "code"}`` records from every shard of a manifest.
+
+    Each iteration rereads the shards from the start. Records come out in
+    manifest order regardless of ``num_workers``. With an ``index``, only
+    records it has not seen pass and their keys are staged in it, so a second
+    iteration yields nothing. A shard's keys and counts are handed to
+    :meth:`ExactDedupIndex.record` only after the shard is verified, and
+    per-shard counts accumulate in ``shard_stats``.
+    """
+
+    def __init__(
+        self,
+        manifest: str | Path,
+        text_column: str = SCHEMA_TEXT_COLUMN,
+        code_column: Optional[str] = SCHEMA_CODE_COLUMN,
+        num_workers: int = 4,
+        verify_checksums: bool = True,
+        index: Optional[ExactDedupIndex] = None,
+    ) -> None:
+        self.manifest = load_manifest(manifest)
+        self.columns = (text_column, code_column)
+        self.num_workers = max(1, min(num_workers, len(self.manifest.files)))
+        self.verify_checksums = verify_checksums
+        self.index = index
+        self.shard_stats: Dict[str, IngestStats] = {}
+
+    @classmethod
+    def from_config(cls, config: DatasetConfig, index: Optional[ExactDedupIndex] = None) -> "ManifestShardReader":
+        columns = (config.text_column, config.code_column)
+        if columns == ("text", None):
+            columns = (SCHEMA_TEXT_COLUMN, SCHEMA_CODE_COLUMN)
+        return cls(
+            config.manifest,
+            *columns,
+            num_workers=config.num_workers,
+            verify_checksums=config.verify_checksums,
+            index=index,
+        )
+
+    def fingerprint(self) -> str:
+        """Identify what an iteration would yield: manifest contents, columns and, with an index, the ingest.
+
+        An index-filtered read stages keys as it goes, so it is never served
+        from an earlier materialisation.
+        """
+
+        ingest = self.index.ingest_id if self.index is not None else None
+        payload = json.dumps([manifest_fingerprint(self.manifest.path), self.columns, ingest])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def __iter__(self) -> Iterator[dict]:
+        started = time.perf_counter()
+        records = nbytes = 0
+        batches = self._serial() if self.num_workers == 1 else self._parallel()
+        for shard, batch, payload in batches:
+            if batch is None:
+                nbytes += payload
+                if self.index is not None:
+                    self.index.record(self.shard_stats.setdefault(str(shard.path), IngestStats(str(shard.path))))
+                continue
+            if self.index is not None:
+                keep = self.index.filter_new(payload)
+                stats = self.shard_stats.setdefault(str(shard.path), IngestStats(str(shard.path)))
+                stats.records += len(batch)
+                stats.new += int(keep.sum())
+                batch = [record for record, kept in zip(batch, keep) if kept]
+            records += len(batch)
+            yield from batch
+        elapsed = time.perf_counter() - started
+        LOGGER.info(
+            "Read %d records from %d shards of %s (%.1f MiB/s compressed)",
+            records,
+            len(self.manifest.files),
+            self.manifest.path,
+            nbytes / 2**20 / elapsed if elapsed > 0 else 0.0,
+        )
+
+    def _serial(self) -> Iterator[tuple]:
+        """Yield ``(shard, records, keys)`` per batch and ``(shard, None, bytes)`` when a shard ends."""
+
+        with_keys = self.index is not None
+        for shard in self.manifest.files:
+            for batch, keys in read_shard(shard, *self.columns, verify=self.verify_checksums, with_keys=with_keys):
+                yield shard, batch, keys
+            yield shard, None, shard.path.stat().st_size
+
+    def _parallel(self) -> Iterator[tuple]:
+        """Decode shard ``i`` on worker ``i % num_workers`` and drain the workers' queues round-robin."""
+
+        context = multiprocessing.get_context()
+        queues = [context.Queue(maxsize=_QUEUE_BATCHES) for _ in range(self.num_workers)]
+        workers = [
+            context.Process(
+                target=_decode_worker,
+                args=(
+                    self.manifest.files[index :: self.num_workers],
+                    self.columns,
+                    self.verify_checksums,
+                    self.index is not None,
+                    queues[index],
+                ),
+                daemon=True,
+            )
+            for index in range(self.num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for index, shard in enumerate(self.manifest.files):
+                slot = index % self.num_workers
+                while True:
+                    kind, payload = self._receive(queues[slot], workers[slot], shard)
+                    if kind == "batch":
+                        yield shard, *payload
+                    elif kind == "done":
+                        yield shard, None, payload
+                        break
+                    else:
+                        integrity, message = payload
+                        raise (ValueError if integrity else RuntimeError)(f"Reading {shard.path} failed: {message}")
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+            for shard_queue in queues:
+                shard_queue.close()
+
+    @staticmethod
+    def _receive(shard_queue: multiprocessing.Queue, worker, shard: ShardEntry) -> tuple:
+        while True:
+            try:
+                return shard_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not worker.is_alive() and shard_queue.empty():
+                    raise RuntimeError(f"Shard reader process exited with code {worker.exitcode} while reading {shard.path}")
@@ -0,0 +1,351 @@
+"""Per-stage throughput, memory and training-speed instrumentation.
+
+:class:`RunMetrics` times every stage of :func:`src.training.train.train`
+(wall and CPU seconds, peak RSS) and counts the records, bytes and tokens
+that flow through it. Lazily chained stages such as loading → preprocessing
+are metered as iterators, so each one's time is measured while its
+consumer pulls items. During training :class:`ThroughputMonitor` adds
+step time, tokens/s and model FLOPs utilisation to the ``Trainer`` logs,
+which also carry them to TensorBoard. Everything ends up in one JSON run
+report, optionally with the hottest functions found by
+:class:`SamplingProfiler`.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import signal
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from transformers import TrainerCallback
+
+from .config import MetricsConfig
+
+LOGGER = logging.getLogger(__name__)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MiB; 0.0 where ``resource`` is missing (Windows)."""
+
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    # ``ru_maxrss`` is KiB on Linux and bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+@dataclass
+class StageMetrics:
+    """Counters for one pipeline stage.
+
+    ``upstream`` names the stage that lazily feeds this one; its time is
+    included in ``wall_seconds`` and subtracted again in the report's
+    ``self_seconds``.
+    """
+
+    name: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    records: int = 0
+    bytes: int = 0
+    tokens: int = 0
+    peak_rss_mb: float = 0.0
+    upstream: Optional[str] = None
+
+    def rates(self, seconds: Optional[float] = None) -> Dict[str, float]:
+        seconds = seconds if seconds is not None else self.wall_seconds
+        if seconds <= 0:
+            return {}
+        rates = {"records_per_second": self.records / seconds, "bytes_per_second": self.bytes / seconds}
+        if self.tokens:
+            rates["tokens_per_second"] = self.tokens / seconds
+        return rates
+
+
+class SamplingProfiler:
+    """Statistical profiler driven by ``SIGPROF``.
+
+    Every ``interval`` seconds of process CPU time the main thread's stack is
+    sampled: the innermost frame counts towards a function's ``self``
+    samples and every distinct frame on the stack towards its ``total``.
+    The timer keeps running from the first :meth:`start` until :meth:`close`;
+    ticks outside a ``start``/``stop`` pair are ignored, so toggling around
+    short calls costs no timer resets. Only available where
+    ``signal.setitimer`` exists (not on Windows).
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.self_samples: Counter = Counter()
+        self.total_samples: Counter = Counter()
+        self.samples = 0
+        self._depth = 0
+        self._armed = False
+        self._previous_handler = None
+
+    @staticmethod
+    def available() -> bool:
+        return hasattr(signal, "setitimer")
+
+    def _sample(self, signum, frame) -> None:
+        if self._depth <= 0:
+            return
+        self.samples += 1
+        seen = set()
+        innermost = True
+        while frame is not None:
+            code = frame.f_code
+            key = f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+            if innermost:
+                self.self_samples[key] += 1
+                innermost = False
+            if key not in seen:
+                seen.add(key)
+                self.total_samples[key] += 1
+            frame = frame.f_back
+
+    def start(self) -> None:
+        """Start sampling; nested ``start``/``stop`` pairs are reference counted."""
+
+        if not self._armed:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            self._armed = True
+        self._depth += 1
+
+    def stop(self) -> None:
+        self._depth -= 1
+
+    def close(self) -> None:
+        """Disarm the timer and restore the previous ``SIGPROF`` handler."""
+
+        if self._armed:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+            self._armed = False
+
+    def report(self, top: int = 30) -> Dict[str, Any]:
+        def ranked(counter: Counter) -> List[Dict[str, Any]]:
+            return [
+                {"function": key, "samples": count, "fraction": count / self.samples}
+                for key, count in counter.most_common(top)
+            ]
+
+        return {
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "self": ranked(self.self_samples),
+            "total": ranked(self.total_samples),
+        }
+
+
+class RunMetrics:
+    """Collects :class:`StageMetrics` for a run and writes the JSON/TensorBoard report."""
+
+    def __init__(self, config: Optional[MetricsConfig] = None) -> None:
+        self.config = config or MetricsConfig()
+        self.stages: Dict[str, StageMetrics] = {}
+        self.training: Dict[str, Any] = {}
+        self.started = time.perf_counter()
+        self.profiler: Optional[SamplingProfiler] = None
+        if self.config.profile:
+            if SamplingProfiler.available():
+                self.profiler = SamplingProfiler(self.config.profile_interval_ms / 1000)
+            else:
+                LOGGER.warning("Sampling profiler needs signal.setitimer; profiling is disabled on this platform.")
+
+    def _get(self, name: str) -> StageMetrics:
+        return self.stages.setdefault(name, StageMetrics(name=name))
+
+    def _profiles(self, name: str) -> bool:
+        stages = self.config.profile_stages
+        return self.profiler is not None and (stages is None or name in stages)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMetrics]:
+        """Time the enclosed block as stage ``name`` and yield its counters."""
+
+        stage = self._get(name)
+        profiling = self._profiles(name)
+        if profiling:
+            self.profiler.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall_seconds += time.perf_counter() - wall
+            stage.cpu_seconds += time.process_time() - cpu
+            stage.peak_rss_mb = max(stage.peak_rss_mb, peak_rss_mb())
+            if profiling:
+                self.profiler.stop()
+            LOGGER.info("Stage %s: %s", name, _summary(stage))
+
+    def meter(
+        self,
+        name: str,
+        items: Iterable[Any],
+        size: Optional[Callable[[Any], int]] = None,
+        upstream: Optional[str] = None,
+    ) -> Iterator[Any]:
+        """Count ``items`` (and ``size(item)`` bytes) as stage ``name`` while a consumer iterates them.
+
+        Only the time spent producing items is charged to the stage; time the
+        consumer spends between items is not.
+        """
+
+        stage = self._get(name)
+        stage.upstream = upstream
+        profiling = self._profiles(name)
+        iterator = iter(items)
+        while True:
+            if profiling:
+                self.profiler.start()
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                stage.wall_seconds += time.perf_counter() - wall
+                stage.cpu_seconds += time.process_time() - cpu
+                if profiling:
+                    self.profiler.stop()
+            stage.records += 1
+            if size is not None:
+                stage.bytes += size(item)
+            yield item
+        stage.peak_rss_mb = max(stage.peak_rss_mb, peak_rss_mb())
+        LOGGER.info("Stage %s: %s", name, _summary(stage))
+
+    def report(self) -> Dict[str, Any]:
+        stages = []
+        for stage in self.stages.values():
+            entry = asdict(stage)
+            upstream = self.stages.get(stage.upstream) if stage.upstream else None
+            entry["self_seconds"] = stage.wall_seconds - (upstream.wall_seconds if upstream else 0.0)
+            entry.update(stage.rates())
+            stages.append(entry)
+        report: Dict[str, Any] = {
+            "wall_seconds": time.perf_counter() - self.started,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": stages,
+        }
+        if self.training:
+            report["training"] = self.training
+        if self.profiler is not None:
+            report["profile"] = self.profiler.report(self.config.profile_top)
+        return report
+
+    def close(self) -> None:
+        """Stop the profiler, if any; counters stay available for the report."""
+
+        if self.profiler is not None:
+            self.profiler.close()
+
+    def write_report(self, path: str | Path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.report(), indent=2))
+        LOGGER.info("Wrote run report to %s", path)
+        return path
+
+    def write_tensorboard(self, log_dir: str | Path) -> None:
+        """Log each stage's timings and rates as ``pipeline/<stage>/<metric>`` scalars."""
+
+        try:
+            from torch.utils.tensorboard import SummaryWriter
+        except ImportError:
+            LOGGER.warning("tensorboard is not installed; skipping pipeline metrics export.")
+            return
+        writer = SummaryWriter(log_dir=str(log_dir))
+        try:
+            for entry in self.report()["stages"]:
+                for key in ("wall_seconds", "self_seconds", "cpu_seconds", "peak_rss_mb", "records_per_second", "bytes_per_second", "tokens_per_second"):
+                    if key in entry:
+                        writer.add_scalar(f"pipeline/{entry['name']}/{key}", entry[key], 0)
+        finally:
+            writer.close()
+
+
+def _summary(stage: StageMetrics) -> str:
+    parts = [f"{stage.wall_seconds:.2f}s wall", f"{stage.cpu_seconds:.2f}s cpu", f"{stage.peak_rss_mb:.0f} MiB peak RSS"]
+    rates = stage.rates()
+    if stage.records:
+        parts.append(f"{stage.records} records ({rates.get('records_per_second', 0):.1f}/s)")
+    if stage.bytes:
+        parts.append(f"{rates.get('bytes_per_second', 0) / 2**20:.2f} MiB/s")
+    if stage.tokens:
+        parts.append(f"{stage.tokens} tokens ({rates.get('tokens_per_second', 0):.1f}/s)")
+    return ", ".join(parts)
+
+
+class ThroughputMonitor(TrainerCallback):
+    """Trainer callback measuring optimizer-step time, tokens/s and MFU.
+
+    The trainer reports the non-padding tokens of every micro-batch through
+    :meth:`add_tokens`. ``log_values`` returns the averages since the previous
+    log and is merged into the trainer's logs. MFU uses ``6 * num_parameters``
+    FLOPs per token (forward + backward, recomputation excluded) against
+    ``peak_tflops`` per device, and is omitted when that is unknown.
+    """
+
+    def __init__(self, num_parameters: int, peak_tflops: Optional[float] = None, num_devices: int = 1) -> None:
+        self.num_parameters = num_parameters
+        self.peak_flops = peak_tflops * 1e12 * num_devices if peak_tflops else None
+        self.total_tokens = 0
+        self.total_steps = 0
+        self.total_seconds = 0.0
+        self._window_tokens = 0
+        self._window_steps = 0
+        self._window_seconds = 0.0
+        self._step_started: Optional[float] = None
+
+    def add_tokens(self, count: int) -> None:
+        self._window_tokens += count
+        self.total_tokens += count
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._step_started = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self._step_started is None:
+            return
+        elapsed = time.perf_counter() - self._step_started
+        self._window_seconds += elapsed
+        self._window_steps += 1
+        self.total_seconds += elapsed
+        self.total_steps += 1
+        self._step_started = None
+
+    def _rates(self, tokens: int, steps: int, seconds: float) -> Dict[str, float]:
+        if not steps or seconds <= 0:
+            return {}
+        tokens = int(tokens)
+        values = {"step_time": seconds / steps, "tokens_per_second": tokens / seconds}
+        if self.peak_flops:
+            values["mfu"] = 6 * self.num_parameters * values["tokens_per_second"] / self.peak_flops
+        return values
+
+    def log_values(self) -> Dict[str, float]:
+        values = self._rates(self._window_tokens, self._window_steps, self._window_seconds)
+        if values:
+            values["peak_rss_mb"] = peak_rss_mb()
+        self._window_tokens, self._window_steps, self._window_seconds = 0, 0, 0.0
+        return values
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "steps": self.total_steps,
+            "tokens": int(self.total_tokens),
+            "step_seconds": self.total_seconds,
+            "num_parameters": self.num_parameters,
+            **self._rates(self.total_tokens, self.total_steps, self.total_seconds),
+        }
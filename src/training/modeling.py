@@ -1,7 +1,8 @@
 """Model construction helpers for the Codex-like system."""
 from __future__ import annotations
 
-from typing import Iterable, Optional
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
 
 import torch
 from torch import nn
@@ -13,11 +14,29 @@ from transformers import (
 )
 from transformers.modeling_outputs import CausalLMOutputWithCrossAttentions
 
-from .config import ModelConfig, TokenizerConfig
+from .config import GenerationConfig, ModelConfig, TokenizerConfig
 from .decoder import CodeDecoder
 from .encoder import CodeEncoder
+from .generation import generate
+from .loss import chunked_causal_lm_loss
 from .tokenizer import build_custom_tokenizer
 
+_EMBEDDING_KEY = "encoder.token_embeddings.weight"
+_TIED_LM_HEAD_KEY = "decoder.lm_head.weight"
+_CHECKPOINT_FILES = ("model.safetensors", "pytorch_model.bin")
+# Training saves the tokenizer to this subdirectory of every checkpoint and of ``output_dir``.
+CHECKPOINT_TOKENIZER_DIR = "tokenizer"
+
+
+def _drop_tied_weight(module: nn.Module, state_dict: dict, prefix: str, local_metadata: dict) -> None:
+    # safetensors refuses aliased tensors, so the tied head is stored once.
+    state_dict.pop(prefix + _TIED_LM_HEAD_KEY, None)
+
+
+def _restore_tied_weight(module: nn.Module, state_dict: dict, prefix: str, *_: object) -> None:
+    if prefix + _EMBEDDING_KEY in state_dict:
+        state_dict.setdefault(prefix + _TIED_LM_HEAD_KEY, state_dict[prefix + _EMBEDDING_KEY])
+
 
 class CodexLikeCausalLM(nn.Module):
     """Minimal causal language model composed of custom encoder + decoder."""
@@ -30,10 +49,16 @@ class CodexLikeCausalLM(nn.Module):
             raise ValueError(
                 "Decoder hidden size must match encoder hidden size for weight tying."
             )
-        self.encoder = CodeEncoder(config.encoder, vocab_size=vocab_size)
+        self.encoder = CodeEncoder(
+            config.encoder,
+            vocab_size=vocab_size,
+            use_flash_attention=config.use_flash_attention,
+        )
         self.decoder = CodeDecoder(config.decoder, hidden_size=config.encoder.hidden_size, vocab_size=vocab_size)
         if config.decoder.tie_embeddings:
             self.decoder.lm_head.weight = self.encoder.embedding_weight
+            self.register_state_dict_post_hook(_drop_tied_weight)
+            self.register_load_state_dict_pre_hook(_restore_tied_weight)
         self.loss_fn = nn.CrossEntropyLoss(ignore_index=-100)
 
     def forward(
@@ -41,9 +66,25 @@ class CodexLikeCausalLM(nn.Module):
         input_ids: torch.LongTensor,
         attention_mask: Optional[torch.LongTensor] = None,
         labels: Optional[torch.LongTensor] = None,
+        position_ids: Optional[torch.LongTensor] = None,
+        segment_ids: Optional[torch.LongTensor] = None,
+        return_logits: Optional[bool] = None,
         **_: dict,
     ) -> CausalLMOutputWithCrossAttentions:
-        hidden_states = self.encoder(input_ids=input_ids, attention_mask=attention_mask)
+        """Run the model; ``return_logits`` defaults to ``True`` unless the chunked loss is used."""
+
+        hidden_states = self.encoder(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            segment_ids=segment_ids,
+        )
+        chunk_size = self.config.decoder.loss_chunk_size
+        if labels is not None and chunk_size:
+            loss = chunked_causal_lm_loss(hidden_states, self.decoder.lm_head.weight, labels, chunk_size)
+            logits = self.decoder(hidden_states) if return_logits else None
+            return CausalLMOutputWithCrossAttentions(loss=loss, logits=logits)
+
         logits = self.decoder(hidden_states)
 
         loss = None
@@ -57,17 +98,52 @@ class CodexLikeCausalLM(nn.Module):
 
         return CausalLMOutputWithCrossAttentions(loss=loss, logits=logits)
 
+    @property
+    def is_gradient_checkpointing(self) -> bool:
+        return self.encoder.checkpoint_policy is not None
+
+    def gradient_checkpointing_enable(self, gradient_checkpointing_kwargs: Optional[dict] = None, **_: dict) -> None:
+        """Enable the checkpointing policy from :class:`ModelConfig`.
+
+        Matches the ``PreTrainedModel`` hook that ``Trainer`` calls; its
+        keyword arguments are accepted for compatibility and ignored.
+        """
+
+        self.encoder.enable_checkpointing(
+            policy=self.config.checkpoint_policy,
+            every=self.config.checkpoint_every,
+            offload=self.config.offload_activations,
+        )
+
+    def gradient_checkpointing_disable(self) -> None:
+        self.encoder.disable_checkpointing()
+
+    def generate(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: Optional[torch.LongTensor] = None,
+        config: Optional[GenerationConfig] = None,
+    ) -> torch.LongTensor:
+        """Sample a continuation of ``input_ids`` using a key/value cache; see :func:`generate`."""
+
+        return generate(self, input_ids, attention_mask=attention_mask, config=config)
+
 
 def build_tokenizer(
     config: TokenizerConfig,
-    corpus: Optional[Iterable[str]] = None,
+    corpus: Optional[Iterable[str] | Iterable[List[str]]] = None,
+    holdout: Optional[Sequence[str]] = None,
 ) -> PreTrainedTokenizerBase:
-    """Load or train a tokenizer with sensible defaults for code."""
+    """Load or train a tokenizer with sensible defaults for code.
+
+    ``holdout`` is forwarded to :func:`build_custom_tokenizer` when ``corpus``
+    is a sampled training set.
+    """
 
     if config.use_custom:
         if corpus is None:
             raise ValueError("A text corpus is required when ``use_custom`` tokenizer mode is enabled.")
-        tokenizer = build_custom_tokenizer(config, corpus=corpus)
+        tokenizer = build_custom_tokenizer(config, corpus=corpus, holdout=holdout)
     elif config.pretrained:
         tokenizer = AutoTokenizer.from_pretrained(config.pretrained, use_fast=True)
     else:
@@ -89,11 +165,40 @@ def build_tokenizer(
     return tokenizer
 
 
+def checkpoint_tokenizer_path(checkpoint: str | Path) -> Path:
+    """Where a checkpoint's tokenizer lives: its ``tokenizer`` subdirectory if present, else the checkpoint."""
+
+    nested = Path(checkpoint) / CHECKPOINT_TOKENIZER_DIR
+    return nested if nested.is_dir() else Path(checkpoint)
+
+
+def load_checkpoint_weights(model: nn.Module, checkpoint: str | Path) -> nn.Module:
+    """Load a ``Trainer`` checkpoint (directory or weights file) into ``model``."""
+
+    path = Path(checkpoint)
+    if path.is_dir():
+        candidates = [path / name for name in _CHECKPOINT_FILES if (path / name).exists()]
+        if not candidates:
+            raise FileNotFoundError(f"No {' or '.join(_CHECKPOINT_FILES)} found in {path}")
+        path = candidates[0]
+    if path.suffix == ".safetensors":
+        from safetensors.torch import load_file
+
+        state_dict = load_file(str(path))
+    else:
+        state_dict = torch.load(path, map_location="cpu", weights_only=True)
+    model.load_state_dict(state_dict)
+    return model
+
+
 def build_model(config: ModelConfig, tokenizer: PreTrainedTokenizerBase) -> PreTrainedModel | nn.Module:
     """Instantiate the language model, supporting custom and pretrained variants."""
 
     if config.use_custom_architecture:
-        return CodexLikeCausalLM(config=config, tokenizer=tokenizer)
+        model = CodexLikeCausalLM(config=config, tokenizer=tokenizer)
+        if config.gradient_checkpointing:
+            model.gradient_checkpointing_enable()
+        return model
 
     if not config.pretrained:
         raise ValueError("A pretrained checkpoint is required when ``use_custom_architecture`` is False.")
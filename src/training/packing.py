@@ -0,0 +1,144 @@
+"""Pack tokenized documents into fixed-length blocks for causal LM training."""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from datasets import Dataset, Features, Sequence, Value
+
+from .config import PackingConfig
+from .pipeline import write_arrow
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class PackingStats:
+    """Counters describing how densely documents filled the packed blocks."""
+
+    documents: int = 0
+    blocks: int = 0
+    tokens: int = 0
+    padding: int = 0
+
+    @property
+    def fill_ratio(self) -> float:
+        total = self.tokens + self.padding
+        return self.tokens / total if total else 0.0
+
+
+def packed_features(config: PackingConfig) -> Features:
+    columns: Dict[str, Sequence] = {
+        "input_ids": Sequence(Value("int32")),
+        "ignore_spans": Sequence(Value("int32")),
+    }
+    if config.reset_position_ids:
+        columns["position_ids"] = Sequence(Value("int32"))
+    if config.document_attention:
+        columns["segment_ids"] = Sequence(Value("int32"))
+    return Features(columns)
+
+
+def _spans_to_mask(spans: List[int], length: int) -> List[bool]:
+    masked = [False] * length
+    for start, end in zip(spans[::2], spans[1::2]):
+        masked[start:end] = [True] * (end - start)
+    return masked
+
+
+def _mask_to_spans(masked: List[bool]) -> List[int]:
+    spans: List[int] = []
+    for idx, flag in enumerate(masked):
+        if flag and (idx == 0 or not masked[idx - 1]):
+            spans.append(idx)
+        if flag and (idx == len(masked) - 1 or not masked[idx + 1]):
+            spans.append(idx + 1)
+    return spans
+
+
+def pack_sequences(
+    rows: Iterable[dict],
+    config: PackingConfig,
+    block_size: int,
+    eos_token_id: int,
+    stats: Optional[PackingStats] = None,
+) -> Iterator[dict]:
+    """Concatenate documents separated by ``eos_token_id`` into ``block_size`` rows.
+
+    A row's ``ignore_spans`` (flattened ``[start, end)`` pairs excluded from
+    the loss) are re-based onto the packed rows. A document that straddles two
+    blocks keeps counting positions in the second block. ``segment_ids`` number
+    the documents within each block so attention can be restricted to a single
+    document. Only the final block may be shorter; the collator pads it.
+    """
+
+    stats = stats if stats is not None else PackingStats()
+    buffers: Dict[str, list] = {"input_ids": [], "masked": [], "position_ids": [], "segment_ids": []}
+    segment = 0
+
+    def _emit(length: int) -> dict:
+        block = {key: values[:length] for key, values in buffers.items()}
+        for values in buffers.values():
+            del values[:length]
+        row = {"input_ids": block["input_ids"], "ignore_spans": _mask_to_spans(block["masked"])}
+        if config.reset_position_ids:
+            row["position_ids"] = block["position_ids"]
+        if config.document_attention:
+            # Renumber segments so every block starts counting from zero.
+            first = block["segment_ids"][0]
+            row["segment_ids"] = [value - first for value in block["segment_ids"]]
+        stats.blocks += 1
+        return row
+
+    for row in rows:
+        ids = list(row["input_ids"])
+        if not ids:
+            continue
+        masked = _spans_to_mask(list(row.get("ignore_spans") or []), len(ids))
+        if ids[-1] != eos_token_id:
+            ids.append(eos_token_id)
+            masked.append(False)
+        buffers["input_ids"].extend(ids)
+        buffers["masked"].extend(masked)
+        buffers["position_ids"].extend(range(len(ids)))
+        buffers["segment_ids"].extend([segment] * len(ids))
+        segment += 1
+        stats.documents += 1
+        stats.tokens += len(ids)
+        while len(buffers["input_ids"]) >= block_size:
+            yield _emit(block_size)
+
+    if buffers["input_ids"]:
+        stats.padding += block_size - len(buffers["input_ids"])
+        yield _emit(len(buffers["input_ids"]))
+
+
+def pack_dataset(
+    dataset: Dataset,
+    config: PackingConfig,
+    tokenizer,
+    path: str | Path,
+    writer_batch_size: int = 1000,
+) -> Dataset:
+    """Pack a tokenized dataset into an Arrow file of fixed-length blocks."""
+
+    block_size = config.block_size or tokenizer.model_max_length
+    if tokenizer.eos_token_id is None:
+        raise ValueError("Sequence packing requires the tokenizer to define an eos token.")
+    stats = PackingStats()
+    packed = write_arrow(
+        pack_sequences(dataset, config, block_size, tokenizer.eos_token_id, stats),
+        path,
+        packed_features(config),
+        writer_batch_size,
+    )
+    LOGGER.info(
+        "Packed %d documents into %d blocks of %d tokens (%.2f%% non-pad)",
+        stats.documents,
+        stats.blocks,
+        block_size,
+        100 * stats.fill_ratio,
+    )
+    return packed
@@ -0,0 +1,273 @@
+"""Lazy preprocess → chunk → Arrow stages for building the training corpus."""
+from __future__ import annotations
+
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from datasets import Dataset, Features, Value
+from datasets.arrow_writer import ArrowWriter
+
+from .chunker import CodeChunker
+from .config import ChunkerConfig, DedupConfig, PreprocessorConfig
+from .dedup import MinHashDeduplicator
+from .preprocess import CodePreprocessor
+
+LOGGER = logging.getLogger(__name__)
+
+CORPUS_FEATURES = Features({"text": Value("string")})
+
+
+@dataclass
+class WorkerStats:
+    """Throughput counters accumulated for a single preprocessing worker."""
+
+    pid: int
+    batches: int = 0
+    records: int = 0
+    characters: int = 0
+    busy_seconds: float = 0.0
+
+    @property
+    def records_per_second(self) -> float:
+        return self.records / self.busy_seconds if self.busy_seconds else 0.0
+
+    @property
+    def characters_per_second(self) -> float:
+        return self.characters / self.busy_seconds if self.busy_seconds else 0.0
+
+
+@dataclass
+class _BatchResult:
+    """Chunks (grouped per record) and bookkeeping for one processed batch."""
+
+    chunks: List[List[str]]
+    lengths: List[int]
+    band_keys: Optional[np.ndarray]
+    word_counts: Optional[np.ndarray]
+    pid: int
+    records: int
+    characters: int
+    elapsed: float
+
+
+_WORKER_PIPELINE: Optional[Tuple[CodePreprocessor, CodeChunker, Optional[MinHashDeduplicator]]] = None
+
+
+def _init_worker(
+    preprocessor_config: PreprocessorConfig,
+    chunker_config: ChunkerConfig,
+    dedup_config: Optional[DedupConfig],
+) -> None:
+    global _WORKER_PIPELINE
+    _WORKER_PIPELINE = (
+        CodePreprocessor(preprocessor_config),
+        CodeChunker(chunker_config),
+        # Only the stateless signature half runs here; the index stays in the parent.
+        MinHashDeduplicator(dedup_config) if dedup_config is not None else None,
+    )
+
+
+def _process_records(
+    preprocessor: CodePreprocessor,
+    chunker: CodeChunker,
+    deduplicator: Optional[MinHashDeduplicator],
+    batch: List[Tuple[str, str]],
+) -> _BatchResult:
+    started = time.perf_counter()
+    normalized = [preprocessor(text, code) for text, code in batch]
+    band_keys, word_counts = deduplicator.band_keys(normalized) if deduplicator is not None else (None, None)
+    return _BatchResult(
+        chunks=[list(chunker(document)) for document in normalized],
+        lengths=[len(document) for document in normalized],
+        band_keys=band_keys,
+        word_counts=word_counts,
+        pid=os.getpid(),
+        records=len(batch),
+        characters=sum(len(text) + len(code) for text, code in batch),
+        elapsed=time.perf_counter() - started,
+    )
+
+
+def _process_batch(batch: List[Tuple[str, str]]) -> _BatchResult:
+    assert _WORKER_PIPELINE is not None, "worker initializer did not run"
+    return _process_records(*_WORKER_PIPELINE, batch)
+
+
+def _iter_record_batches(
+    records: Iterable[dict],
+    text_column: str,
+    code_column: Optional[str],
+    batch_size: int,
+) -> Iterator[List[Tuple[str, str]]]:
+    pairs = (
+        (item.get(text_column) or "", (item.get(code_column) or "") if code_column else "")
+        for item in records
+    )
+    while True:
+        batch = list(islice(pairs, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _prepare_corpus_parallel(
+    records: Iterable[dict],
+    preprocessor: CodePreprocessor,
+    chunker: CodeChunker,
+    deduplicator: Optional[MinHashDeduplicator],
+    text_column: str,
+    code_column: Optional[str],
+    worker_stats: Dict[int, WorkerStats],
+) -> Iterator[str]:
+    """Fan record batches out to a process pool and yield chunks in input order.
+
+    Results are consumed strictly in submission order, so the output matches the
+    serial path exactly. At most ``2 * num_workers`` batches are in flight, which
+    keeps memory bounded even when ``records`` is an unbounded stream.
+    """
+
+    config = preprocessor.config
+    max_in_flight = 2 * config.num_workers
+    batches = _iter_record_batches(records, text_column, code_column, config.worker_batch_size)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=config.num_workers,
+        initializer=_init_worker,
+        initargs=(config, chunker.config, deduplicator.config if deduplicator is not None else None),
+    ) as executor:
+        pending: Deque[Future[_BatchResult]] = deque()
+        for batch in batches:
+            pending.append(executor.submit(_process_batch, batch))
+            if len(pending) < max_in_flight:
+                continue
+            yield from _collect(pending.popleft().result(), deduplicator, worker_stats)
+        while pending:
+            yield from _collect(pending.popleft().result(), deduplicator, worker_stats)
+    _log_worker_stats(worker_stats, time.perf_counter() - started)
+
+
+def _collect(
+    result: _BatchResult,
+    deduplicator: Optional[MinHashDeduplicator],
+    worker_stats: Dict[int, WorkerStats],
+) -> Iterator[str]:
+    stats = worker_stats.setdefault(result.pid, WorkerStats(pid=result.pid))
+    stats.batches += 1
+    stats.records += result.records
+    stats.characters += result.characters
+    stats.busy_seconds += result.elapsed
+    if deduplicator is None or result.band_keys is None:
+        keep = [True] * result.records
+    else:
+        keep = deduplicator.filter(result.band_keys, result.word_counts, result.lengths)
+    for chunks, kept in zip(result.chunks, keep):
+        if kept:
+            yield from chunks
+
+
+def _log_worker_stats(worker_stats: Dict[int, WorkerStats], wall_seconds: float) -> None:
+    total_records = sum(stats.records for stats in worker_stats.values())
+    for stats in sorted(worker_stats.values(), key=lambda item: item.pid):
+        LOGGER.info(
+            "Worker %d: %d records in %d batches, %.1f records/s, %.1f chars/s",
+            stats.pid,
+            stats.records,
+            stats.batches,
+            stats.records_per_second,
+            stats.characters_per_second,
+        )
+    if wall_seconds > 0:
+        LOGGER.info(
+            "Preprocessed %d records with %d workers at %.1f records/s",
+            total_records,
+            len(worker_stats),
+            total_records / wall_seconds,
+        )
+
+
+def prepare_corpus(
+    records: Iterable[dict],
+    preprocessor: CodePreprocessor,
+    chunker: CodeChunker,
+    text_column: str = "text",
+    code_column: Optional[str] = "code",
+    worker_stats: Optional[Dict[int, WorkerStats]] = None,
+    deduplicator: Optional[MinHashDeduplicator] = None,
+) -> Iterator[str]:
+    """Yield normalized + chunked samples one at a time.
+
+    When ``preprocessor.config.num_workers`` is greater than one the work runs
+    in a process pool; pass a dict as ``worker_stats`` to receive the per-worker
+    throughput counters keyed by process id. A ``deduplicator`` drops
+    near-duplicate documents after preprocessing and before chunking.
+    """
+
+    if preprocessor.config.num_workers > 1:
+        yield from _prepare_corpus_parallel(
+            records,
+            preprocessor,
+            chunker,
+            deduplicator,
+            text_column,
+            code_column,
+            worker_stats if worker_stats is not None else {},
+        )
+    elif deduplicator is not None:
+        # Signatures are computed per batch so the MinHash maths stays vectorised.
+        stats = worker_stats if worker_stats is not None else {}
+        for batch in _iter_record_batches(records, text_column, code_column, preprocessor.config.worker_batch_size):
+            yield from _collect(_process_records(preprocessor, chunker, deduplicator, batch), deduplicator, stats)
+    else:
+        for item in records:
+            text = item.get(text_column, "")
+            code = item.get(code_column, "") if code_column else ""
+            normalized = preprocessor(text, code)
+            yield from chunker(normalized)
+
+    if deduplicator is not None:
+        deduplicator.log_stats()
+
+
+def write_arrow(
+    rows: Iterable[dict],
+    path: str | Path,
+    features: Features,
+    writer_batch_size: int = 1000,
+) -> Dataset:
+    """Stream ``rows`` into an Arrow file and return it memory-mapped.
+
+    Rows are flushed to disk every ``writer_batch_size`` examples, so at most
+    one record batch of Python objects is alive at any time.
+    """
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = ArrowWriter(features=features, path=str(path), writer_batch_size=writer_batch_size)
+    try:
+        for row in rows:
+            writer.write(row)
+        writer.finalize()
+    finally:
+        writer.close()
+    return Dataset.from_file(str(path))
+
+
+def write_corpus(chunks: Iterable[str], path: str | Path, writer_batch_size: int = 1000) -> Dataset:
+    """Stream text ``chunks`` into a single-column Arrow corpus file."""
+
+    return write_arrow(({"text": chunk} for chunk in chunks), path, CORPUS_FEATURES, writer_batch_size)
+
+
+def iter_text_batches(dataset: Dataset, column: str = "text", batch_size: int = 1000) -> Iterator[List[str]]:
+    """Yield ``batch_size`` slices of ``column`` from a memory-mapped dataset."""
+
+    for start in range(0, len(dataset), batch_size):
+        yield dataset[start : start + batch_size][column]
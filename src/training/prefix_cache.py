@@ -0,0 +1,192 @@
+"""Radix-tree cache of prompt-prefix key/value states for the custom model.
+
+Completion traffic keeps resending the same file prefix with a small
+suffix change. :class:`PrefixCache` stores the per-layer keys and values of
+previously seen prompts in a radix tree keyed on token ids. A new prompt
+copies the KV of its longest cached prefix into its :class:`KVCache` row,
+so only the tokens after that prefix go through the model. Leaves are
+evicted least-recently-used first once the stored tensors exceed
+``max_bytes``.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from .generation import KVCache
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _Node:
+    """A radix-tree edge: ``tokens`` plus their ``(layers, heads, len(tokens), head_dim)`` keys and values."""
+
+    __slots__ = ("tokens", "keys", "values", "children", "parent", "last_access")
+
+    def __init__(
+        self,
+        tokens: Tuple[int, ...],
+        keys: Optional[torch.Tensor],
+        values: Optional[torch.Tensor],
+        parent: Optional["_Node"],
+    ) -> None:
+        self.tokens = tokens
+        self.keys = keys
+        self.values = values
+        self.children: Dict[int, _Node] = {}
+        self.parent = parent
+        self.last_access = 0
+
+    @property
+    def nbytes(self) -> int:
+        if self.keys is None:
+            return 0
+        return self.keys.numel() * self.keys.element_size() * 2
+
+
+def _common_length(left: Sequence[int], right: Sequence[int]) -> int:
+    length = 0
+    for a, b in zip(left, right):
+        if a != b:
+            break
+        length += 1
+    return length
+
+
+class PrefixCache:
+    """Token-prefix → KV radix tree with LRU eviction under a byte budget.
+
+    ``load`` fills a cache row with the longest stored prefix of a prompt and
+    ``store`` records a prompt once its row has been prefilled. Hit counters
+    are kept for :meth:`stats`.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.root = _Node((), None, None, None)
+        self.nbytes = 0
+        self._clock = itertools.count(1)
+        self.requests = 0
+        self.hit_requests = 0
+        self.prompt_tokens = 0
+        self.hit_tokens = 0
+        self.evictions = 0
+
+    def _match(self, tokens: Sequence[int]) -> List[Tuple[_Node, int]]:
+        """Return ``(node, matched tokens of its edge)`` along the longest stored prefix."""
+
+        node, position, pieces = self.root, 0, []
+        tick = next(self._clock)
+        while position < len(tokens):
+            child = node.children.get(tokens[position])
+            if child is None:
+                break
+            matched = _common_length(child.tokens, tokens[position:])
+            child.last_access = tick
+            pieces.append((child, matched))
+            position += matched
+            if matched < len(child.tokens):
+                break
+            node = child
+        return pieces
+
+    def load(self, cache: KVCache, row: int, tokens: Sequence[int], limit: Optional[int] = None) -> int:
+        """Copy the KV of ``tokens``' longest stored prefix (at most ``limit`` tokens) into ``cache`` row ``row``.
+
+        Sets ``cache.lengths[row]`` to the number of tokens loaded and returns it.
+        """
+
+        self.requests += 1
+        self.prompt_tokens += len(tokens)
+        offset = 0
+        for node, matched in self._match(tokens[:limit] if limit is not None else tokens):
+            for layer, (keys, values) in enumerate(zip(cache.keys, cache.values)):
+                keys[row, :, offset : offset + matched] = node.keys[layer, :, :matched]
+                values[row, :, offset : offset + matched] = node.values[layer, :, :matched]
+            offset += matched
+        cache.lengths[row] = offset
+        if offset:
+            self.hit_requests += 1
+            self.hit_tokens += offset
+        return offset
+
+    def store(self, cache: KVCache, row: int, tokens: Sequence[int]) -> None:
+        """Record the KV of ``tokens``, which must occupy the first positions of ``cache`` row ``row``."""
+
+        node, position = self.root, 0
+        tick = next(self._clock)
+        while position < len(tokens):
+            child = node.children.get(tokens[position])
+            if child is None:
+                child = _Node(
+                    tuple(tokens[position:]),
+                    torch.stack([keys[row, :, position : len(tokens)] for keys in cache.keys]),
+                    torch.stack([values[row, :, position : len(tokens)] for values in cache.values]),
+                    node,
+                )
+                node.children[tokens[position]] = child
+                self.nbytes += child.nbytes
+                child.last_access = tick
+                break
+            matched = _common_length(child.tokens, tokens[position:])
+            if matched < len(child.tokens):
+                child = self._split(child, matched)
+            child.last_access = tick
+            node, position = child, position + matched
+        self._evict()
+
+    def _split(self, node: _Node, length: int) -> _Node:
+        """Cut ``node``'s edge after ``length`` tokens and return the new upper node."""
+
+        # Clone both halves so neither keeps the other's storage alive.
+        upper = _Node(
+            node.tokens[:length],
+            node.keys[:, :, :length].clone(),
+            node.values[:, :, :length].clone(),
+            node.parent,
+        )
+        upper.last_access = node.last_access
+        node.parent.children[node.tokens[0]] = upper
+        node.tokens = node.tokens[length:]
+        node.keys = node.keys[:, :, length:].clone()
+        node.values = node.values[:, :, length:].clone()
+        node.parent = upper
+        upper.children[node.tokens[0]] = node
+        return upper
+
+    def _evict(self) -> None:
+        if self.nbytes <= self.max_bytes:
+            return
+        # Only leaves can go; a parent becomes evictable once its last child is gone.
+        leaves = [(node.last_access, id(node), node) for node in self._nodes() if not node.children]
+        heapq.heapify(leaves)
+        while self.nbytes > self.max_bytes and leaves:
+            _, _, node = heapq.heappop(leaves)
+            parent = node.parent
+            del parent.children[node.tokens[0]]
+            self.nbytes -= node.nbytes
+            self.evictions += 1
+            if parent is not self.root and not parent.children:
+                heapq.heappush(leaves, (parent.last_access, id(parent), parent))
+
+    def _nodes(self) -> List[_Node]:
+        nodes, stack = [], list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.children.values())
+        return nodes
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hit_rate": self.hit_requests / self.requests if self.requests else 0.0,
+            "token_hit_rate": self.hit_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "cached_tokens": sum(len(node.tokens) for node in self._nodes()),
+            "megabytes": self.nbytes / 2**20,
+            "evictions": self.evictions,
+        }
@@ -1,15 +1,126 @@
-"""Preprocessing utilities tailored for code + natural language mixtures."""
+"""Preprocessing utilities tailored for code + natural language mixtures.
+
+The default ``"fused"`` normalizer skips every step that cannot change its
+input. NFKC is skipped for pure-ASCII strings, dedenting for code where no
+line is indented, and fence extraction for text without a fence. Comment
+stripping is one regex pass per document through a language-aware lexer that
+steps over string literals. The lexer's language comes from the code fence
+tag or the caller's/config's hint. The ``"legacy"`` normalizer keeps the
+original multi-pass implementation with its language-blind comment regexes.
+"""
 from __future__ import annotations
 
+import os
 import re
 import textwrap
 import unicodedata
-from typing import Iterable
+from typing import Iterable, Optional, Tuple
 
 from .config import PreprocessorConfig
 
 
 _CODE_BLOCK_RE = re.compile(r"```(?P<lang>\w+)?\n(?P<body>.*?)(```|$)", re.DOTALL)
+# The same blocks as ``_CODE_BLOCK_RE``, matched without a lazy per-character ``.*?``.
+_FENCE_RE = re.compile(r"```(?P<lang>\w+)?\n(?P<body>[^`]*(?:`(?!``)[^`]*)*)(?:```)?")
+_WHITESPACE_ONLY_RE = re.compile(r"\n[ \t]+(?=\n|$)")
+_INDENT_RE = re.compile(r"\n([ \t]*)[^ \t\n]")
+
+# String literals in unrolled form (``[^"\\]*(?:\\.[^"\\]*)*``): the regex engine
+# then spends one step per run of plain characters instead of one per character.
+_DOUBLE = r'"[^"\\\n]*(?:\\[\s\S][^"\\\n]*)*"'
+_SINGLE = r"'[^'\\\n]*(?:\\[\s\S][^'\\\n]*)*'"
+_TRIPLE_DOUBLE = r'"""[^"\\]*(?:(?:\\[\s\S]|"(?!""))[^"\\]*)*"""'
+_TRIPLE_SINGLE = r"'''[^'\\]*(?:(?:\\[\s\S]|'(?!''))[^'\\]*)*'''"
+_BLOCK_COMMENT = r"/\*[\s\S]*?\*/"
+# ``#`` only opens a shell comment at the start of a word: ``$#``, ``${#x}`` and URL fragments stay.
+_WORD_HASH_COMMENT = r"(?<![^\s;&|()<>])#[^\n]*"
+
+
+class _CommentLexer:
+    """Drop comments from code in one regex pass, stepping over string literals.
+
+    Every match is a run of code and strings (group 1) followed by at most one
+    comment, so ``sub(r"\\1", code)`` does one substitution per comment.
+    The trailing comment is optional, so a match never backtracks into the
+    run and plain greedy quantifiers behave like possessive ones.
+    ``special`` lists the characters that can open a string or a comment;
+    documents containing none of ``markers`` are returned untouched. Blanks
+    before a comment are kept, as in the legacy normalizer.
+    """
+
+    def __init__(self, strings: str, comment: str, special: str, markers: Tuple[str, ...]) -> None:
+        self.markers = markers
+        self.pattern = re.compile(rf"((?:[^{special}]+|{strings}|(?!{comment})[{special}])*)(?:{comment})?")
+
+    def strip(self, code: str) -> str:
+        if not any(marker in code for marker in self.markers):
+            return code
+        return self.pattern.sub(r"\1", code)
+
+
+_LEXERS = {
+    "python": _CommentLexer(f"{_TRIPLE_DOUBLE}|{_TRIPLE_SINGLE}|{_DOUBLE}|{_SINGLE}", r"#[^\n]*", "#\"'", ("#",)),
+    "shell": _CommentLexer(r"""'[^']*'|"[^"\\]*(?:\\[\s\S][^"\\]*)*"|\\[\s\S]""", _WORD_HASH_COMMENT, "#\"'\\\\", ("#",)),
+    "powershell": _CommentLexer(
+        r"""'[^']*(?:''[^']*)*'|"[^"`]*(?:`[\s\S][^"`]*)*\"""",
+        rf"<#[\s\S]*?#>|{_WORD_HASH_COMMENT}",
+        "#\"'<",
+        ("#",),
+    ),
+    # Single quotes are character literals here, so Rust lifetimes are not read as strings.
+    "c": _CommentLexer(
+        rf"""{_TRIPLE_DOUBLE}|{_DOUBLE}|'(?:\\[^\n]{{1,9}}?|[^\\'\n])'|`[^`]*`""",
+        rf"//[^\n]*|{_BLOCK_COMMENT}",
+        "/\"'`",
+        ("//", "/*"),
+    ),
+    "javascript": _CommentLexer(
+        rf"{_DOUBLE}|{_SINGLE}|`[^`\\]*(?:\\[\s\S][^`\\]*)*`",
+        rf"//[^\n]*|{_BLOCK_COMMENT}",
+        "/\"'`",
+        ("//", "/*"),
+    ),
+    "sql": _CommentLexer(
+        r"""'[^']*(?:''[^']*)*'|"[^"]*(?:""[^"]*)*\"""", rf"--[^\n]*|{_BLOCK_COMMENT}", "-/\"'", ("--", "/*")
+    ),
+    # Unknown languages: ``#`` and ``//`` comments that start a word, outside one-line strings.
+    "generic": _CommentLexer(f"{_DOUBLE}|{_SINGLE}", rf"{_WORD_HASH_COMMENT}|(?<!\S)//[^\n]*", "#/\"'", ("#", "//")),
+}
+_LANGUAGE_ALIASES = {
+    "python": ("python", "py", "python3", "py3", "ipython", "pycon"),
+    "shell": ("shell", "sh", "bash", "zsh", "ksh", "dash", "fish", "console", "shell-session", "terminal"),
+    "powershell": ("powershell", "ps1", "pwsh", "ps"),
+    "c": (
+        "c", "h", "cpp", "c++", "cc", "cxx", "hpp", "java", "cs", "csharp", "c#", "go", "golang",
+        "rust", "rs", "kotlin", "kt", "swift", "scala", "dart", "objc", "objective-c",
+    ),
+    "javascript": ("javascript", "js", "jsx", "mjs", "cjs", "typescript", "ts", "tsx"),
+    "sql": ("sql", "mysql", "postgresql", "postgres", "psql", "sqlite", "plsql", "tsql"),
+}
+_LEXER_BY_ALIAS = {alias: _LEXERS[name] for name, aliases in _LANGUAGE_ALIASES.items() for alias in aliases}
+
+
+def _lexer_for(language: Optional[str]) -> _CommentLexer:
+    return _LEXER_BY_ALIAS.get((language or "").lower(), _LEXERS["generic"])
+
+
+def _dedent(text: str) -> str:
+    """``textwrap.dedent`` that returns early when no line can be indented.
+
+    The line patterns are anchored on a literal ``\\n`` (the text gets one
+    prepended) so the regex engine can jump between newlines.
+    """
+
+    if not text or (text[0] not in " \t" and "\n " not in text and "\n\t" not in text):
+        return text
+    text = _WHITESPACE_ONLY_RE.sub("\n", "\n" + text)
+    if text[1:2] not in (" ", "\t", "\n"):
+        # A flush-left first line makes the common margin empty.
+        return text[1:]
+    margin = os.path.commonprefix(_INDENT_RE.findall(text))
+    if margin:
+        text = text.replace("\n" + margin, "\n")
+    return text[1:]
 
 
 class CodePreprocessor:
@@ -50,10 +161,7 @@ class CodePreprocessor:
         for match in _CODE_BLOCK_RE.finditer(text):
             yield match.group("body").strip("\n")
 
-    def __call__(self, text: str, code: str | None = None) -> str:
-        text = text or ""
-        code = code or ""
-
+    def _legacy(self, text: str, code: str) -> str:
         text = self._normalize_unicode(text)
         code = self._normalize_unicode(code)
 
@@ -73,3 +181,51 @@ class CodePreprocessor:
         normalized = "\n".join(filter(None, combined))
         normalized = self._ensure_trailing_newline(normalized)
         return normalized
+
+    def _normalize_fast(self, text: str) -> str:
+        # NFKC maps every ASCII string to itself, and ``isascii`` reads a flag CPython keeps per string.
+        if not self.config.normalize_unicode or text.isascii():
+            return text
+        return unicodedata.normalize("NFKC", text)
+
+    def _clean_code(self, code: str, language: Optional[str]) -> str:
+        if self.config.strip_comments:
+            code = _lexer_for(language).strip(code)
+        return _dedent(code) if self.config.dedent else code
+
+    def _fused(self, text: str, code: str, language: Optional[str]) -> str:
+        text = self._normalize_fast(text)
+        code = self._normalize_fast(code)
+        language = language or self.config.language
+
+        if code:
+            code = self._clean_code(code, language)
+        elif "```" in text:
+            code = "\n\n".join(
+                self._clean_code(match.group("body").strip("\n"), match.group("lang") or language)
+                for match in _FENCE_RE.finditer(text)
+            )
+        if self.config.collapse_whitespace:
+            text = " ".join(text.split())
+
+        if text and code:
+            normalized = f"<nl>{text}\n<code>\n{code}"
+        elif text:
+            normalized = f"<nl>{text}"
+        else:
+            normalized = f"<code>\n{code}" if code else ""
+        if self.config.ensure_trailing_newline and not normalized.endswith("\n"):
+            normalized += "\n"
+        return normalized
+
+    def __call__(self, text: str, code: str | None = None, language: Optional[str] = None) -> str:
+        """Combine ``text`` and ``code`` into one ``<nl>``/``<code>`` document.
+
+        ``language`` names the language of ``code`` (or of untagged fenced
+        blocks in ``text``) for comment stripping and defaults to
+        ``config.language``; the legacy normalizer ignores it.
+        """
+
+        if self.config.normalizer == "legacy":
+            return self._legacy(text or "", code or "")
+        return self._fused(text or "", code or "", language)
@@ -0,0 +1,375 @@
+"""Quantized CPU inference builds of :class:`CodexLikeCausalLM`.
+
+Linear layers, ``lm_head`` included, become dynamic int8 layers whose weights
+are stored as int8 and whose activations are quantized per call, so the
+matmuls run on the int8 GEMM kernels. The token embedding is stored as
+grouped int8 or packed int4 values and only the looked-up rows are
+dequantized. A tied head kept out of dynamic int8 shares that storage.
+"""
+from __future__ import annotations
+
+import io
+import logging
+import math
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from .config import GenerationConfig, QuantizationConfig, TrainingConfig
+from .modeling import CodexLikeCausalLM, build_tokenizer, checkpoint_tokenizer_path, load_checkpoint_weights
+
+LOGGER = logging.getLogger(__name__)
+
+_WEIGHT_ONLY_BITS = (4, 8)
+# Vocabulary rows dequantized per matmul slice in ``GroupQuantizedWeight.linear``.
+_DEQUANT_ROWS = 4096
+
+
+class GroupQuantizedWeight(nn.Module):
+    """Symmetric weight-only quantization with one scale per ``group_size`` columns.
+
+    ``int8`` values are stored as-is; ``int4`` values are offset by eight and
+    packed two per byte, halving storage again.
+    """
+
+    def __init__(self, qweight: torch.Tensor, scales: torch.Tensor, bits: int, group_size: int, columns: int) -> None:
+        super().__init__()
+        self.register_buffer("qweight", qweight)
+        self.register_buffer("scales", scales)
+        self.bits = bits
+        self.group_size = group_size
+        self.columns = columns
+
+    @classmethod
+    def from_float(cls, weight: torch.Tensor, bits: int, group_size: int, clip_ratio: float = 1.0) -> "GroupQuantizedWeight":
+        if bits not in _WEIGHT_ONLY_BITS:
+            raise ValueError(f"weight-only quantization supports {_WEIGHT_ONLY_BITS} bits")
+        rows, columns = weight.shape
+        groups = _grouped(weight.detach().float(), group_size)
+        max_int = 2 ** (bits - 1) - 1
+        scales = (groups.abs().amax(dim=-1, keepdim=True) * clip_ratio / max_int).clamp(min=1e-8)
+        values = torch.clamp(torch.round(groups / scales), -max_int - 1, max_int).to(torch.int8)
+        values = values.reshape(rows, -1)[:, :columns]
+        if bits == 4:
+            values = _pack_int4(values)
+        return cls(values.contiguous(), scales.squeeze(-1).to(torch.float16), bits, group_size, columns)
+
+    def _values(self, rows: slice | torch.Tensor) -> torch.Tensor:
+        values = self.qweight[rows]
+        if self.bits == 4:
+            values = _unpack_int4(values, self.columns)
+        return values
+
+    def dequantize(self, rows: slice | torch.Tensor = slice(None), dtype: torch.dtype = torch.float32) -> torch.Tensor:
+        """Return floating-point weights for ``rows`` (an index tensor or slice)."""
+
+        values = self._values(rows).to(dtype)
+        scales = self.scales[rows].to(dtype)
+        grouped = _grouped(values, self.group_size) * scales.unsqueeze(-1)
+        return grouped.reshape(values.size(0), -1)[:, : self.columns]
+
+    def linear(self, inputs: torch.Tensor) -> torch.Tensor:
+        """``inputs @ weight.T`` dequantizing a slice of rows at a time."""
+
+        num_rows = self.qweight.size(0)
+        outputs = inputs.new_empty(*inputs.shape[:-1], num_rows)
+        for start in range(0, num_rows, _DEQUANT_ROWS):
+            rows = slice(start, min(num_rows, start + _DEQUANT_ROWS))
+            outputs[..., rows] = inputs @ self.dequantize(rows, inputs.dtype).t()
+        return outputs
+
+
+class QuantizedEmbedding(nn.Module):
+    """Embedding lookup that dequantizes only the requested rows."""
+
+    def __init__(self, weight: GroupQuantizedWeight, dtype: torch.dtype = torch.float32) -> None:
+        super().__init__()
+        self.quantized = weight
+        self.dtype = dtype
+
+    def forward(self, input_ids: torch.LongTensor) -> torch.Tensor:
+        flat = input_ids.reshape(-1)
+        return self.quantized.dequantize(flat, self.dtype).view(*input_ids.shape, -1)
+
+
+class QuantizedLMHead(nn.Module):
+    """Output projection over a (possibly shared) :class:`GroupQuantizedWeight`."""
+
+    def __init__(self, weight: GroupQuantizedWeight) -> None:
+        super().__init__()
+        self.quantized = weight
+
+    def forward(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        return self.quantized.linear(hidden_states)
+
+
+@dataclass
+class QuantizationReport:
+    """Perplexity drift and decoding speed of a quantized model against its source."""
+
+    weight_only_bits: Optional[int]
+    dynamic_linear: bool
+    clip_ratio: Optional[float]
+    reference_perplexity: float
+    quantized_perplexity: float
+    reference_tokens_per_second: float
+    quantized_tokens_per_second: float
+    reference_size_mb: float
+    quantized_size_mb: float
+
+    @property
+    def perplexity_drift(self) -> float:
+        """Relative perplexity increase, e.g. ``0.01`` for one percent."""
+
+        return self.quantized_perplexity / self.reference_perplexity - 1.0
+
+    @property
+    def speedup(self) -> float:
+        return self.quantized_tokens_per_second / self.reference_tokens_per_second
+
+
+def _grouped(values: torch.Tensor, group_size: int) -> torch.Tensor:
+    columns = values.size(-1)
+    padding = -columns % group_size
+    if padding:
+        values = F.pad(values, (0, padding))
+    return values.view(values.size(0), -1, group_size)
+
+
+def _pack_int4(values: torch.Tensor) -> torch.Tensor:
+    unsigned = (values + 8).to(torch.uint8)
+    if unsigned.size(-1) % 2:
+        unsigned = F.pad(unsigned, (0, 1), value=8)
+    return unsigned[:, 0::2] | (unsigned[:, 1::2] << 4)
+
+
+def _unpack_int4(packed: torch.Tensor, columns: int) -> torch.Tensor:
+    unpacked = torch.stack((packed & 0x0F, packed >> 4), dim=-1).reshape(packed.size(0), -1)
+    return unpacked[:, :columns].to(torch.int8) - 8
+
+
+def _calibration_inputs(
+    model: CodexLikeCausalLM,
+    batches: Iterable[torch.LongTensor],
+    max_tokens: int,
+) -> Dict[str, torch.Tensor]:
+    """Record up to ``max_tokens`` input rows of every ``nn.Linear`` in ``model``."""
+
+    captured: Dict[str, List[torch.Tensor]] = {}
+    counts: Dict[str, int] = {}
+
+    def hook(name: str):
+        def record(module: nn.Module, inputs: Tuple[torch.Tensor, ...], output: torch.Tensor) -> None:
+            rows = inputs[0].reshape(-1, inputs[0].size(-1))[: max_tokens - counts.get(name, 0)]
+            if len(rows):
+                captured.setdefault(name, []).append(rows.detach())
+                counts[name] = counts.get(name, 0) + len(rows)
+
+        return record
+
+    handles = [
+        module.register_forward_hook(hook(name))
+        for name, module in model.named_modules()
+        if isinstance(module, nn.Linear)
+    ]
+    try:
+        with torch.no_grad():
+            for input_ids in batches:
+                model(input_ids, return_logits=True)
+                if counts and min(counts.values()) >= max_tokens:
+                    break
+    finally:
+        for handle in handles:
+            handle.remove()
+    return {name: torch.cat(rows) for name, rows in captured.items()}
+
+
+def _dynamic_int8_error(module: nn.Linear, inputs: torch.Tensor) -> float:
+    """Relative output error of ``module`` once converted to dynamic int8."""
+
+    quantized = torch.ao.quantization.quantize_dynamic(
+        nn.Sequential(module),
+        {"0": torch.ao.quantization.per_channel_dynamic_qconfig},
+        dtype=torch.qint8,
+    )[0]
+    with torch.no_grad():
+        reference = module(inputs)
+        return float((quantized(inputs) - reference).norm() / reference.norm().clamp(min=1e-12))
+
+
+def calibrate_clip_ratio(weight: torch.Tensor, hidden_states: torch.Tensor, config: QuantizationConfig) -> float:
+    """Pick the clipping ratio whose quantized weights best reproduce the calibration logits."""
+
+    if hidden_states.numel() == 0 or len(config.clip_ratios) == 1:
+        return config.clip_ratios[0]
+    errors = []
+    for ratio in config.clip_ratios:
+        quantized = GroupQuantizedWeight.from_float(weight, config.weight_only_bits, config.group_size, ratio)
+        error = 0.0
+        for start in range(0, weight.size(0), _DEQUANT_ROWS):
+            rows = slice(start, start + _DEQUANT_ROWS)
+            reference = hidden_states @ weight[rows].t()
+            error += float((hidden_states @ quantized.dequantize(rows).t() - reference).pow(2).sum())
+        errors.append(error)
+        LOGGER.info("Clip ratio %.2f: logit squared error %.4g", ratio, error)
+    return config.clip_ratios[min(range(len(errors)), key=errors.__getitem__)]
+
+
+def quantize_model(
+    model: CodexLikeCausalLM,
+    config: QuantizationConfig,
+    calibration_batches: Sequence[torch.LongTensor] = (),
+) -> Tuple[CodexLikeCausalLM, Optional[float]]:
+    """Quantize ``model`` in place for CPU inference.
+
+    Returns the model and the clipping ratio chosen for a shared weight-only
+    ``lm_head`` (``None`` when the head is not weight-only quantized).
+    """
+
+    if config.weight_only_bits is not None and config.weight_only_bits not in _WEIGHT_ONLY_BITS:
+        raise ValueError(f"weight_only_bits must be one of {_WEIGHT_ONLY_BITS} or None")
+    model.eval()
+    inputs = _calibration_inputs(model, calibration_batches, config.calibration_max_tokens)
+    lm_head = model.decoder.lm_head
+    tied = lm_head.weight is model.encoder.token_embeddings.weight
+
+    dynamic: Dict[str, object] = {}
+    if config.dynamic_linear:
+        for name, module in model.named_modules():
+            if not isinstance(module, nn.Linear):
+                continue
+            error = _dynamic_int8_error(module, inputs[name]) if name in inputs else 0.0
+            if error > config.max_relative_error:
+                LOGGER.info("Keeping %s in floating point (int8 relative error %.3f)", name, error)
+                continue
+            dynamic[name] = torch.ao.quantization.per_channel_dynamic_qconfig
+
+    clip_ratio = None
+    if config.weight_only_bits is not None:
+        embedding_weight = model.encoder.token_embeddings.weight.detach()
+        embedding = GroupQuantizedWeight.from_float(embedding_weight, config.weight_only_bits, config.group_size)
+        if tied and "decoder.lm_head" not in dynamic:
+            hidden_states = inputs.get("decoder.lm_head", torch.empty(0))
+            clip_ratio = calibrate_clip_ratio(embedding_weight, hidden_states, config)
+            embedding = GroupQuantizedWeight.from_float(
+                embedding_weight, config.weight_only_bits, config.group_size, clip_ratio
+            )
+            model.decoder.lm_head = QuantizedLMHead(embedding)
+        model.encoder.token_embeddings = QuantizedEmbedding(embedding, dtype=embedding_weight.dtype)
+
+    if dynamic:
+        torch.ao.quantization.quantize_dynamic(model, dynamic, dtype=torch.qint8, inplace=True)
+    LOGGER.info("Converted %d linear layers to dynamic int8", len(dynamic))
+    return model, clip_ratio
+
+
+def _model_size_mb(model: nn.Module) -> float:
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+
+def perplexity(model: CodexLikeCausalLM, batches: Iterable[torch.LongTensor]) -> float:
+    """Token-level perplexity of ``model`` over unpadded ``(1, T)`` batches."""
+
+    total_loss, total_tokens = 0.0, 0
+    with torch.no_grad():
+        for input_ids in batches:
+            if input_ids.size(1) < 2:
+                continue
+            logits = model(input_ids, return_logits=True).logits
+            loss = F.cross_entropy(logits[0, :-1].float(), input_ids[0, 1:], reduction="sum")
+            total_loss += float(loss)
+            total_tokens += input_ids.size(1) - 1
+    return math.exp(total_loss / max(total_tokens, 1))
+
+
+def decode_tokens_per_second(model: CodexLikeCausalLM, prompts: Sequence[torch.LongTensor], new_tokens: int) -> float:
+    """Greedy decoding throughput after the prompt, in generated tokens per second."""
+
+    generated, elapsed = 0, 0.0
+    for prompt in prompts:
+        config = GenerationConfig(max_new_tokens=new_tokens, cache_length=prompt.size(1) + new_tokens)
+        started = time.perf_counter()
+        output = model.generate(prompt, config=config)
+        elapsed += time.perf_counter() - started
+        generated += output.numel()
+    return generated / elapsed if elapsed else 0.0
+
+
+def quantize_checkpoint(
+    config: TrainingConfig,
+    checkpoint: str | Path,
+    tokenizer_path: Optional[str | Path] = None,
+) -> Tuple[CodexLikeCausalLM, QuantizationReport]:
+    """Build a quantized model from a training checkpoint and compare it to the original.
+
+    Calibration and evaluation chunks are drawn from the configured corpus as
+    a weight-stratified sample of records. The records are split between the
+    two sets before chunking, so no document has chunks in both.
+    """
+
+    # Imported lazily: the training module pulls in the whole data pipeline.
+    from .train import _prepare_texts, _sample_records
+
+    qconfig = config.quantization
+    tokenizer = build_tokenizer(
+        replace(
+            config.tokenizer,
+            use_custom=False,
+            pretrained=str(tokenizer_path or checkpoint_tokenizer_path(checkpoint)),
+        )
+    )
+    model_config = replace(config.model, use_custom_architecture=True, gradient_checkpointing=False)
+
+    def load() -> CodexLikeCausalLM:
+        return load_checkpoint_weights(CodexLikeCausalLM(model_config, tokenizer), checkpoint).eval()
+
+    max_length = min(tokenizer.model_max_length, model_config.encoder.max_position_embeddings)
+
+    def encode(records: List[dict], limit: int) -> List[torch.Tensor]:
+        texts = _prepare_texts(config, records)[:limit]
+        return [torch.tensor([ids]) for ids in tokenizer(texts, truncation=True, max_length=max_length)["input_ids"] if ids]
+
+    total = qconfig.calibration_samples + qconfig.eval_samples
+    records = _sample_records(config, total=total)
+    split = round(len(records) * qconfig.calibration_samples / total)
+    calibration = encode(records[:split], qconfig.calibration_samples)
+    evaluation = encode(records[split:], qconfig.eval_samples)
+    prompts = [batch[:, : max(1, batch.size(1) // 2)] for batch in evaluation[:4]]
+
+    reference = load()
+    reference_ppl = perplexity(reference, evaluation)
+    reference_tps = decode_tokens_per_second(reference, prompts, qconfig.benchmark_new_tokens)
+    reference_size = _model_size_mb(reference)
+    del reference
+
+    quantized, clip_ratio = quantize_model(load(), qconfig, calibration)
+    report = QuantizationReport(
+        weight_only_bits=qconfig.weight_only_bits,
+        dynamic_linear=qconfig.dynamic_linear,
+        clip_ratio=clip_ratio,
+        reference_perplexity=reference_ppl,
+        quantized_perplexity=perplexity(quantized, evaluation),
+        reference_tokens_per_second=reference_tps,
+        quantized_tokens_per_second=decode_tokens_per_second(quantized, prompts, qconfig.benchmark_new_tokens),
+        reference_size_mb=reference_size,
+        quantized_size_mb=_model_size_mb(quantized),
+    )
+    LOGGER.info(
+        "Quantized model: perplexity %.3f -> %.3f (%+.2f%%), %.1f -> %.1f tokens/s (x%.2f), %.1f -> %.1f MB",
+        report.reference_perplexity,
+        report.quantized_perplexity,
+        100 * report.perplexity_drift,
+        report.reference_tokens_per_second,
+        report.quantized_tokens_per_second,
+        report.speedup,
+        report.reference_size_mb,
+        report.quantized_size_mb,
+    )
+    return quantized, report
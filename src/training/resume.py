@@ -0,0 +1,159 @@
+"""Checkpointed training-data position for fast resumes.
+
+Every checkpoint gets a ``data_state.json`` next to the trainer state. It
+records where the prepared training rows live (a tokenized Arrow file or a
+token shard), how many rows and bytes they had, and the sampler settings that
+fix the batch order. The tokenizer is saved to ``<checkpoint>/tokenizer``.
+When :func:`src.training.train.train` resumes from such a checkpoint it opens
+those rows directly instead of re-running corpus preparation, tokenization
+and shard export.
+
+Weighted stream mixing happens while the corpus is written, so by the time
+training starts every source, the mixer's RNG and its shuffle buffer have
+already been drained into the prepared rows. The rows are map-style and
+batch order is a seeded function of ``(seed, epoch)``. The saved
+``global_step`` is therefore an exact position: the trainer rebuilds the
+epoch's batch order and skips the consumed batches as index lists, without
+reading or collating a row.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import Optional, Tuple
+
+from datasets import Dataset
+from transformers import TrainerCallback
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+
+from .config import TrainingConfig
+from .modeling import CHECKPOINT_TOKENIZER_DIR, build_tokenizer
+from .shards import TokenShardDataset
+
+LOGGER = logging.getLogger(__name__)
+
+DATA_STATE_NAME = "data_state.json"
+
+
+@dataclass
+class DataState:
+    """Where the training rows live and which sampler settings ordered them."""
+
+    dataset: str
+    format: str
+    num_rows: int
+    size_bytes: int
+    seed: int
+    max_tokens_per_batch: Optional[int]
+    micro_batch_size: int
+    global_step: int = 0
+    epoch: float = 0.0
+
+    def sampler_settings(self) -> Tuple[int, Optional[int], int]:
+        return self.seed, self.max_tokens_per_batch, self.micro_batch_size
+
+
+def _dataset_location(dataset) -> Optional[Tuple[str, str, int]]:
+    """Return ``(path, format, size_bytes)`` for an on-disk dataset, else ``None``."""
+
+    if isinstance(dataset, TokenShardDataset):
+        return str(dataset.directory), "token_shard", (dataset.directory / "tokens.bin").stat().st_size
+    cache_files = getattr(dataset, "cache_files", None)
+    if not cache_files or len(cache_files) != 1:
+        return None
+    path = Path(cache_files[0]["filename"])
+    return str(path), "arrow", path.stat().st_size
+
+
+def data_state_for(config: TrainingConfig, dataset) -> Optional[DataState]:
+    """Describe ``dataset`` for checkpointing; ``None`` when it is not backed by a single file."""
+
+    location = _dataset_location(dataset)
+    if location is None:
+        LOGGER.warning("Training rows are not backed by a single file; checkpoints will not record the data position.")
+        return None
+    path, data_format, size_bytes = location
+    return DataState(
+        dataset=path,
+        format=data_format,
+        num_rows=len(dataset),
+        size_bytes=size_bytes,
+        seed=config.seed,
+        max_tokens_per_batch=config.max_tokens_per_batch,
+        micro_batch_size=config.micro_batch_size,
+    )
+
+
+def load_data_state(checkpoint: str | Path) -> Optional[DataState]:
+    path = Path(checkpoint) / DATA_STATE_NAME
+    if not path.exists():
+        return None
+    return DataState(**json.loads(path.read_text()))
+
+
+class DataStateCallback(TrainerCallback):
+    """Write ``data_state.json`` and the tokenizer into every checkpoint the trainer saves."""
+
+    def __init__(self, data_state: DataState, tokenizer) -> None:
+        self.data_state = data_state
+        self.tokenizer = tokenizer
+
+    def on_save(self, args, state, control, **kwargs):
+        if not state.is_world_process_zero:
+            return
+        checkpoint = Path(args.output_dir) / f"{PREFIX_CHECKPOINT_DIR}-{state.global_step}"
+        if not checkpoint.is_dir():
+            return
+        data_state = replace(self.data_state, global_step=state.global_step, epoch=state.epoch or 0.0)
+        (checkpoint / DATA_STATE_NAME).write_text(json.dumps(asdict(data_state), indent=2))
+        self.tokenizer.save_pretrained(str(checkpoint / CHECKPOINT_TOKENIZER_DIR))
+
+
+def load_checkpoint_data(config: TrainingConfig):
+    """Return ``(tokenizer, train_dataset)`` recorded in the resumed checkpoint.
+
+    Returns ``None`` (and the caller prepares the data again) when the
+    checkpoint has no data state or the recorded rows are gone or changed.
+    """
+
+    checkpoint = Path(config.resume_from_checkpoint)
+    data_state = load_data_state(checkpoint)
+    if data_state is None:
+        LOGGER.info("%s has no %s; preparing the training data again.", checkpoint, DATA_STATE_NAME)
+        return None
+    location = Path(data_state.dataset)
+    size_file = location / "tokens.bin" if data_state.format == "token_shard" else location
+    if not size_file.exists() or size_file.stat().st_size != data_state.size_bytes:
+        LOGGER.warning("Training rows at %s are missing or changed; preparing the training data again.", location)
+        return None
+
+    dataset = TokenShardDataset(location) if data_state.format == "token_shard" else Dataset.from_file(str(location))
+    if len(dataset) != data_state.num_rows:
+        LOGGER.warning(
+            "%s has %d rows but the checkpoint recorded %d; preparing the training data again.",
+            location,
+            len(dataset),
+            data_state.num_rows,
+        )
+        return None
+    current = (config.seed, config.max_tokens_per_batch, config.micro_batch_size)
+    if current != data_state.sampler_settings():
+        LOGGER.warning(
+            "Sampler settings (seed, max_tokens_per_batch, micro_batch_size) changed from %s to %s;"
+            " resumed batches will not continue the checkpointed order.",
+            data_state.sampler_settings(),
+            current,
+        )
+    tokenizer = build_tokenizer(
+        replace(config.tokenizer, use_custom=False, pretrained=str(checkpoint / CHECKPOINT_TOKENIZER_DIR))
+    )
+    LOGGER.info(
+        "Resuming %d training rows from %s at step %d (epoch %.2f).",
+        data_state.num_rows,
+        location,
+        data_state.global_step,
+        data_state.epoch,
+    )
+    return tokenizer, dataset
@@ -0,0 +1,535 @@
+"""Embedding store and approximate nearest-neighbour search over records.
+
+Records are embedded with the model's own encoder: the final hidden states of
+:class:`~src.training.encoder.CodeEncoder`, or of a pretrained model, are
+mean-pooled over the non-padding tokens and L2-normalised, so inner product
+is cosine similarity. :class:`EmbeddingStore` appends the vectors to a
+memory-mapped ``float32`` or ``int8`` matrix, which is the externally stored
+``embedding_vector`` of the release schema. :class:`IVFIndex` is an
+inverted-file index built in NumPy. A k-means coarse quantizer assigns every
+vector to a list, and a query scores only the vectors in its ``nprobe``
+closest lists. New vectors can be added at any time without retraining::
+
+    python -m src.training.retrieval build data/jsonl/terminal_commands_sample.jsonl \\
+        --checkpoint <checkpoint_dir> --tokenizer <tokenizer_dir> --output retrieval/
+    python -m src.training.retrieval search retrieval/ "scan a subnet for open ports" -k 5 \\
+        --checkpoint <checkpoint_dir> --tokenizer <tokenizer_dir>
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn
+from transformers import PreTrainedTokenizerBase
+
+from .config import RetrievalConfig, default_training_config
+from .data import iter_dataset_text
+from .encoder import CodeEncoder
+from .manifest import ManifestShardReader, ShardEntry, read_shard
+from .modeling import CodexLikeCausalLM
+
+LOGGER = logging.getLogger(__name__)
+
+_META_FILE = "meta.json"
+_DTYPES = ("float32", "int8")
+# Rows scored per matmul when assigning, brute-forcing or rebuilding.
+_BLOCK_ROWS = 1 << 16
+
+
+def _hidden_states(model: nn.Module, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    if isinstance(model, CodexLikeCausalLM):
+        return model.encoder(input_ids=input_ids, attention_mask=attention_mask)
+    if isinstance(model, CodeEncoder):
+        return model(input_ids=input_ids, attention_mask=attention_mask)
+    outputs = model(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True)
+    return outputs.hidden_states[-1]
+
+
+@torch.no_grad()
+def embed_texts(
+    model: nn.Module,
+    tokenizer: PreTrainedTokenizerBase,
+    texts: Sequence[str],
+    batch_size: int = 64,
+    max_length: int = 256,
+) -> np.ndarray:
+    """Return L2-normalised mean-pooled final hidden states as a ``(len(texts), hidden)`` array."""
+
+    device = next(model.parameters()).device
+    # Length-sorted batches carry little padding; results go back to input order.
+    order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+    embeddings: Optional[np.ndarray] = None
+    for start in range(0, len(order), batch_size):
+        rows = order[start : start + batch_size]
+        batch = tokenizer(
+            [texts[row] for row in rows],
+            padding=True,
+            padding_side="right",
+            truncation=True,
+            max_length=max_length,
+            return_tensors="pt",
+        ).to(device)
+        hidden = _hidden_states(model, batch["input_ids"], batch["attention_mask"]).float()
+        mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = F.normalize((hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1), dim=-1)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), pooled.size(-1)), dtype=np.float32)
+        embeddings[rows] = pooled.cpu().numpy()
+    return embeddings if embeddings is not None else np.zeros((0, 0), dtype=np.float32)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 codes and the ``float32`` scales that restore them."""
+
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+class EmbeddingStore:
+    """Append-only memory-mapped embedding matrix.
+
+    ``vectors.bin`` holds the rows back to back as ``float32`` or as ``int8``
+    codes, with one ``float32`` scale per row in ``scales.bin``. Row ``i`` is
+    the ``i``-th vector ever appended. The files grow by doubling, and
+    ``meta.json`` records the dimension, dtype and row count on
+    :meth:`flush`.
+    """
+
+    def __init__(self, directory: str | Path, dim: Optional[int] = None, dtype: str = "float32") -> None:
+        self.directory = Path(directory)
+        meta_path = self.directory / _META_FILE
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            self.dim, self.dtype, self.count = meta["dim"], meta["dtype"], meta["count"]
+        else:
+            if dim is None:
+                raise ValueError(f"{self.directory} holds no embedding store; pass dim to create one")
+            if dtype not in _DTYPES:
+                raise ValueError(f"dtype must be one of {', '.join(_DTYPES)}")
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.dim, self.dtype, self.count = dim, dtype, 0
+        self._vectors: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._map(max(self.count, 1024))
+
+    @property
+    def quantized(self) -> bool:
+        return self.dtype == "int8"
+
+    def _map(self, capacity: int) -> None:
+        """(Re)map the files with room for ``capacity`` rows, extending them if needed."""
+
+        if self._vectors is not None:
+            self._vectors.flush()
+        files = [("vectors.bin", np.dtype(self.dtype), (capacity, self.dim))]
+        if self.quantized:
+            files.append(("scales.bin", np.dtype(np.float32), (capacity,)))
+        mapped = []
+        for name, dtype, shape in files:
+            path = self.directory / name
+            with open(path, "ab") as handle:
+                size = int(np.prod(shape)) * dtype.itemsize
+                if handle.tell() < size:
+                    handle.truncate(size)
+            mapped.append(np.memmap(path, dtype=dtype, mode="r+", shape=shape))
+        self._vectors = mapped[0]
+        self._scales = mapped[1] if self.quantized else None
+        self.capacity = capacity
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, vectors: np.ndarray) -> np.ndarray:
+        """Append ``float32`` rows and return their row ids."""
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            raise ValueError(f"expected vectors of shape (n, {self.dim}), got {vectors.shape}")
+        start, stop = self.count, self.count + len(vectors)
+        if stop > self.capacity:
+            self._map(max(stop, 2 * self.capacity))
+        if self.quantized:
+            self._vectors[start:stop], self._scales[start:stop] = quantize_int8(vectors)
+        else:
+            self._vectors[start:stop] = vectors
+        self.count = stop
+        return np.arange(start, stop, dtype=np.int64)
+
+    def vectors(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Rows ``start:stop`` as ``float32`` (dequantized for ``int8`` stores)."""
+
+        stop = self.count if stop is None else min(stop, self.count)
+        rows = np.asarray(self._vectors[start:stop], dtype=np.float32)
+        if self.quantized:
+            rows *= self._scales[start:stop, None]
+        return rows
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Arbitrary rows as ``float32``."""
+
+        vectors = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self.quantized:
+            vectors *= self._scales[rows, None]
+        return vectors
+
+    def blocks(self, start: int = 0, block_rows: int = _BLOCK_ROWS) -> Iterator[Tuple[int, np.ndarray]]:
+        for offset in range(start, self.count, block_rows):
+            yield offset, self.vectors(offset, offset + block_rows)
+
+    def flush(self) -> None:
+        self._vectors.flush()
+        if self._scales is not None:
+            self._scales.flush()
+        meta = {"dim": self.dim, "dtype": self.dtype, "count": self.count}
+        (self.directory / _META_FILE).write_text(json.dumps(meta, indent=2))
+
+
+def _spherical_kmeans(sample: np.ndarray, num_lists: int, iterations: int, seed: int) -> np.ndarray:
+    """Unit-norm centroids maximising the inner product with their members."""
+
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=num_lists)
+        sums = np.zeros_like(centroids)
+        filled = np.flatnonzero(counts)
+        sums[filled] = np.add.reduceat(sample[order], np.concatenate(([0], np.cumsum(counts)[:-1]))[filled], axis=0)
+        # Empty lists restart from random points instead of staying dead.
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), size=len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.where(norms > 0, norms, 1.0)
+    return centroids.astype(np.float32)
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        assignments[start : start + _BLOCK_ROWS] = np.argmax(vectors[start : start + _BLOCK_ROWS] @ centroids.T, axis=1)
+    return assignments
+
+
+def _top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Best ``k`` of 1-D ``scores`` in descending order, padded with ``-inf``/``-1``."""
+
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[keep], ids[keep]
+    order = np.argsort(-scores, kind="stable")
+    padded_scores = np.full(k, -np.inf, dtype=np.float32)
+    padded_ids = np.full(k, -1, dtype=np.int64)
+    padded_scores[: len(order)], padded_ids[: len(order)] = scores[order], ids[order]
+    return padded_scores, padded_ids
+
+
+class IVFIndex:
+    """Inverted-file index over unit-norm vectors with an inner-product metric.
+
+    Each list keeps its member ids and a contiguous copy of their vectors,
+    as ``float32`` or ``int8`` with per-vector scales, in buffers that grow by
+    doubling. :meth:`add` therefore costs one centroid matmul plus an
+    amortised copy, and a search scans ``nprobe`` contiguous blocks.
+    """
+
+    def __init__(self, centroids: np.ndarray, dtype: str = "float32") -> None:
+        if dtype not in _DTYPES:
+            raise ValueError(f"dtype must be one of {', '.join(_DTYPES)}")
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.dtype = dtype
+        num_lists, dim = self.centroids.shape
+        self._sizes = np.zeros(num_lists, dtype=np.int64)
+        self._ids = [np.empty(0, dtype=np.int64) for _ in range(num_lists)]
+        self._codes = [np.empty((0, dim), dtype=dtype) for _ in range(num_lists)]
+        self._scales = [np.empty(0, dtype=np.float32) for _ in range(num_lists)]
+
+    @classmethod
+    def train(
+        cls,
+        sample: np.ndarray,
+        num_lists: int,
+        iterations: int = 20,
+        seed: int = 0,
+        dtype: str = "float32",
+    ) -> "IVFIndex":
+        num_lists = max(1, min(num_lists, len(sample)))
+        started = time.perf_counter()
+        centroids = _spherical_kmeans(np.asarray(sample, dtype=np.float32), num_lists, iterations, seed)
+        LOGGER.info("Trained %d IVF lists on %d vectors in %.1fs", num_lists, len(sample), time.perf_counter() - started)
+        return cls(centroids, dtype=dtype)
+
+    @property
+    def num_lists(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return int(self._sizes.sum())
+
+    def _reserve(self, list_id: int, rows: int) -> None:
+        size, capacity = self._sizes[list_id], len(self._ids[list_id])
+        if size + rows <= capacity:
+            return
+        capacity = max(size + rows, 2 * capacity, 16)
+        for buffers in (self._ids, self._codes, self._scales):
+            old = buffers[list_id]
+            grown = np.empty((capacity, *old.shape[1:]), dtype=old.dtype)
+            grown[:size] = old[:size]
+            buffers[list_id] = grown
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+        """Assign ``vectors`` to their nearest lists; they are searchable immediately."""
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.dtype == "int8":
+            codes, scales = quantize_int8(vectors)
+        else:
+            codes, scales = vectors, np.ones(len(vectors), dtype=np.float32)
+        assignments = _nearest(vectors, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=self.num_lists)
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        for list_id in np.flatnonzero(counts):
+            members = order[bounds[list_id] : bounds[list_id + 1]]
+            self._reserve(list_id, len(members))
+            size = self._sizes[list_id]
+            self._ids[list_id][size : size + len(members)] = ids[members]
+            self._codes[list_id][size : size + len(members)] = codes[members]
+            self._scales[list_id][size : size + len(members)] = scales[members]
+            self._sizes[list_id] += len(members)
+
+    def search(self, queries: np.ndarray, k: int = 10, nprobe: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(scores, ids)`` of shape ``(len(queries), k)``; missing hits are ``-1``."""
+
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        nprobe = min(nprobe, self.num_lists)
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        all_scores = np.empty((len(queries), k), dtype=np.float32)
+        all_ids = np.empty((len(queries), k), dtype=np.int64)
+        for row, (query, lists) in enumerate(zip(queries, probes)):
+            scores, ids = [], []
+            for list_id in lists:
+                size = self._sizes[list_id]
+                if not size:
+                    continue
+                list_scores = self._codes[list_id][:size] @ query
+                if self.dtype == "int8":
+                    list_scores *= self._scales[list_id][:size]
+                scores.append(list_scores.astype(np.float32, copy=False))
+                ids.append(self._ids[list_id][:size])
+            if scores:
+                all_scores[row], all_ids[row] = _top_k(np.concatenate(scores), np.concatenate(ids), k)
+            else:
+                all_scores[row], all_ids[row] = -np.inf, -1
+        return all_scores, all_ids
+
+    def save(self, directory: str | Path) -> None:
+        """Write centroids and the lists, concatenated with ``int64`` offsets, under ``directory``."""
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        sizes = self._sizes
+        np.save(directory / "centroids.npy", self.centroids)
+        np.save(directory / "list_offsets.npy", np.concatenate(([0], np.cumsum(sizes))))
+        for name, buffers in (("list_ids", self._ids), ("list_codes", self._codes), ("list_scales", self._scales)):
+            np.save(directory / f"{name}.npy", np.concatenate([buffer[:size] for buffer, size in zip(buffers, sizes)]))
+        (directory / "ivf.json").write_text(json.dumps({"dtype": self.dtype, "num_lists": self.num_lists, "size": len(self)}))
+
+    @classmethod
+    def load(cls, directory: str | Path) -> "IVFIndex":
+        """Open a saved index; lists stay memory-mapped until an :meth:`add` grows them."""
+
+        directory = Path(directory)
+        meta = json.loads((directory / "ivf.json").read_text())
+        index = cls(np.load(directory / "centroids.npy"), dtype=meta["dtype"])
+        offsets = np.load(directory / "list_offsets.npy")
+        index._sizes = np.diff(offsets)
+        for name, buffers in (("list_ids", index._ids), ("list_codes", index._codes), ("list_scales", index._scales)):
+            values = np.load(directory / f"{name}.npy", mmap_mode="r")
+            buffers[:] = [values[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+        return index
+
+
+def brute_force_search(store: EmbeddingStore, queries: np.ndarray, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact top-``k`` inner-product search over every row of ``store``."""
+
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for start, block in store.blocks():
+        scores = queries @ block.T
+        ids = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+        merged_scores = np.concatenate([best_scores, scores], axis=1)
+        merged_ids = np.concatenate([best_ids, ids], axis=1)
+        keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+        best_ids = np.take_along_axis(merged_ids, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+
+
+def recall_at_k(found: np.ndarray, exact: np.ndarray) -> float:
+    """Mean fraction of each query's exact top-k ids that ``found`` contains."""
+
+    hits = sum(len(np.intersect1d(row, truth[truth >= 0])) for row, truth in zip(found, exact))
+    return hits / max(1, int((exact >= 0).sum()))
+
+
+def evaluate_index(
+    index: IVFIndex,
+    store: EmbeddingStore,
+    queries: np.ndarray,
+    k: int = 10,
+    nprobe: int = 32,
+) -> Dict[str, float]:
+    """Recall@k against brute force plus per-query latency percentiles, in milliseconds."""
+
+    exact_started = time.perf_counter()
+    _, exact = brute_force_search(store, queries, k)
+    exact_ms = (time.perf_counter() - exact_started) * 1000 / len(queries)
+    latencies, found = [], []
+    for query in queries:
+        started = time.perf_counter()
+        found.append(index.search(query, k, nprobe)[1][0])
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        "k": k,
+        "nprobe": nprobe,
+        "recall": recall_at_k(np.stack(found), exact),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "brute_force_ms": exact_ms,
+    }
+
+
+def build_index(store: EmbeddingStore, config: RetrievalConfig, index: Optional[IVFIndex] = None) -> IVFIndex:
+    """Train an index on a sample of ``store`` (unless given one) and add the rows it lacks.
+
+    Rows are added in store order, so an existing index of the first
+    ``len(index)`` rows only receives the newer ones.
+    """
+
+    if index is None:
+        rng = np.random.default_rng(config.seed)
+        sample_rows = np.sort(rng.choice(len(store), size=min(len(store), config.kmeans_sample), replace=False))
+        sample = store.take(sample_rows)
+        num_lists = config.num_lists or max(1, round(4 * math.sqrt(len(store))))
+        index = IVFIndex.train(sample, num_lists, config.kmeans_iterations, config.seed, dtype=store.dtype)
+    for start, block in store.blocks(start=len(index)):
+        index.add(block, np.arange(start, start + len(block)))
+    return index
+
+
+def _iter_records(path: str) -> Iterator[dict]:
+    """Records of a manifest (``.json``/``.yaml``) or of a single CSV/JSONL shard."""
+
+    source = Path(path)
+    if source.suffix in (".json", ".yaml", ".yml"):
+        yield from ManifestShardReader(source)
+        return
+    for batch, _ in read_shard(ShardEntry(source), verify=False):
+        yield from batch
+
+
+def _batched(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _load_model(args: argparse.Namespace):
+    from .serving import load_serving_model
+
+    config = default_training_config()
+    if args.pretrained:
+        config.model.pretrained = args.pretrained
+    return load_serving_model(config, checkpoint=args.checkpoint, tokenizer_path=args.tokenizer)
+
+
+def _build(args: argparse.Namespace, config: RetrievalConfig) -> None:
+    model, tokenizer = _load_model(args)
+    output = Path(args.output)
+    store: Optional[EmbeddingStore] = EmbeddingStore(output / "store") if (output / "store" / _META_FILE).exists() else None
+    index = IVFIndex.load(output / "index") if (output / "index" / "ivf.json").exists() else None
+    output.mkdir(parents=True, exist_ok=True)
+    started, count = time.perf_counter(), 0
+    with open(output / "records.jsonl", "a") as records_file:
+        for texts in _batched(iter_dataset_text(_iter_records(args.records)), 16 * config.batch_size):
+            vectors = embed_texts(model, tokenizer, texts, config.batch_size, config.max_length)
+            if store is None:
+                store = EmbeddingStore(output / "store", dim=vectors.shape[1], dtype=config.embedding_dtype)
+            store.append(vectors)
+            records_file.writelines(json.dumps(text) + "\n" for text in texts)
+            count += len(texts)
+    if store is None:
+        raise ValueError(f"{args.records} contains no records")
+    store.flush()
+    LOGGER.info("Embedded %d records (%.1f/s); store holds %d", count, count / (time.perf_counter() - started), len(store))
+    index = build_index(store, config, index)
+    index.save(output / "index")
+    LOGGER.info("Index holds %d vectors in %d lists", len(index), index.num_lists)
+
+
+def _search(args: argparse.Namespace, config: RetrievalConfig) -> None:
+    model, tokenizer = _load_model(args)
+    directory = Path(args.directory)
+    index = IVFIndex.load(directory / "index")
+    query = embed_texts(model, tokenizer, [args.query], max_length=config.max_length)
+    scores, ids = index.search(query, args.k, args.nprobe or config.nprobe)
+    wanted = {int(row): float(score) for row, score in zip(ids[0], scores[0]) if row >= 0}
+    with open(directory / "records.jsonl") as records_file:
+        texts = {row: json.loads(line) for row, line in enumerate(records_file) if row in wanted}
+    for row in ids[0]:
+        if row >= 0:
+            print(f"{wanted[int(row)]:.3f}  [{row}] {texts[int(row)]!r}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Embed records and search them by similarity.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Embed records into a store and (re)build or extend its index.")
+    build.add_argument("records", help="Release manifest (.json/.yaml) or a single CSV/JSONL shard.")
+    build.add_argument("--output", required=True, help="Directory for the store, index and records; reused to append.")
+    build.add_argument("--dtype", choices=_DTYPES, default=None, help="Storage type for a new store.")
+    build.add_argument("--num-lists", type=int, default=None)
+    search = subparsers.add_parser("search", help="Print the records closest to a query.")
+    search.add_argument("directory")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=10)
+    search.add_argument("--nprobe", type=int, default=None)
+    for subparser in (build, search):
+        subparser.add_argument("--checkpoint", help="Custom-architecture checkpoint to embed with.")
+        subparser.add_argument("--pretrained", help="transformers model to embed with instead.")
+        subparser.add_argument("--tokenizer", help="Tokenizer directory (defaults to <checkpoint>/tokenizer, else the checkpoint).")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = default_training_config().retrieval
+    if args.command == "build":
+        config.embedding_dtype = args.dtype or config.embedding_dtype
+        config.num_lists = args.num_lists or config.num_lists
+        _build(args, config)
+    else:
+        _search(args, config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,589 @@
+"""Local asyncio completion server with continuous batching.
+
+Requests wait in a bounded queue. Between two decode steps the scheduler
+admits as many waiting requests as there are free slots: they are prefilled
+and join the running batch on the next step, while finished sequences leave
+it immediately. Tokens are streamed back as server-sent events::
+
+    python -m src.training.serving --checkpoint checkpoints/codex-like/checkpoint-1000 \\
+        --tokenizer tokenizer
+    curl -N localhost:8000/v1/completions -d '{"prompt": "def add(", "max_tokens": 32, "stream": true}'
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from torch import nn
+from transformers import DynamicCache, PreTrainedTokenizerBase
+
+from .config import GenerationConfig, ServingConfig, TrainingConfig, default_training_config
+from .generation import KVCache, select_next_tokens
+from .modeling import (
+    CodexLikeCausalLM,
+    build_model,
+    build_tokenizer,
+    checkpoint_tokenizer_path,
+    load_checkpoint_weights,
+)
+from .prefix_cache import PrefixCache
+
+LOGGER = logging.getLogger(__name__)
+
+_REQUEST_IDS = itertools.count()
+
+
+@dataclass
+class CompletionRequest:
+    """One completion as tracked by the scheduler and the engines."""
+
+    prompt_ids: List[int]
+    max_tokens: int
+    generation: GenerationConfig
+    id: int = field(default_factory=lambda: next(_REQUEST_IDS))
+    generated: List[int] = field(default_factory=list)
+    finish_reason: Optional[str] = None
+    cancelled: bool = False
+
+
+# An engine step yields ``(request, token)`` pairs; ``request.finish_reason`` is
+# set once the token ends the sequence.
+TokenEvent = Tuple[CompletionRequest, int]
+
+
+class _Engine:
+    """Shared bookkeeping for the model-specific engines."""
+
+    def __init__(self, eos_token_id: Optional[int], max_batch_size: int, max_sequence_length: int) -> None:
+        self.eos_token_id = eos_token_id
+        self.max_batch_size = max_batch_size
+        self.max_sequence_length = max_sequence_length
+        self.active: List[CompletionRequest] = []
+
+    def free_slots(self) -> int:
+        return self.max_batch_size - len(self.active)
+
+    def _emit(self, requests: List[CompletionRequest], logits: torch.Tensor) -> List[TokenEvent]:
+        events: List[TokenEvent] = []
+        for row, request in enumerate(requests):
+            token = int(select_next_tokens(logits[row : row + 1], request.generation)[0])
+            request.generated.append(token)
+            if token == self.eos_token_id:
+                request.finish_reason = "stop"
+            elif len(request.generated) >= request.max_tokens:
+                request.finish_reason = "length"
+            elif len(request.prompt_ids) + len(request.generated) >= self.max_sequence_length:
+                # The newest token would have no cache position left to be fed from.
+                request.finish_reason = "length"
+            events.append((request, token))
+        return events
+
+    def admit(self, requests: List[CompletionRequest]) -> List[TokenEvent]:
+        raise NotImplementedError
+
+    def step(self) -> List[TokenEvent]:
+        raise NotImplementedError
+
+    def release(self, request: CompletionRequest) -> None:
+        self.active.remove(request)
+
+
+class CustomModelEngine(_Engine):
+    """Batched decoding for :class:`CodexLikeCausalLM` over one slot-per-row KV cache.
+
+    Active sequences always occupy rows ``0..n-1`` so each step runs on a
+    contiguous view of the cache; releasing a sequence moves the last row
+    into its slot. With a :class:`PrefixCache`, admitted prompts start from
+    the KV of their longest previously seen prefix and only the remaining
+    tokens are prefilled.
+    """
+
+    def __init__(
+        self,
+        model: CodexLikeCausalLM,
+        eos_token_id: Optional[int],
+        max_batch_size: int,
+        max_sequence_length: int,
+        prefix_cache: Optional[PrefixCache] = None,
+    ) -> None:
+        max_sequence_length = min(max_sequence_length, model.encoder.config.max_position_embeddings)
+        super().__init__(eos_token_id, max_batch_size, max_sequence_length)
+        self.model = model.eval()
+        self.cache = KVCache.for_model(model, batch_size=max_batch_size, max_length=max_sequence_length)
+        self.prefix_cache = prefix_cache
+
+    def _prefill(self, cache: KVCache, sequences: List[List[int]]) -> torch.Tensor:
+        """Encode right-padded ``sequences`` after each row's cached tokens; return last-token logits."""
+
+        device = cache.lengths.device
+        lengths = torch.tensor([len(sequence) for sequence in sequences], device=device)
+        input_ids = torch.zeros((len(sequences), int(lengths.max())), dtype=torch.long, device=device)
+        attention_mask = torch.zeros_like(input_ids)
+        for row, sequence in enumerate(sequences):
+            input_ids[row, : len(sequence)] = torch.tensor(sequence, device=device)
+            attention_mask[row, : len(sequence)] = 1
+        hidden_states = self.model.encoder(input_ids, attention_mask=attention_mask, cache=cache)
+        return self.model.decoder(hidden_states[torch.arange(len(sequences), device=device), lengths - 1])
+
+    @torch.no_grad()
+    def admit(self, requests: List[CompletionRequest]) -> List[TokenEvent]:
+        start = len(self.active)
+        rows = range(start, start + len(requests))
+        view = self.cache.view(slice(start, start + len(requests)))
+        view.lengths.zero_()
+        if self.prefix_cache is not None:
+            for row, request in zip(rows, requests):
+                # The last prompt token is always recomputed: its hidden state yields the first logits.
+                self.prefix_cache.load(self.cache, row, request.prompt_ids, limit=len(request.prompt_ids) - 1)
+        cached = view.lengths.tolist()
+        suffixes = [request.prompt_ids[offset:] for request, offset in zip(requests, cached)]
+        if max(cached) + max(map(len, suffixes)) <= self.max_sequence_length:
+            logits = self._prefill(view, suffixes)
+        else:
+            # Padding the batch to its longest suffix would overrun the cache of a long cached row.
+            logits = torch.cat([self._prefill(self.cache.view(slice(row, row + 1)), [suffix]) for row, suffix in zip(rows, suffixes)])
+        if self.prefix_cache is not None:
+            for row, request in zip(rows, requests):
+                self.prefix_cache.store(self.cache, row, request.prompt_ids)
+        self.active.extend(requests)
+        return self._emit(requests, logits)
+
+    @torch.no_grad()
+    def step(self) -> List[TokenEvent]:
+        if not self.active:
+            return []
+        device = self.cache.lengths.device
+        tokens = torch.tensor([[request.generated[-1]] for request in self.active], device=device)
+        hidden_states = self.model.encoder(tokens, cache=self.cache.view(slice(0, len(self.active))))
+        return self._emit(list(self.active), self.model.decoder(hidden_states[:, -1]))
+
+    def release(self, request: CompletionRequest) -> None:
+        row, last = self.active.index(request), len(self.active) - 1
+        if row != last:
+            self.cache.move_row(last, row)
+            self.active[row] = self.active[last]
+        self.active.pop()
+
+
+class PretrainedModelEngine(_Engine):
+    """Continuous batching over ``transformers`` causal LMs.
+
+    The active sequences share one left-padded ``DynamicCache``, so a step is
+    a single forward call over every row. The attention mask hides each
+    row's padding and ``position_ids`` count only its real tokens. Admitted
+    prompts are prefilled together, left-padded, and their cache rows are
+    appended to the running batch. Releasing a sequence drops its row along
+    with any padding columns that no remaining row needs.
+    """
+
+    def __init__(self, model: nn.Module, eos_token_id: Optional[int], max_batch_size: int, max_sequence_length: int) -> None:
+        config = getattr(model, "config", None)
+        positions = getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None)
+        if positions:
+            max_sequence_length = min(max_sequence_length, positions)
+        super().__init__(eos_token_id, max_batch_size, max_sequence_length)
+        self.model = model.eval()
+        self.device = next(model.parameters()).device
+        self._reset()
+
+    def _reset(self) -> None:
+        self._cache: Optional[DynamicCache] = None
+        self._mask = torch.zeros((0, 0), dtype=torch.long, device=self.device)
+
+    def _forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, cache: DynamicCache) -> torch.Tensor:
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -input_ids.shape[1] :]
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True,
+        )
+        return outputs.logits[:, -1]
+
+    @staticmethod
+    def _pad_left(tensor: torch.Tensor, width: int, dim: int) -> torch.Tensor:
+        missing = width - tensor.shape[dim]
+        if not missing:
+            return tensor
+        shape = list(tensor.shape)
+        shape[dim] = missing
+        return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+    @torch.no_grad()
+    def admit(self, requests: List[CompletionRequest]) -> List[TokenEvent]:
+        if not self.active:
+            self._reset()
+        width = max(len(request.prompt_ids) for request in requests)
+        input_ids = torch.zeros((len(requests), width), dtype=torch.long, device=self.device)
+        attention_mask = torch.zeros_like(input_ids)
+        for row, request in enumerate(requests):
+            input_ids[row, width - len(request.prompt_ids) :] = torch.tensor(request.prompt_ids, device=self.device)
+            attention_mask[row, width - len(request.prompt_ids) :] = 1
+        cache = DynamicCache()
+        logits = self._forward(input_ids, attention_mask, cache)
+
+        if self._cache is None:
+            self._cache, self._mask = cache, attention_mask
+        else:
+            width = max(width, self._mask.shape[1])
+            for running, admitted in zip(self._cache.layers, cache.layers):
+                running.keys = torch.cat([self._pad_left(running.keys, width, 2), self._pad_left(admitted.keys, width, 2)])
+                running.values = torch.cat([self._pad_left(running.values, width, 2), self._pad_left(admitted.values, width, 2)])
+            self._mask = torch.cat([self._pad_left(self._mask, width, 1), self._pad_left(attention_mask, width, 1)])
+        self.active.extend(requests)
+        return self._emit(requests, logits)
+
+    @torch.no_grad()
+    def step(self) -> List[TokenEvent]:
+        if not self.active:
+            return []
+        tokens = torch.tensor([[request.generated[-1]] for request in self.active], device=self.device)
+        self._mask = torch.cat([self._mask, self._mask.new_ones((len(self.active), 1))], dim=1)
+        return self._emit(list(self.active), self._forward(tokens, self._mask, self._cache))
+
+    def release(self, request: CompletionRequest) -> None:
+        row = self.active.index(request)
+        super().release(request)
+        if not self.active:
+            self._reset()
+            return
+        keep = torch.tensor([index for index in range(self._mask.shape[0]) if index != row], device=self.device)
+        self._mask = self._mask[keep]
+        # Columns that are padding in every remaining row can go.
+        start = int(self._mask.any(dim=0).long().argmax())
+        self._mask = self._mask[:, start:]
+        for layer in self._cache.layers:
+            layer.keys = layer.keys[keep, :, start:]
+            layer.values = layer.values[keep, :, start:]
+
+
+def build_engine(model: nn.Module, tokenizer: PreTrainedTokenizerBase, config: ServingConfig) -> _Engine:
+    if not isinstance(model, CodexLikeCausalLM):
+        return PretrainedModelEngine(model, tokenizer.eos_token_id, config.max_batch_size, config.max_sequence_length)
+    prefix_cache = PrefixCache(int(config.prefix_cache_mb * 2**20)) if config.prefix_cache_mb > 0 else None
+    return CustomModelEngine(
+        model, tokenizer.eos_token_id, config.max_batch_size, config.max_sequence_length, prefix_cache=prefix_cache
+    )
+
+
+class _Detokenizer:
+    """Turn a growing token list into text deltas without splitting multi-byte characters."""
+
+    def __init__(self, tokenizer: PreTrainedTokenizerBase) -> None:
+        self.tokenizer = tokenizer
+        self.ids: List[int] = []
+        self.text = ""
+
+    def push(self, token: int) -> str:
+        self.ids.append(token)
+        text = self.tokenizer.decode(self.ids, skip_special_tokens=True)
+        if text.endswith("\ufffd"):
+            return ""
+        delta, self.text = text[len(self.text) :], text
+        return delta
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+class CompletionServer:
+    """HTTP front end plus the continuous-batching scheduler loop.
+
+    ``POST /v1/completions`` takes ``prompt``, ``max_tokens``, ``temperature``,
+    ``top_k``, ``top_p`` and ``stream``; ``GET /health`` reports queue depth and
+    batch occupancy. Backpressure comes from the bounded waiting queue (full
+    means HTTP 503 with ``Retry-After``) and from awaiting each client's socket
+    drain while streaming.
+    """
+
+    def __init__(self, engine: _Engine, tokenizer: PreTrainedTokenizerBase, config: ServingConfig) -> None:
+        self.engine = engine
+        self.tokenizer = tokenizer
+        self.config = config
+        self._streams: Dict[int, asyncio.Queue] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="engine")
+        self._waiting: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._scheduler: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> asyncio.AbstractServer:
+        self._waiting = asyncio.Queue(maxsize=self.config.max_queue_size)
+        self._wakeup = asyncio.Event()
+        self._scheduler = asyncio.create_task(self._schedule())
+        self._server = await asyncio.start_server(self._handle, self.config.host, self.config.port)
+        LOGGER.info("Serving completions on %s", ", ".join(str(sock.getsockname()) for sock in self._server.sockets))
+        return self._server
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+        self._executor.shutdown(wait=True)
+
+    # -- scheduling ---------------------------------------------------------
+    def _engine_step(self, admitted: List[CompletionRequest]) -> List[TokenEvent]:
+        events = self.engine.step()
+        if admitted:
+            events += self.engine.admit(admitted)
+        return events
+
+    async def _schedule(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.engine.active and self._waiting.empty():
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            admitted: List[CompletionRequest] = []
+            while len(admitted) < self.engine.free_slots() and not self._waiting.empty():
+                request = self._waiting.get_nowait()
+                if not request.cancelled:
+                    admitted.append(request)
+            try:
+                events = await loop.run_in_executor(self._executor, self._engine_step, admitted)
+            except Exception:  # noqa: BLE001 - keep serving other requests
+                LOGGER.exception("Engine step failed; aborting the running batch")
+                for request in self.engine.active + admitted:
+                    request.finish_reason = "error"
+                    self._publish(request, None)
+                self.engine.active.clear()
+                continue
+            for request, token in events:
+                self._publish(request, token)
+            for request in list(self.engine.active):
+                if request.finish_reason is not None or request.cancelled:
+                    self.engine.release(request)
+
+    def _publish(self, request: CompletionRequest, token: Optional[int]) -> None:
+        stream = self._streams.get(request.id)
+        if stream is not None:
+            stream.put_nowait((token, request.finish_reason))
+
+    # -- HTTP ---------------------------------------------------------------
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            method, path, body = await _read_request(reader)
+            if method == "GET" and path == "/health":
+                await _write_json(writer, 200, self.stats())
+            elif method == "POST" and path == "/v1/completions":
+                await self._complete(_parse_json(body), writer)
+            else:
+                raise _HTTPError(404, f"No route for {method} {path}")
+        except _HTTPError as error:
+            headers = {"Retry-After": "1"} if error.status == 503 else {}
+            await _write_json(writer, error.status, {"error": str(error)}, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def stats(self) -> dict:
+        prefix_cache = getattr(self.engine, "prefix_cache", None)
+        return {
+            "waiting": self._waiting.qsize() if self._waiting is not None else 0,
+            "active": len(self.engine.active),
+            "max_batch_size": self.engine.max_batch_size,
+            "prefix_cache": prefix_cache.stats() if prefix_cache is not None else None,
+        }
+
+    def _build_request(self, payload: dict) -> Tuple[CompletionRequest, bool]:
+        prompt = payload.get("prompt")
+        if not isinstance(prompt, str) or not prompt:
+            raise _HTTPError(400, "'prompt' must be a non-empty string")
+        prompt_ids = self.tokenizer(prompt)["input_ids"]
+        limit = self.engine.max_sequence_length
+        if not prompt_ids or len(prompt_ids) >= limit:
+            raise _HTTPError(400, f"Prompt must be 1-{limit - 1} tokens long")
+        try:
+            max_tokens = int(payload.get("max_tokens", self.config.default_max_tokens))
+            temperature = float(payload.get("temperature", 0.0))
+            generation = GenerationConfig(
+                do_sample=temperature > 0,
+                temperature=temperature or 1.0,
+                top_k=int(payload.get("top_k", 0)),
+                top_p=float(payload.get("top_p", 1.0)),
+            )
+        except (TypeError, ValueError) as error:
+            raise _HTTPError(400, f"Invalid sampling parameter: {error}") from error
+        if max_tokens < 1:
+            raise _HTTPError(400, "'max_tokens' must be positive")
+        request = CompletionRequest(
+            prompt_ids=prompt_ids,
+            max_tokens=min(max_tokens, self.config.max_new_tokens),
+            generation=generation,
+        )
+        return request, bool(payload.get("stream", False))
+
+    async def _complete(self, payload: dict, writer: asyncio.StreamWriter) -> None:
+        request, stream = self._build_request(payload)
+        tokens: asyncio.Queue = asyncio.Queue()
+        self._streams[request.id] = tokens
+        try:
+            try:
+                self._waiting.put_nowait(request)
+            except asyncio.QueueFull:
+                raise _HTTPError(503, "Server is at capacity; retry later") from None
+            self._wakeup.set()
+            detokenizer = _Detokenizer(self.tokenizer)
+            if stream:
+                await _write_head(writer, 200, {"Content-Type": "text/event-stream", "Transfer-Encoding": "chunked"})
+            while True:
+                token, finish_reason = await tokens.get()
+                delta = detokenizer.push(token) if token is not None else ""
+                if stream:
+                    event = {"id": request.id, "token": token, "text": delta, "finish_reason": finish_reason}
+                    await _write_chunk(writer, f"data: {json.dumps(event)}\n\n".encode())
+                if finish_reason is not None:
+                    break
+            if stream:
+                await _write_chunk(writer, b"data: [DONE]\n\n")
+                await _write_chunk(writer, b"")
+            else:
+                await _write_json(
+                    writer,
+                    200,
+                    {
+                        "id": request.id,
+                        "text": detokenizer.text,
+                        "finish_reason": finish_reason,
+                        "usage": {"prompt_tokens": len(request.prompt_ids), "completion_tokens": len(request.generated)},
+                    },
+                )
+        except (ConnectionError, asyncio.CancelledError):
+            request.cancelled = True
+            raise
+        finally:
+            self._streams.pop(request.id, None)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, path, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise _HTTPError(400, "Malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method.upper(), path.split("?", 1)[0], body
+
+
+def _parse_json(body: bytes) -> dict:
+    try:
+        payload = json.loads(body or b"{}")
+    except json.JSONDecodeError as error:
+        raise _HTTPError(400, f"Invalid JSON body: {error}") from error
+    if not isinstance(payload, dict):
+        raise _HTTPError(400, "JSON body must be an object")
+    return payload
+
+
+async def _write_head(writer: asyncio.StreamWriter, status: int, headers: Dict[str, str]) -> None:
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+
+async def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+    writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+    await writer.drain()
+
+
+async def _write_json(writer: asyncio.StreamWriter, status: int, payload: dict, headers: Optional[Dict[str, str]] = None) -> None:
+    body = json.dumps(payload).encode()
+    await _write_head(
+        writer,
+        status,
+        {"Content-Type": "application/json", "Content-Length": str(len(body)), **(headers or {})},
+    )
+    writer.write(body)
+    await writer.drain()
+
+
+def load_serving_model(
+    config: TrainingConfig,
+    checkpoint: Optional[str] = None,
+    tokenizer_path: Optional[str] = None,
+) -> Tuple[nn.Module, PreTrainedTokenizerBase]:
+    """Load the tokenizer plus either a custom-model checkpoint or ``config.model.pretrained``."""
+
+    if tokenizer_path is None and checkpoint is not None:
+        tokenizer_path = str(checkpoint_tokenizer_path(checkpoint))
+    tokenizer_source = tokenizer_path or config.tokenizer.pretrained or config.model.pretrained
+    tokenizer = build_tokenizer(replace(config.tokenizer, use_custom=False, pretrained=tokenizer_source))
+    if checkpoint is not None:
+        model_config = replace(config.model, use_custom_architecture=True, gradient_checkpointing=False)
+        model = load_checkpoint_weights(CodexLikeCausalLM(model_config, tokenizer), checkpoint)
+    else:
+        model = build_model(replace(config.model, use_custom_architecture=False, gradient_checkpointing=False), tokenizer)
+    return model.eval(), tokenizer
+
+
+async def serve(model: nn.Module, tokenizer: PreTrainedTokenizerBase, config: ServingConfig) -> None:
+    """Run the completion server until cancelled."""
+
+    server = CompletionServer(build_engine(model, tokenizer, config), tokenizer, config)
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve completions with continuous batching.")
+    parser.add_argument("--checkpoint", help="Custom-architecture training checkpoint to serve.")
+    parser.add_argument("--pretrained", help="transformers checkpoint to serve instead of a custom model.")
+    parser.add_argument("--tokenizer", help="Tokenizer directory (defaults to <checkpoint>/tokenizer, else the checkpoint).")
+    defaults = ServingConfig()
+    parser.add_argument("--host", default=defaults.host)
+    parser.add_argument("--port", type=int, default=defaults.port)
+    parser.add_argument("--max-batch-size", type=int, default=defaults.max_batch_size)
+    parser.add_argument("--max-queue-size", type=int, default=defaults.max_queue_size)
+    parser.add_argument("--max-sequence-length", type=int, default=defaults.max_sequence_length)
+    parser.add_argument("--max-new-tokens", type=int, default=defaults.max_new_tokens)
+    parser.add_argument("--prefix-cache-mb", type=float, default=defaults.prefix_cache_mb, help="0 disables prefix caching.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = default_training_config()
+    if args.pretrained:
+        config.model.pretrained = args.pretrained
+    serving = replace(
+        config.serving,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_queue_size=args.max_queue_size,
+        max_sequence_length=args.max_sequence_length,
+        max_new_tokens=args.max_new_tokens,
+        prefix_cache_mb=args.prefix_cache_mb,
+    )
+    model, tokenizer = load_serving_model(config, checkpoint=args.checkpoint, tokenizer_path=args.tokenizer)
+    asyncio.run(serve(model, tokenizer, serving))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Memory-mapped binary token shards with O(1) random access.
+
+A shard is a directory holding a flat token array plus offset indexes::
+
+    tokens.bin        # every row's token ids back to back (uint16 or int32)
+    offsets.npy       # int64[num_rows + 1]; row i is tokens[offsets[i]:offsets[i + 1]]
+    spans.npy         # int32 flattened [start, end) loss-ignore spans of every row
+    span_offsets.npy  # int64[num_rows + 1] indexing into spans.npy
+    first_positions.npy  # int32[num_rows]; packed shards only
+    meta.json         # dtype, row/token counts, eos id and packing flags
+
+All arrays are opened with ``numpy.memmap`` so several ranks and dataloader
+workers share the same pages through the OS page cache, and rows come back as
+tensor views over the mapping rather than decoded Python lists.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+LOGGER = logging.getLogger(__name__)
+
+_TOKENS_FILE = "tokens.bin"
+_META_FILE = "meta.json"
+
+
+def token_dtype(vocab_size: int) -> np.dtype:
+    """Smallest dtype that holds every token id and converts to a torch tensor."""
+
+    # ``torch`` has no uint32, so larger vocabularies use int32 instead.
+    return np.dtype(np.uint16) if vocab_size <= np.iinfo(np.uint16).max + 1 else np.dtype(np.int32)
+
+
+def is_token_shard(directory: str | Path) -> bool:
+    return (Path(directory) / _META_FILE).exists()
+
+
+def write_token_shard(
+    rows: Iterable[dict],
+    directory: str | Path,
+    vocab_size: int,
+    eos_token_id: Optional[int] = None,
+    packed: bool = False,
+    reset_position_ids: bool = False,
+    document_attention: bool = False,
+) -> Path:
+    """Stream tokenized ``rows`` into a shard directory.
+
+    Tokens are appended to ``tokens.bin`` row by row, so only the offset
+    indexes (eight bytes per row) are held in memory while writing. For packed
+    rows the starting position of each row's first document is kept so
+    positions can be restored exactly for documents that straddle two rows.
+    """
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    dtype = token_dtype(vocab_size)
+    offsets = array("q", [0])
+    span_offsets = array("q", [0])
+    spans = array("i")
+    first_positions = array("i")
+    with open(directory / _TOKENS_FILE, "wb") as handle:
+        for row in rows:
+            ids = np.asarray(row["input_ids"], dtype=dtype)
+            ids.tofile(handle)
+            offsets.append(offsets[-1] + len(ids))
+            spans.extend(row.get("ignore_spans") or ())
+            span_offsets.append(len(spans))
+            if packed:
+                positions = row.get("position_ids")
+                first_positions.append(int(positions[0]) if positions else 0)
+
+    np.save(directory / "offsets.npy", np.frombuffer(offsets, dtype=np.int64))
+    np.save(directory / "spans.npy", np.frombuffer(spans, dtype=np.int32))
+    np.save(directory / "span_offsets.npy", np.frombuffer(span_offsets, dtype=np.int64))
+    if packed:
+        np.save(directory / "first_positions.npy", np.frombuffer(first_positions, dtype=np.int32))
+    meta = {
+        "dtype": dtype.name,
+        "vocab_size": vocab_size,
+        "num_rows": len(offsets) - 1,
+        "num_tokens": offsets[-1],
+        "eos_token_id": eos_token_id,
+        "packed": packed,
+        "reset_position_ids": reset_position_ids,
+        "document_attention": document_attention,
+    }
+    (directory / _META_FILE).write_text(json.dumps(meta, indent=2))
+    LOGGER.info("Wrote %d rows / %d tokens to %s", meta["num_rows"], meta["num_tokens"], directory)
+    return directory
+
+
+class TokenShardDataset(Dataset):
+    """``torch`` dataset over a token shard returning zero-copy tensor views.
+
+    The token file is mapped copy-on-write: pages stay shared with every other
+    reader until written to (which never happens), and ``torch.from_numpy`` can
+    wrap slices without copying. ``uint16`` shards require ``torch>=2.3``.
+    """
+
+    def __init__(self, directory: str | Path) -> None:
+        self.directory = Path(directory)
+        self.meta = json.loads((self.directory / _META_FILE).read_text())
+        self._tokens: Optional[np.memmap] = None
+        self._offsets = np.load(self.directory / "offsets.npy", mmap_mode="r")
+        self._spans = np.load(self.directory / "spans.npy", mmap_mode="r")
+        self._span_offsets = np.load(self.directory / "span_offsets.npy", mmap_mode="r")
+        first_positions = self.directory / "first_positions.npy"
+        self._first_positions = np.load(first_positions, mmap_mode="r") if first_positions.exists() else None
+
+    @property
+    def tokens(self) -> np.memmap:
+        # Opened lazily so each dataloader worker maps the file after forking.
+        if self._tokens is None:
+            if self.meta["num_tokens"] == 0:
+                self._tokens = np.zeros(0, dtype=self.meta["dtype"])
+            else:
+                self._tokens = np.memmap(self.directory / _TOKENS_FILE, dtype=self.meta["dtype"], mode="c")
+        return self._tokens
+
+    def __len__(self) -> int:
+        return self.meta["num_rows"]
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self._offsets)
+
+    def _document_layout(self, ids: np.ndarray, idx: int) -> Dict[str, torch.Tensor]:
+        """Rebuild ``segment_ids``/``position_ids`` from the eos separators."""
+
+        is_eos = ids == self.meta["eos_token_id"]
+        segments = np.zeros(len(ids), dtype=np.int64)
+        if len(ids) > 1:
+            np.cumsum(is_eos[:-1], out=segments[1:])
+        layout: Dict[str, torch.Tensor] = {}
+        if self.meta["document_attention"]:
+            layout["segment_ids"] = torch.from_numpy(segments)
+        if self.meta["reset_position_ids"]:
+            starts = np.concatenate(([0], np.flatnonzero(is_eos[:-1]) + 1))
+            positions = np.arange(len(ids), dtype=np.int64) - starts[segments]
+            if self._first_positions is not None:
+                positions[segments == 0] += int(self._first_positions[idx])
+            layout["position_ids"] = torch.from_numpy(positions)
+        return layout
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor | List[int]]:
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        ids = self.tokens[start:end]
+        span_start, span_end = int(self._span_offsets[idx]), int(self._span_offsets[idx + 1])
+        item: Dict[str, torch.Tensor | List[int]] = {
+            "input_ids": torch.from_numpy(ids),
+            "ignore_spans": self._spans[span_start:span_end].tolist(),
+        }
+        if self.meta["packed"]:
+            item.update(self._document_layout(ids, idx))
+        return item
@@ -1,15 +1,19 @@
 """Custom tokenizer utilities for the Codex-like system."""
 from __future__ import annotations
 
-from dataclasses import dataclass
+import json
+import logging
+from dataclasses import asdict, dataclass
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Iterable, Iterator, List, Optional, Sequence
 
 from tokenizers import ByteLevelBPETokenizer
 from transformers import PreTrainedTokenizerFast
 
 from .config import TokenizerConfig
 
+LOGGER = logging.getLogger(__name__)
+
 
 @dataclass
 class CodeTokenizerState:
@@ -21,6 +25,15 @@ class CodeTokenizerState:
     tokenizer_file: Path
 
 
+@dataclass
+class CompressionPoint:
+    """Held-out compression achieved by a tokenizer trained on a prefix of the sample's chunks."""
+
+    chunks: int
+    sample_bytes: int
+    tokens_per_byte: float
+
+
 class CodeTokenizer:
     """Train and serve a byte-level BPE tokenizer specialised for code."""
 
@@ -30,8 +43,8 @@ class CodeTokenizer:
         self._hf_tokenizer: Optional[PreTrainedTokenizerFast] = None
         self._state: Optional[CodeTokenizerState] = None
 
-    def train_from_iterator(self, iterator: Iterable[str]) -> None:
-        """Train the tokenizer using an iterator of strings."""
+    def train_from_iterator(self, iterator: Iterable[str] | Iterable[List[str]]) -> None:
+        """Train the tokenizer using an iterator of strings or batches of strings."""
 
         self._tokenizer.train_from_iterator(
             iterator,
@@ -51,6 +64,13 @@ class CodeTokenizer:
             special_tokens=self.config.special_tokens or [],
         )
 
+    def tokens_per_byte(self, texts: Sequence[str]) -> float:
+        """Average number of tokens per UTF-8 byte over ``texts`` (lower is better)."""
+
+        num_bytes = sum(len(text.encode("utf-8")) for text in texts)
+        num_tokens = sum(len(encoding.ids) for encoding in self._tokenizer.encode_batch(list(texts)))
+        return num_tokens / num_bytes if num_bytes else 0.0
+
     def save(self, directory: str | Path) -> CodeTokenizerState:
         directory = Path(directory)
         directory.mkdir(parents=True, exist_ok=True)
@@ -87,8 +107,69 @@ class CodeTokenizer:
         return tokenizer
 
 
-def build_custom_tokenizer(config: TokenizerConfig, corpus: Optional[Iterable[str]] = None) -> PreTrainedTokenizerFast:
-    """Utility function to train a custom tokenizer when no checkpoint is provided."""
+def _batched(texts: Sequence[str], batch_size: int) -> Iterator[List[str]]:
+    for start in range(0, len(texts), batch_size):
+        yield list(texts[start : start + batch_size])
+
+
+def train_with_convergence_report(
+    config: TokenizerConfig,
+    sample: Sequence[str],
+    holdout: Sequence[str],
+) -> tuple[CodeTokenizer, List[CompressionPoint]]:
+    """Train on doubling prefixes of the ``sample`` chunks and measure held-out compression.
+
+    The last (full-sample) tokenizer is returned together with one
+    :class:`CompressionPoint` per prefix; a flat curve means a smaller sample
+    would already match full-sample quality. Without a ``holdout`` there is
+    nothing to measure, so only the full-sample tokenizer is trained.
+    """
+
+    steps = max(1, config.convergence_steps) if holdout else 1
+    sizes = sorted({max(1, len(sample) >> (steps - 1 - step)) for step in range(steps)})
+    points: List[CompressionPoint] = []
+    builder = CodeTokenizer(config)
+    for size in sizes:
+        builder = CodeTokenizer(config)
+        builder.train_from_iterator(_batched(sample[:size], config.sample_batch_size))
+        if not holdout:
+            continue
+        point = CompressionPoint(
+            chunks=size,
+            sample_bytes=sum(len(text.encode("utf-8")) for text in sample[:size]),
+            tokens_per_byte=builder.tokens_per_byte(holdout),
+        )
+        points.append(point)
+        LOGGER.info(
+            "Tokenizer sample of %d chunks (%d bytes): %.4f tokens/byte on %d held-out chunks",
+            point.chunks,
+            point.sample_bytes,
+            point.tokens_per_byte,
+            len(holdout),
+        )
+    return builder, points
+
+
+def build_custom_tokenizer(
+    config: TokenizerConfig,
+    corpus: Optional[Iterable[str] | Iterable[List[str]]] = None,
+    holdout: Optional[Sequence[str]] = None,
+) -> PreTrainedTokenizerFast:
+    """Utility function to train a custom tokenizer when no checkpoint is provided.
+
+    Passing ``holdout`` marks ``corpus`` as an in-memory sample: the tokenizer
+    is trained by :func:`train_with_convergence_report` and the compression
+    curve is written next to the tokenizer as ``sample_report.json``.
+    """
+
+    if holdout is not None:
+        if corpus is None:
+            raise ValueError("A sample corpus is required alongside ``holdout``.")
+        tokenizer_builder, points = train_with_convergence_report(config, list(corpus), holdout)
+        tokenizer_builder.save(Path(config.serialization_dir))
+        report = Path(config.serialization_dir) / "sample_report.json"
+        report.write_text(json.dumps([asdict(point) for point in points], indent=2))
+        return tokenizer_builder.to_hf()
 
     tokenizer_builder = CodeTokenizer(config)
     if config.train_files:
@@ -96,7 +177,7 @@ def build_custom_tokenizer(config: TokenizerConfig, corpus: Optional[Iterable[st
     elif corpus is not None:
         tokenizer_builder.train_from_iterator(corpus)
     else:
-        raise ValueError("Either ``train_files`` or an in-memory corpus must be provided.")
+        raise ValueError("Either ``train_files`` or a corpus iterator must be provided.")
 
     tokenizer_builder.save(Path(config.serialization_dir))
     return tokenizer_builder.to_hf()
@@ -2,60 +2,143 @@
 from __future__ import annotations
 
 import logging
+import os
+import random
+from dataclasses import replace
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Callable, Iterable, List, Optional, Tuple
 
-from datasets import Dataset
+from datasets import Dataset, concatenate_datasets
+from torch.utils.data import DataLoader
 from transformers import Trainer, TrainingArguments
 
+from .cache import ArtifactCache, fingerprint, tokenizer_fingerprint
 from .config import DatasetConfig, TrainingConfig, default_training_config
 from .chunker import CodeChunker
-from .data import MixedDataset, interleave_weighted, load_mixed_datasets
-from .modeling import build_model, build_tokenizer
+from .collator import CausalLMCollator, TokenBudgetBatchSampler, sequence_lengths
+from .data import (
+    MixedDataset,
+    interleave_streaming,
+    interleave_weighted,
+    load_mixed_datasets,
+    stratified_reservoir_sample,
+)
+from .dedup import ExactDedupIndex, MinHashDeduplicator
+from .manifest import manifest_fingerprint
+from .metrics import RunMetrics, ThroughputMonitor
+from .modeling import CHECKPOINT_TOKENIZER_DIR, build_model, build_tokenizer
+from .packing import pack_dataset
+from .pipeline import iter_text_batches, prepare_corpus, write_corpus
 from .preprocess import CodePreprocessor
+from .resume import DataStateCallback, data_state_for, load_checkpoint_data
+from .shards import TokenShardDataset, is_token_shard, write_token_shard
 
 LOGGER = logging.getLogger(__name__)
 
 
-def _prepare_corpus(
+def _tokenize_dataset(
     dataset: Dataset,
-    preprocessor: CodePreprocessor,
-    chunker: CodeChunker,
+    tokenizer,
     text_column: str = "text",
-    code_column: Optional[str] = "code",
-) -> List[str]:
-    """Produce a list of normalized + chunked samples ready for tokenization."""
+    cache_file_name: Optional[str] = None,
+    chunker: Optional[CodeChunker] = None,
+) -> Dataset:
+    """Tokenize the dataset into causal LM inputs.
 
-    prepared: List[str] = []
-    for item in dataset:
-        text = item.get(text_column, "")
-        code = item.get(code_column, "") if code_column else ""
-        normalized = preprocessor(text, code)
-        for chunk in chunker(normalized):
-            prepared.append(chunk)
-    return prepared
-
-
-def _tokenize_dataset(dataset: Dataset, tokenizer, text_column: str = "text") -> Dataset:
-    """Tokenize the dataset into causal LM inputs."""
+    Only ``input_ids`` are stored; :class:`CausalLMCollator` derives the
+    attention mask and labels at batch time. With a token-mode ``chunker`` each
+    document is tokenized whole and split into token windows, and the
+    overlapping prefix of every window is recorded in ``ignore_spans`` so it is
+    excluded from the loss.
+    """
 
     def _map_batch(batch: dict) -> dict:
         encodings = tokenizer(
             batch[text_column],
             truncation=True,
             max_length=tokenizer.model_max_length,
+            return_attention_mask=False,
         )
-        encodings["labels"] = [ids[:] for ids in encodings["input_ids"]]
-        return encodings
+        return {"input_ids": encodings["input_ids"]}
 
+    def _map_windows(batch: dict) -> dict:
+        max_tokens = chunker.config.max_tokens or tokenizer.model_max_length
+        encodings = tokenizer(
+            batch[text_column],
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+        )
+        windows: dict = {"input_ids": [], "ignore_spans": []}
+        for text, ids, offsets in zip(batch[text_column], encodings["input_ids"], encodings["offset_mapping"]):
+            for window in chunker.token_windows(text, offsets, max_tokens):
+                windows["input_ids"].append(ids[window.start : window.end])
+                windows["ignore_spans"].append([0, window.masked_prefix] if window.masked_prefix else [])
+        return windows
+
+    token_mode = chunker is not None and chunker.config.mode == "tokens"
     return dataset.map(
-        _map_batch,
+        _map_windows if token_mode else _map_batch,
         batched=True,
         remove_columns=dataset.column_names,
+        cache_file_name=cache_file_name,
+        load_from_cache_file=False,
         desc="Tokenizing",
     )
 
 
+class CodexTrainer(Trainer):
+    """``Trainer`` that can batch by a token budget instead of a fixed size.
+
+    With a ``throughput`` monitor, the non-padding tokens of every micro-batch
+    are counted and step time, tokens/s and MFU are added to each log entry.
+    """
+
+    def __init__(
+        self,
+        *args,
+        max_tokens_per_batch: Optional[int] = None,
+        seed: int = 42,
+        throughput: Optional[ThroughputMonitor] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.sampler_seed = seed
+        self.throughput = throughput
+        if throughput is not None:
+            self.add_callback(throughput)
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        if self.throughput is not None:
+            mask = inputs.get("attention_mask")
+            # Kept as a tensor: converting here would synchronise with the device every micro-batch.
+            self.throughput.add_tokens(mask.sum() if mask is not None else inputs["input_ids"].numel())
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def log(self, logs: dict, *args, **kwargs) -> None:
+        if self.throughput is not None and "loss" in logs:
+            logs.update(self.throughput.log_values())
+        super().log(logs, *args, **kwargs)
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self.max_tokens_per_batch is None:
+            return super().get_train_dataloader()
+        batch_sampler = TokenBudgetBatchSampler(
+            sequence_lengths(self.train_dataset),
+            max_tokens=self.max_tokens_per_batch,
+            seed=self.sampler_seed,
+        )
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
+
+
 def build_training_arguments(config: TrainingConfig) -> TrainingArguments:
     gradient_accumulation_steps = config.gradient_accumulation_steps or (
         config.total_batch_size // config.micro_batch_size
@@ -76,54 +159,416 @@ def build_training_arguments(config: TrainingConfig) -> TrainingArguments:
         bf16=config.mixed_precision == "bf16",
         fp16=config.mixed_precision == "fp16",
         max_steps=config.num_train_steps,
-        gradient_checkpointing=True,
+        gradient_checkpointing=config.model.gradient_checkpointing,
+        # Packing metadata such as ``ignore_spans`` must reach the collator.
+        remove_unused_columns=False,
         report_to=["tensorboard"],
         resume_from_checkpoint=config.resume_from_checkpoint,
     )
 
 
-def train(config: TrainingConfig | None = None) -> None:
-    """Main training orchestration function."""
+def _load_records(config: TrainingConfig, exact_index: Optional[ExactDedupIndex] = None) -> Iterable[dict]:
+    """Load every configured source and mix them according to their weights."""
 
-    config = config or default_training_config()
-    Path(config.output_dir).mkdir(parents=True, exist_ok=True)
+    LOGGER.info("Preparing datasets…")
+    mixed_configs: Iterable[DatasetConfig] = config.datasets
+    datasets: Iterable[MixedDataset] = load_mixed_datasets(mixed_configs, exact_index=exact_index)
+    if any(cfg.streaming for cfg in config.datasets):
+        return interleave_streaming(
+            list(datasets),
+            seed=config.seed,
+            buffer_size=config.shuffle_buffer_size,
+        )
+    return interleave_weighted(list(datasets))
+
+
+def _corpus_fingerprint(config: TrainingConfig) -> str:
+    # With an exact index, the corpus is whatever its committed ingests prepared.
+    if config.dedup.exact_index:
+        return fingerprint("corpus", ExactDedupIndex.state_fingerprint(config.dedup.exact_index))
+    streaming = any(cfg.streaming for cfg in config.datasets)
+    mixing = (config.seed, config.shuffle_buffer_size) if streaming else None
+    dedup = config.dedup if config.dedup.enabled else None
+    # A manifest path can be re-released in place; key on its content too.
+    manifests = [manifest_fingerprint(cfg.manifest) for cfg in config.datasets if cfg.manifest]
+    return fingerprint("corpus", config.datasets, mixing, config.preprocessor, dedup, config.chunker, manifests)
+
+
+def _record_bytes(record: dict) -> int:
+    return sum(len(value.encode()) for value in record.values() if isinstance(value, str))
+
+
+def _prepared_chunks(config: TrainingConfig, records: Iterable[dict], metrics: RunMetrics) -> Iterable[str]:
+    """Preprocess, near-dedup and chunk metered ``records``, metering the chunks as ``preprocess_chunk``."""
 
     LOGGER.info("Preparing preprocessing pipeline…")
     preprocessor = CodePreprocessor(config.preprocessor)
     chunker = CodeChunker(config.chunker)
 
-    LOGGER.info("Preparing datasets…")
-    mixed_configs: Iterable[DatasetConfig] = config.datasets
-    datasets: Iterable[MixedDataset] = load_mixed_datasets(mixed_configs)
-    combined_dataset = interleave_weighted(list(datasets))
-
     LOGGER.info("Normalizing and chunking corpus…")
-    corpus = _prepare_corpus(
-        combined_dataset,
-        preprocessor=preprocessor,
-        chunker=chunker,
+    deduplicator = MinHashDeduplicator(config.dedup) if config.dedup.enabled else None
+    return metrics.meter(
+        "preprocess_chunk",
+        prepare_corpus(records, preprocessor=preprocessor, chunker=chunker, deduplicator=deduplicator),
+        size=lambda chunk: len(chunk.encode()),
+        upstream="load",
     )
 
-    LOGGER.info("Loading tokenizer…")
-    tokenizer = build_tokenizer(config.tokenizer, corpus=corpus)
 
-    prepared_dataset = Dataset.from_dict({"text": corpus})
+def _build_corpus(
+    config: TrainingConfig,
+    cache: Optional[ArtifactCache],
+    corpus_key: str,
+    metrics: RunMetrics,
+) -> Dataset:
+    """Return the prepared corpus, reusing a cached copy when one exists.
+
+    Loading and preprocessing/chunking are metered as the ``load`` and
+    ``preprocess_chunk`` stages while the corpus is written.
+    """
+
+    if cache is not None and (hit := cache.get("corpus", corpus_key)) is not None:
+        return Dataset.from_file(str(hit / "prepared.arrow"))
+
+    records = metrics.meter("load", _load_records(config), size=_record_bytes)
+    chunks = _prepared_chunks(config, records, metrics)
+    if cache is None:
+        return write_corpus(
+            chunks,
+            Path(config.output_dir) / "corpus" / "prepared.arrow",
+            writer_batch_size=config.writer_batch_size,
+        )
+    with cache.stage("corpus", corpus_key, description=", ".join(cfg.name for cfg in config.datasets)) as scratch:
+        write_corpus(chunks, scratch / "prepared.arrow", writer_batch_size=config.writer_batch_size)
+    return Dataset.from_file(str(cache.path("corpus", corpus_key) / "prepared.arrow"))
+
+
+def _source_fingerprint(config: DatasetConfig) -> str:
+    return fingerprint("source", manifest_fingerprint(config.manifest), config.text_column, config.code_column)
+
+
+def _ingest_corpus(config: TrainingConfig, metrics: RunMetrics) -> Dataset:
+    """Ingest the manifest sources into ``dedup.exact_index`` and return every corpus it holds.
+
+    Records the index already holds are skipped while loading; the rest are
+    prepared into this ingest's corpus file, which the index adopts when it
+    commits. The training corpus concatenates the files of all committed
+    ingests, so a rerun, or a release with nothing new, trains on the same
+    rows, and a release with new records adds them to the earlier ones.
+    Manifests that a committed ingest already read are not read again.
+    """
+
+    exact_index = ExactDedupIndex(
+        config.dedup.exact_index,
+        capacity=config.dedup.exact_index_capacity,
+        bloom_bits_per_key=config.dedup.bloom_bits_per_key,
+    )
+    preparation = fingerprint("preparation", config.preprocessor, config.chunker)
+    if exact_index.preparation not in (None, preparation):
+        raise ValueError(
+            f"Exact dedup index {exact_index.directory} holds records prepared with other preprocessor or "
+            "chunker settings; point dedup.exact_index at a new directory to prepare them again."
+        )
+    sources = [_source_fingerprint(cfg) for cfg in config.datasets if cfg.manifest]
+    if all(exact_index.ingested(source) for source in sources):
+        LOGGER.info("Every manifest is already ingested into %s; reusing its corpus.", exact_index.directory)
+    else:
+        records = metrics.meter("load", _load_records(config, exact_index), size=_record_bytes)
+        path = exact_index.corpus_path()
+        scratch = path.with_suffix(".tmp")
+        written = len(write_corpus(_prepared_chunks(config, records, metrics), scratch, config.writer_batch_size))
+        if written:
+            os.replace(scratch, path)
+        else:
+            scratch.unlink()
+        exact_index.commit(path if written else None, sources=sources, preparation=preparation)
+
+    corpora = exact_index.corpora()
+    if not corpora:
+        raise ValueError(f"Exact dedup index {exact_index.directory} holds no prepared records yet.")
+    return concatenate_datasets([Dataset.from_file(str(path)) for path in corpora])
+
+
+def _sample_records(config: TrainingConfig, total: int, scan_limit: Optional[int] = None) -> List[dict]:
+    """Draw a weight-stratified sample of ``total`` source records, shuffled with ``config.seed``."""
+
+    samples = stratified_reservoir_sample(
+        load_mixed_datasets(config.datasets),
+        total=total,
+        seed=config.seed,
+        scan_limit=scan_limit,
+    )
+    records = [record for source in samples for record in source]
+    random.Random(config.seed).shuffle(records)
+    LOGGER.info("Sampled %d records from %d sources", len(records), len(samples))
+    return records
+
+
+def _prepare_texts(config: TrainingConfig, records: List[dict]) -> List[str]:
+    """Preprocess and chunk ``records`` in memory; the chunks come back shuffled with ``config.seed``."""
+
+    texts = list(
+        prepare_corpus(
+            records,
+            preprocessor=CodePreprocessor(replace(config.preprocessor, num_workers=1)),
+            chunker=CodeChunker(config.chunker),
+        )
+    )
+    random.Random(config.seed).shuffle(texts)
+    return texts
+
+
+def _sample_tokenizer_corpus(config: TrainingConfig, metrics: RunMetrics) -> Tuple[List[str], List[str]]:
+    """Draw the tokenizer training sample and split off a held-out set.
+
+    The split is made on source records before chunking, so no document has
+    chunks on both sides and the holdout compression is not inflated.
+    """
+
+    tokenizer_config = config.tokenizer
+    with metrics.stage("tokenizer_sample") as stage:
+        records = _sample_records(
+            config,
+            total=tokenizer_config.sample_documents + tokenizer_config.holdout_documents,
+            scan_limit=tokenizer_config.sample_scan_limit,
+        )
+        holdout_size = min(tokenizer_config.holdout_documents, len(records) // 2)
+        holdout = _prepare_texts(config, records[:holdout_size])
+        sample = _prepare_texts(config, records[holdout_size:])
+        stage.records += len(sample) + len(holdout)
+        stage.bytes += sum(len(text.encode()) for text in sample + holdout)
+    LOGGER.info(
+        "Holding out %d documents (%d chunks) to measure tokenizer compression; training on %d chunks",
+        holdout_size,
+        len(holdout),
+        len(sample),
+    )
+    return sample, holdout
+
+
+def _train_tokenizer(config: TrainingConfig, corpus: Callable[[], Dataset], metrics: RunMetrics):
+    if config.tokenizer.sample_documents:
+        sample, holdout = _sample_tokenizer_corpus(config, metrics)
+        return build_tokenizer(config.tokenizer, corpus=sample, holdout=holdout)
+    return build_tokenizer(
+        config.tokenizer,
+        corpus=iter_text_batches(corpus(), batch_size=config.writer_batch_size),
+    )
+
+
+def _build_tokenizer(
+    config: TrainingConfig,
+    cache: Optional[ArtifactCache],
+    corpus_key: str,
+    corpus: Callable[[], Dataset],
+    metrics: RunMetrics,
+):
+    """Load or train the tokenizer; trained tokenizers are cached by corpus."""
+
+    if not config.tokenizer.use_custom:
+        return build_tokenizer(config.tokenizer)
+    if cache is None:
+        return _train_tokenizer(config, corpus, metrics)
+
+    tokenizer_key = fingerprint("tokenizer", corpus_key, config.tokenizer)
+    hit = cache.get("tokenizer", tokenizer_key)
+    if hit is not None:
+        return build_tokenizer(replace(config.tokenizer, use_custom=False, pretrained=str(hit)))
+
+    tokenizer = _train_tokenizer(config, corpus, metrics)
+    with cache.stage("tokenizer", tokenizer_key, description=f"vocab={len(tokenizer)}") as scratch:
+        tokenizer.save_pretrained(str(scratch))
+    return tokenizer
+
+
+def _write_training_data(
+    config: TrainingConfig,
+    corpus: Dataset,
+    tokenizer,
+    directory: Path,
+) -> Path:
+    """Tokenize (and optionally pack) ``corpus`` into ``directory/tokenized.arrow``."""
+
+    target = directory / "tokenized.arrow"
+    if not config.packing.enabled:
+        _tokenize_dataset(corpus, tokenizer=tokenizer, cache_file_name=str(target), chunker=CodeChunker(config.chunker))
+        return target
+
+    unpacked = directory / "unpacked.arrow"
+    tokenized = _tokenize_dataset(
+        corpus,
+        tokenizer=tokenizer,
+        cache_file_name=str(unpacked),
+        chunker=CodeChunker(config.chunker),
+    )
+    pack_dataset(tokenized, config.packing, tokenizer, target, writer_batch_size=config.writer_batch_size)
+    unpacked.unlink()
+    return target
+
+
+def _build_tokenized(
+    config: TrainingConfig,
+    cache: Optional[ArtifactCache],
+    corpus_key: str,
+    corpus: Callable[[], Dataset],
+    tokenizer,
+) -> Dataset:
+    """Tokenize the corpus, reusing a cached copy keyed on the vocabulary."""
+
+    if cache is None:
+        directory = Path(config.output_dir) / "tokenized"
+        directory.mkdir(parents=True, exist_ok=True)
+        return Dataset.from_file(str(_write_training_data(config, corpus(), tokenizer, directory)))
+
+    packing = config.packing if config.packing.enabled else None
+    tokenized_key = fingerprint(
+        "tokenized", corpus_key, config.tokenizer, tokenizer_fingerprint(tokenizer), packing
+    )
+    hit = cache.get("tokenized", tokenized_key)
+    if hit is None:
+        description = f"vocab={len(tokenizer)}" + (" packed" if packing else "")
+        with cache.stage("tokenized", tokenized_key, description=description) as scratch:
+            _write_training_data(config, corpus(), tokenizer, scratch)
+        hit = cache.path("tokenized", tokenized_key)
+    return Dataset.from_file(str(hit / "tokenized.arrow"))
 
-    tokenized = _tokenize_dataset(prepared_dataset, tokenizer=tokenizer)
 
-    LOGGER.info("Instantiating model…")
-    model = build_model(config.model, tokenizer)
+def _write_token_shards(config: TrainingConfig, dataset: Dataset, tokenizer) -> TokenShardDataset:
+    """Export tokenized rows (and the tokenizer) as a memory-mapped token shard."""
 
-    LOGGER.info("Starting trainer…")
-    training_args = build_training_arguments(config)
-    trainer = Trainer(
-        model=model,
-        args=training_args,
-        train_dataset=tokenized,
+    directory = Path(config.token_shards)
+    LOGGER.info("Writing token shard to %s…", directory)
+    write_token_shard(
+        dataset,
+        directory,
+        vocab_size=len(tokenizer),
+        eos_token_id=tokenizer.eos_token_id,
+        packed=config.packing.enabled,
+        reset_position_ids=config.packing.enabled and config.packing.reset_position_ids,
+        document_attention=config.packing.enabled and config.packing.document_attention,
     )
+    tokenizer.save_pretrained(str(directory / "tokenizer"))
+    return TokenShardDataset(directory)
+
+
+def _prepare_training_data(config: TrainingConfig, metrics: Optional[RunMetrics] = None):
+    """Return ``(tokenizer, train_dataset)``, running the data pipeline if needed.
+
+    When resuming from a checkpoint that recorded its training rows, those
+    rows and the checkpoint's tokenizer are reused and nothing is prepared.
+    """
+
+    metrics = metrics or RunMetrics(config.metrics)
+    if config.resume_from_checkpoint:
+        with metrics.stage("resume_data") as stage:
+            resumed = load_checkpoint_data(config)
+            if resumed is not None:
+                stage.records = len(resumed[1])
+        if resumed is not None:
+            return resumed
+
+    if config.token_shards and is_token_shard(config.token_shards):
+        LOGGER.info("Loading token shard from %s…", config.token_shards)
+        with metrics.stage("tokenizer"):
+            tokenizer_dir = Path(config.token_shards) / "tokenizer"
+            tokenizer = build_tokenizer(replace(config.tokenizer, use_custom=False, pretrained=str(tokenizer_dir)))
+        with metrics.stage("token_shards") as stage:
+            dataset = TokenShardDataset(config.token_shards)
+            stage.records, stage.tokens = len(dataset), int(sequence_lengths(dataset).sum())
+        return tokenizer, dataset
+
+    cache = ArtifactCache(config.cache_dir, max_bytes=config.cache_max_bytes) if config.cache_dir else None
+    prepared: List[Dataset] = []
+    if config.dedup.exact_index:
+        # The ingest decides what the corpus holds, so it runs before the corpus is keyed.
+        with metrics.stage("corpus") as stage:
+            prepared.append(_ingest_corpus(config, metrics))
+            stage.records = len(prepared[0])
+    corpus_key = _corpus_fingerprint(config)
+
+    def corpus() -> Dataset:
+        # Only built when a downstream stage misses the cache.
+        if not prepared:
+            with metrics.stage("corpus") as stage:
+                prepared.append(_build_corpus(config, cache, corpus_key, metrics))
+                stage.records = len(prepared[0])
+        return prepared[0]
+
+    LOGGER.info("Loading tokenizer…")
+    with metrics.stage("tokenizer"):
+        tokenizer = _build_tokenizer(config, cache, corpus_key, corpus, metrics)
+
+    with metrics.stage("tokenize") as stage:
+        tokenized = _build_tokenized(config, cache, corpus_key, corpus, tokenizer)
+        stage.records, stage.tokens = len(tokenized), int(sequence_lengths(tokenized).sum())
+    if config.token_shards:
+        with metrics.stage("token_shards") as stage:
+            shards = _write_token_shards(config, tokenized, tokenizer)
+            stage.records, stage.tokens = len(shards), int(sequence_lengths(shards).sum())
+        return tokenizer, shards
+    return tokenizer, tokenized
+
+
+def train(config: TrainingConfig | None = None) -> None:
+    """Main training orchestration function.
+
+    Every stage is timed and counted by :class:`RunMetrics`; the JSON run
+    report is written even when a stage fails.
+    """
+
+    config = config or default_training_config()
+    Path(config.output_dir).mkdir(parents=True, exist_ok=True)
+    metrics = RunMetrics(config.metrics)
+    report_path = config.metrics.report_path or str(Path(config.output_dir) / "run_report.json")
+    training_args = None
+
+    try:
+        tokenizer, train_dataset = _prepare_training_data(config, metrics)
+
+        LOGGER.info("Instantiating model…")
+        with metrics.stage("model"):
+            model = build_model(config.model, tokenizer)
+
+        LOGGER.info("Starting trainer…")
+        training_args = build_training_arguments(config)
+        collator = CausalLMCollator(
+            pad_token_id=tokenizer.pad_token_id,
+            keep_segment_ids=config.model.use_custom_architecture,
+        )
+        throughput = ThroughputMonitor(
+            num_parameters=sum(parameter.numel() for parameter in model.parameters()),
+            peak_tflops=config.metrics.peak_tflops,
+            num_devices=training_args.world_size,
+        )
+        trainer = CodexTrainer(
+            model=model,
+            args=training_args,
+            train_dataset=train_dataset,
+            data_collator=collator,
+            max_tokens_per_batch=config.max_tokens_per_batch,
+            seed=config.seed,
+            throughput=throughput,
+        )
+        data_state = data_state_for(config, train_dataset)
+        if data_state is not None:
+            trainer.add_callback(DataStateCallback(data_state, tokenizer))
 
-    trainer.train(resume_from_checkpoint=config.resume_from_checkpoint)
-    trainer.save_model(config.output_dir)
+        with metrics.stage("train") as stage:
+            try:
+                trainer.train(resume_from_checkpoint=config.resume_from_checkpoint)
+            finally:
+                metrics.training = throughput.summary()
+                stage.records, stage.tokens = metrics.training["steps"], metrics.training["tokens"]
+        with metrics.stage("save"):
+            trainer.save_model(config.output_dir)
+            tokenizer.save_pretrained(str(Path(config.output_dir) / CHECKPOINT_TOKENIZER_DIR))
+    finally:
+        metrics.close()
+        metrics.write_report(report_path)
+        if config.metrics.tensorboard:
+            # ``logging_dir`` is gone from newer ``TrainingArguments``; their TensorBoard runs live under ``output_dir/runs``.
+            log_dir = getattr(training_args, "logging_dir", None) or Path(config.output_dir) / "runs" / "pipeline"
+            metrics.write_tensorboard(log_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,39 @@
+import random
+
+from src.training.chunker import CodeChunker
+from src.training.config import ChunkerConfig
+
+
+def _char_offsets(text):
+    return [(index, index + 1) for index in range(len(text))]
+
+
+def _assert_valid(windows, num_tokens):
+    assert windows[0].start == 0
+    assert windows[-1].end == num_tokens
+    for previous, window in zip(windows, windows[1:]):
+        assert previous.start < window.start <= previous.end
+        assert window.start + window.masked_prefix == previous.end
+    for window in windows:
+        assert 0 <= window.masked_prefix <= window.end - window.start
+
+
+def test_line_break_just_past_start_does_not_move_backwards():
+    text = "import os\n" + "x=[" + "1," * 3000 + "]\n"
+    chunker = CodeChunker(ChunkerConfig(mode="tokens", overlap_tokens=128, max_tokens=1024))
+    windows = list(chunker.token_windows(text, _char_offsets(text), 1024))
+    _assert_valid(windows, len(text))
+    # A hard cut beats a 9-token window ending at the first line break.
+    assert windows[0].end == 1024
+
+
+def test_token_windows_invariants_on_random_documents():
+    rng = random.Random(0)
+    for _ in range(200):
+        lines = ["".join(rng.choice("ab ") for _ in range(rng.choice([1, 3, 40, 400]))) for _ in range(rng.randrange(1, 30))]
+        text = "\n".join(lines)
+        max_tokens = rng.choice([16, 64, 256])
+        overlap = rng.randrange(0, max_tokens)
+        boundary = rng.choice(["line", "definition"])
+        chunker = CodeChunker(ChunkerConfig(mode="tokens", max_tokens=max_tokens, overlap_tokens=overlap, boundary=boundary))
+        _assert_valid(list(chunker.token_windows(text, _char_offsets(text), max_tokens)), len(text))